@@ -1,28 +1,158 @@
 import machine
 import time
+import uasyncio as asyncio
 import ujson
+import httpclient
+import outbox
+import wireformat
+from sampler import make_sampler
+from samplebuffer import zeros, HeapMonitor
+
+# API
+SERVER_IP = "192.168.3.181"
+SERVER_PORT = 5000
+EKG_STREAM_PATH = "/api/ekg-stream"
 
 adc = machine.ADC(26)  # ADC pin
-WINDOW_SIZE = 200  
+SAMPLE_RATE = 250  # Hz, sampled on core 1 (or a timer)
+DURATION = 10  # seconds of recorded EKG
+WINDOW_SIZE = SAMPLE_RATE * DURATION
 INIT_IGNORE_TIME = 10  # ignore time bandpass filter
+CHUNK_SECONDS = 1  # streamed recording is uploaded in chunks of this length
+DEVICE_ID = wireformat.device_id()
 
-def measure_ekg():
-    print("EKG starts.")
-    
-    start_time = time.time()
+def read_adc(buf, i):
+    buf[i] = adc.read_u16()
 
+# Warm-up: keep the sampler running until the bandpass filter has settled
+async def settle(sampler):
+    start_time = time.time()
     while time.time() - start_time < INIT_IGNORE_TIME:
-        adc.read_u16()  
-        time.sleep(0.05)  
+        sampler.discard()
+        await asyncio.sleep_ms(100)
+    sampler.discard()
+    sampler.overruns = 0
+    sampler.late = 0
+
+async def measure_ekg(sample_rate=SAMPLE_RATE, window_size=WINDOW_SIZE):
+    print("EKG starts.")
+
+    # Ring buffer holds 1 s of samples, drained into the window while sampling
+    sampler = make_sampler(read_adc, sample_rate, sample_rate)
+    sampler.start()
+
+    await settle(sampler)
 
     print("EKG starts...")
 
-    ekg_data = []
+    ekg_data = zeros('H', window_size)
+    ticks = zeros('I', window_size)
+    heap = HeapMonitor("EKG")
+    heap.start()
+    count = 0
+
+    while count < window_size:
+        count += sampler.drain(ekg_data, ticks, count)
+        heap.sample()
+        await asyncio.sleep_ms(20)
 
-    while len(ekg_data) < WINDOW_SIZE:
-        value = adc.read_u16()  
-        ekg_data.append(value)
-        time.sleep(0.05)  
+    sampler.stop()
+    heap.report()
+
+    elapsed = time.ticks_diff(ticks[window_size - 1], ticks[0])
+    if elapsed > 0:
+        print(f"EKG rate: {(window_size - 1) * 1000000 / elapsed:.1f} Hz, overruns: {sampler.overruns}, late: {sampler.late}")
 
     print("EKG done.")
-    return ekg_data  
+    return list(ekg_data)
+
+
+# Upload one chunk (EKG sensor frame), returns the server reply or None when it could not
+# be sent; such a chunk waits in the outbox and is resent with its seq later. The server
+# orders chunks by seq, so each one is tried directly even while older uploads are queued
+async def send_chunk(client, stream, seq, frame, final):
+    try:
+        path = f"{EKG_STREAM_PATH}?stream={stream}&seq={seq}&final={1 if final else 0}"
+        response = await outbox.send(client, path, frame, direct=True)
+        if response is None:
+            return None
+        reply = response.json()
+        response.close()
+        return reply
+    except Exception as e:
+        print(f"Error sending chunk {seq}:", e)
+        return None
+
+async def stream_ekg(chunk_seconds=CHUNK_SECONDS):
+    """
+    Record for the duration and rate the server asks for, uploading numbered
+    chunks while recording. Memory use depends on the chunk length only: the
+    sampler ring, one chunk array and at most two encoded chunks in flight.
+    """
+    client = httpclient.async_client(SERVER_IP, SERVER_PORT, "uploads")
+    response = await client.get(EKG_STREAM_PATH)
+    settings = response.json()
+    response.close()
+    if not settings.get("success"):
+        print("No EKG stream:", settings.get("message"))
+        return False
+
+    stream = settings["stream"]
+    sample_rate = settings["sampleRate"]
+    total = settings["duration"] * sample_rate
+    chunk_size = chunk_seconds * sample_rate
+    print(f"EKG stream {stream}: {settings['duration']} s at {sample_rate} Hz")
+
+    sampler = make_sampler(read_adc, sample_rate, 2 * chunk_size)
+    chunk = zeros('H', chunk_size)
+    ticks = zeros('I', chunk_size)
+    sampler.start()
+
+    try:
+        await settle(sampler)
+        print("EKG starts...")
+
+        heap = HeapMonitor("EKG")
+        heap.start()
+        seq = 0
+        sent = 0
+        failed = 0
+        upload = None
+
+        while sent < total:
+            wanted = min(chunk_size, total - sent)
+            n = 0
+            while n < wanted:
+                n += sampler.drain(chunk, ticks, n)
+                heap.sample()
+                if n < wanted:
+                    await asyncio.sleep_ms(20)
+
+            # Chunk N uploads while chunk N+1 is recorded
+            if upload:
+                reply = await upload
+                if reply is None:
+                    failed += 1
+                elif reply.get("done"):
+                    print("Server stopped the EKG stream.")
+                    return False
+
+            sent += n
+            final = sent >= total
+            frame = wireformat.encode(wireformat.SENSOR_EKG, (chunk[:n],), sample_rate,
+                                      start_tick=ticks[0], device_id=DEVICE_ID, varint=True)
+            upload = asyncio.create_task(send_chunk(client, stream, seq, frame, final))
+            seq += 1
+
+        reply = await upload
+    finally:
+        sampler.stop()
+
+    heap.report()
+    print(f"EKG stream: {sent} samples in {seq} chunks, {failed} failed, "
+          f"overruns {sampler.overruns}, late {sampler.late}")
+    if reply is None:
+        return False
+    if reply.get("missing"):
+        print("Server is missing chunks:", reply["missing"])
+    return reply.get("success", False)
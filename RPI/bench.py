@@ -0,0 +1,356 @@
+# Device micro-benchmarks, run on the Pico: import bench; bench.circular_buffer()
+import gc
+import math
+import time
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:  # desktop Python
+    def ticks_us():
+        return int(time.perf_counter() * 1000000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+try:
+    from ucollections import deque
+except ImportError:
+    from collections import deque
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+try:
+    import ujson
+except ImportError:
+    import json as ujson
+
+import wireformat
+import spo2algorithm
+from circular_buffer import CircularBuffer
+from samplebuffer import zeros
+from tempestimator import TempEstimator
+import outbox
+
+
+# Previous deque based CircularBuffer, kept here for comparison
+class DequeCircularBuffer:
+    def __init__(self, max_size):
+        self.data = deque((), max_size)
+        self.max_size = max_size
+
+    def __len__(self):
+        return len(self.data)
+
+    def is_empty(self):
+        return not bool(self.data)
+
+    def append(self, item):
+        if len(self.data) >= self.max_size:
+            self.data.popleft()
+        self.data.append(item)
+
+    def pop_head(self):
+        if self.is_empty():
+            return None
+
+        temp_queue = deque((), self.max_size)
+
+        for _ in range(len(self.data)):
+            val = self.data.popleft()
+            temp_queue.append(val)
+
+        first_item = temp_queue.popleft()
+
+        self.data = temp_queue
+
+        return first_item
+
+
+def timed(name, fn, n):
+    start = ticks_us()
+    fn()
+    elapsed = ticks_diff(ticks_us(), start)
+    print(f"{name:<38} {elapsed / n:8.2f} us/op")
+
+
+def circular_buffer(sizes=(32, 256), n=2000):
+    for size in sizes:
+        bench_circular_buffer(size, n)
+
+
+def bench_circular_buffer(size, n):
+    for cls_name, make in (("deque", lambda: DequeCircularBuffer(size)),
+                           ("ring", lambda: CircularBuffer(size)),
+                           ("ring + min/max", lambda: CircularBuffer(size, extremes=True))):
+        buf = make()
+        cls_name = f"{cls_name} [{size}]"
+
+        def fill():
+            for i in range(n):
+                buf.append(i)
+
+        def fill_and_drain():
+            for i in range(n):
+                buf.append(i)
+                buf.append(i)
+                buf.pop_head()
+
+        timed(f"{cls_name} append", fill, n)
+        timed(f"{cls_name} append+pop_head", fill_and_drain, n)
+
+
+# Synthetic chunks shaped like the uploads: 16 bit EKG ADC, and MAX30102 counts + ICQUANZX at 50 Hz
+def ekg_chunk(n, rate=250):
+    return [int(32768 + 6000 * math.sin(i * 2 * math.pi / rate) ** 15 + (i * 7919) % 97) for i in range(n)]
+
+
+def bp_chunk(n, rate=50):
+    ticks = [1000 + i * 1000 // rate for i in range(n)]
+    ir = [int(50000 + 800 * math.sin(i * 2 * math.pi / rate)) + (i * 31) % 17 for i in range(n)]
+    red = [int(42000 + 600 * math.sin(i * 2 * math.pi / rate)) + (i * 13) % 11 for i in range(n)]
+    icq = [int(20000 + 3000 * math.sin((i - 12) * 2 * math.pi / rate)) for i in range(n)]
+    return ticks, ir, red, icq
+
+
+# JSON upload vs binary frame (raw, int16 delta and varint coded): size and encode rate, checks the round trip
+def wire_format(sizes=(25, 250), runs=20):
+    for n in sizes:
+        samples = ekg_chunk(n)
+        ticks, ir, red, icq = bp_chunk(n)
+
+        payloads = (
+            ("EKG json", lambda: ujson.dumps({"stream": "x", "seq": 0, "samples": samples, "final": False})),
+            ("EKG frame", lambda: wireformat.encode(wireformat.SENSOR_EKG, (samples,), 250)),
+            ("EKG frame varint", lambda: wireformat.encode(wireformat.SENSOR_EKG, (samples,), 250, varint=True)),
+            ("BP json", lambda: ujson.dumps({"timestamp": ticks, "max30102_ir": ir, "max30102_red": red,
+                                             "icquanzx": [v / 65535 for v in icq]})),
+            ("BP frame", lambda: wireformat.encode(wireformat.SENSOR_BP, (ir, red, icq), 50, ticks=ticks)),
+            ("BP frame delta", lambda: wireformat.encode(wireformat.SENSOR_BP, (ir, red, icq), 50,
+                                                         ticks=ticks, delta=True)),
+            ("BP frame varint", lambda: wireformat.encode(wireformat.SENSOR_BP, (ir, red, icq), 50,
+                                                          ticks=ticks, varint=True)),
+        )
+
+        for name, encode in payloads:
+            payload = encode()
+            if name.startswith("EKG frame"):
+                assert [list(c) for c in wireformat.decode(payload)[2]] == [samples]
+            elif name.startswith("BP frame"):
+                header, frame_ticks, channels = wireformat.decode(payload)
+                assert list(frame_ticks) == ticks and [list(c) for c in channels] == [ir, red, icq]
+
+            start = ticks_us()
+            for _ in range(runs):
+                encode()
+            elapsed = ticks_diff(ticks_us(), start)
+            rate = n * runs * 1000000 / elapsed if elapsed > 0 else 0
+            print(f"n={n:<4} {name:<17} {len(payload):>6} bytes  encode {elapsed / runs:9.1f} us "
+                  f"({rate:8.0f} samples/s)")
+
+
+# Synthetic 400 Hz MAX30102 window: ~1.2 Hz pulse on both channels
+def spo2_window(n=200, rate=400):
+    red = [int(40000 + 300 * math.sin(i * 2 * math.pi * 1.2 / rate)) + (i * 13) % 11 for i in range(n)]
+    ir = [int(50000 + 500 * math.sin(i * 2 * math.pi * 1.2 / rate)) + (i * 31) % 17 for i in range(n)]
+    return red, ir
+
+
+# List based process_spo2 vs the incremental SpO2Estimator: time and heap per window
+# (equal results are checked in src/test_spo2_batch.py)
+def spo2_estimator(n=200, runs=20):
+    red, ir = spo2_window(n)
+    estimator = spo2algorithm.SpO2Estimator()
+
+    def batch():
+        return spo2algorithm.process_spo2(red, ir)
+
+    def incremental():
+        estimator.reset()
+        for i in range(n):
+            estimator.add(red[i], ir[i])
+        return estimator.result()
+
+    for name, fn in (("process_spo2 lists", batch), ("SpO2Estimator", incremental)):
+        gc.collect()
+        free = gc.mem_free() if hasattr(gc, "mem_free") else 0
+        start = ticks_us()
+        for _ in range(runs):
+            fn()
+        elapsed = ticks_diff(ticks_us(), start)
+        used = free - gc.mem_free() if hasattr(gc, "mem_free") else 0
+        print(f"{name:<20} n={n}  {elapsed / runs:9.1f} us/window  heap {used / runs:8.0f} B/window")
+
+
+# Early signal quality gate on synthetic first windows (100 Hz FIFO rate):
+# which are aborted, and after how many samples instead of the full 200.
+# Checked once per 17-sample FIFO burst, like spo2.gather_samples.
+def spo2_quality(rate=100):
+    red, ir = spo2_window(200, rate)
+    cases = (
+        ("clean", red, ir),
+        ("clipped", [min(v * 6, 0x3FFFF) for v in red], [min(v * 6, 0x3FFFF) for v in ir]),
+        ("no finger", [v // 20 for v in red], [v // 20 for v in ir]),
+        ("flat", [40000 + i % 3 for i in range(200)], [50000 + i % 3 for i in range(200)]),
+        ("motion", red, [v + (15000 if 60 <= i < 90 else 0) for i, v in enumerate(ir)]),
+    )
+
+    estimator = spo2algorithm.SpO2Estimator()
+    for name, red_values, ir_values in cases:
+        estimator.reset()
+        reason = None
+        for i in range(len(red_values)):
+            estimator.add(red_values[i], ir_values[i])
+            if len(estimator) >= spo2algorithm.QUALITY_SAMPLES and len(estimator) % 17 == 0:
+                reason = spo2algorithm.signal_quality(estimator)
+                if reason:
+                    break
+        print(f"{name:<10} {reason or 'ok':<14} after {len(estimator)} samples")
+
+
+# Logged bodytemp sessions, one per file: the "Calculating: 36.50°C" lines printed by the
+# old fixed 40 s loop (one reading every ~2.75 s). Without files, synthetic probe curves.
+def bodytemp_sessions(paths, count=200):
+    if paths:
+        for path in paths:
+            with open(path) as f:
+                readings = [float(line.split(":")[1].split("°")[0]) for line in f if line.startswith("Calculating:")]
+            yield path, 2.75, 0.0625, readings
+        return
+
+    seed = 1
+    for i in range(count):
+        seed = (seed * 1103515245 + 12345) & 0x7FFFFFFF
+        eq = 35.8 + (seed % 1000) / 370
+        start = 22 + (seed // 1000 % 1000) / 100
+        tau = 3 + (seed // 1000000 % 1000) / 84
+        readings = []
+        for j in range(81):  # 0.5 s period, 11 bit steps
+            temp = eq - (eq - start) * math.exp(-j * 0.5 / tau)
+            readings.append(math.floor(temp / 0.125) * 0.125)
+        yield f"synthetic-{i}", 0.5, 0.125, readings
+
+
+# Replay through TempEstimator: stop time and error against the last (40 s) reading
+def bodytemp_replay(paths=()):
+    stops = []
+    errors = []
+    covered = 0
+    for name, period, step, readings in bodytemp_sessions(paths):
+        estimator = TempEstimator(period_s=period)
+        for temp in readings:
+            estimator.add(temp, step)
+            if estimator.converged():
+                break
+        error = estimator.estimate() - readings[-1]
+        stops.append(estimator.elapsed_s())
+        errors.append(abs(error))
+        covered += abs(error) <= estimator.bound()
+        if paths:
+            print(f"{name}: stop {estimator.elapsed_s():5.1f} s  {estimator.estimate():.2f} ± "
+                  f"{estimator.bound():.2f}°C  40 s reading {readings[-1]:.2f}°C")
+
+    stops.sort()
+    errors.sort()
+    n = len(stops)
+    print(f"{n} sessions  stop median {stops[n // 2]:.1f} s  p90 {stops[n * 9 // 10]:.1f} s  "
+          f"|error| median {errors[n // 2]:.2f} p90 {errors[n * 9 // 10]:.2f}°C  "
+          f"within bound {covered * 100 // n}%")
+
+
+class NullResponse:
+    status_code = 200
+
+    def close(self):
+        pass
+
+
+# Stands in for the server, so the drain rate is the flash read rate
+class NullClient:
+    def __init__(self):
+        self.received = []
+
+    async def post(self, path, body, content_type=None):
+        self.received.append(body[0])
+        return NullResponse()
+
+
+# Outbox flash append and drain rate for BP/EKG chunk sized records and a session result
+def outbox_queue(sizes=(200, 520, 4000), n=40, path="/bench_outbox"):
+    for size in sizes:
+        store = outbox.FlashQueue(path, slots=256, slot_size=256)
+        body = bytearray(size)
+
+        start = ticks_us()
+        appended = 0
+        while appended < n:
+            body[0] = appended
+            if not store.put("/api/live-bp", body):
+                break
+            appended += 1
+        append_us = ticks_diff(ticks_us(), start)
+
+        client = NullClient()
+        start = ticks_us()
+        drained = asyncio.run(store.drain(client))
+        drain_us = ticks_diff(ticks_us(), start)
+        assert client.received == list(range(appended)) and store.is_empty()
+
+        batched = 0
+        while batched < appended and store.put("/api/live-bp", body):
+            batched += 1
+        start = ticks_us()
+        asyncio.run(store.drain(NullClient(), commit_every=16))
+        batch_us = ticks_diff(ticks_us(), start)
+
+        store.close()
+        print(f"{size:>5} B records: append {append_us / appended:9.1f} us ({appended * size * 1000 / append_us:7.1f} kB/s)  "
+              f"drain {drain_us / drained:9.1f} us/record, {batch_us / batched:9.1f} us committing every 16")
+
+
+# Previous FIFO polling (sensor.check() on core 1 at 400 Hz), kept here for comparison
+async def gather_polled(sensor, sample_count):
+    from sampler import make_sampler
+
+    def read_fifo(buf, i):
+        if sensor.available() == 0:
+            sensor.check()
+            if sensor.available() == 0:
+                return False
+        buf[i] = sensor.get_red()
+        buf[i + 1] = sensor.get_ir()
+
+    sampler = make_sampler(read_fifo, 400, 64, channels=2, typecode='I', hard=False)
+    pairs = zeros('I', 128)
+    sensor.clear_fifo()
+    start = ticks_us()
+    sampler.start()
+    got = 0
+    try:
+        while got < sample_count:
+            got += sampler.drain(pairs)
+            await asyncio.sleep_ms(5)
+    finally:
+        sampler.stop()
+    elapsed = ticks_diff(ticks_us(), start)
+    print(f"polled  {got} samples in {elapsed // 1000} ms ({got * 1000000 / elapsed:.1f} Hz), "
+          f"dropped {sampler.overruns} (sampler overruns, sensor FIFO overflows not visible)")
+
+
+# MAX30102 sample rate and drops, polled FIFO vs interrupt-driven burst reads (needs the sensor)
+def spo2_fifo(sample_count=400):
+    import spo2
+
+    spo2.sensor.setup_sensor(led_mode=2, adc_range=16384, sample_rate=400, led_power=0xB0,
+                             sample_avg=4, pulse_width=411)
+    asyncio.run(gather_polled(spo2.sensor, sample_count))
+    asyncio.run(spo2.gather_samples(spo2.sensor, sample_count, quality_samples=0))
+
+
+if __name__ == "__main__":
+    circular_buffer()
+    wire_format()
+    spo2_estimator()
+    bodytemp_replay()
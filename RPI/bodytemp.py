@@ -2,6 +2,8 @@ import machine
 import onewire
 import ds18x20
 import time
+import uasyncio as asyncio
+from tempestimator import TempEstimator
 
 # DS18B20 sensor onewire connect
 ds_pin = machine.Pin(28)  
@@ -14,24 +16,63 @@ if not roms:
 else:
     print(f"✅ {len(roms)} DS18B20 found.")
 
-def get_bodytemp():
+# DS18B20 resolution: config register byte, conversion time (ms) and step (°C)
+RESOLUTIONS = {
+    9: (0x1F, 94, 0.5),
+    10: (0x3F, 188, 0.25),
+    11: (0x5F, 375, 0.125),
+    12: (0x7F, 750, 0.0625),
+}
+
+# 11 bit conversions fit two readings per second; the curve fit gains more from
+# the extra readings than it loses to the coarser step
+RESOLUTION = 11
+PERIOD_MS = 500
+MAX_SECONDS = 40
+
+
+def set_resolution(bits):
+    config, _, _ = RESOLUTIONS[bits]
+    for rom in roms:
+        ds.write_scratch(rom, bytearray((0, 0, config)))  # TH, TL alarms unused
+
+
+# Reads every PERIOD_MS until the predicted equilibrium is stable (see TempEstimator),
+# at most MAX_SECONDS. Returns (temperature, confidence bound in °C), or None.
+async def get_bodytemp(resolution=RESOLUTION, period_ms=PERIOD_MS, max_seconds=MAX_SECONDS):
     if not roms:
         return None  
 
-    print("\n40 second measurement.")
-    
-    timeout = time.time() + 40  
-    last_temp = None  
-    
-    while time.time() < timeout:
-        ds.convert_temp()  
-        time.sleep_ms(750)  
-        for rom in roms:
-            temp = ds.read_temp(rom)
-            last_temp = temp  
-            print(f"Calculating: {temp:.2f}°C")
-        time.sleep(2)  
-
-    print(f"\nDone. Bodytemp: {last_temp:.2f}°C")
-    return last_temp  
+    _, conversion_ms, step = RESOLUTIONS[resolution]
+    set_resolution(resolution)
+    estimator = TempEstimator(period_s=period_ms / 1000)
+
+    print(f"\nMeasuring until stable, at most {max_seconds} seconds.")
+
+    start = time.ticks_ms()
+    next_reading = start
+    try:
+        while True:
+            ds.convert_temp()  
+            await asyncio.sleep_ms(conversion_ms)
+            temp = ds.read_temp(roms[0])
+            estimator.add(temp, step)
+            print(f"Calculating: {temp:.2f}°C, predicted {estimator.estimate():.2f}°C")
+
+            if estimator.converged() or estimator.elapsed_s() >= max_seconds:
+                break
+
+            # Fixed reading period, the fit assumes evenly spaced readings
+            next_reading = time.ticks_add(next_reading, period_ms)
+            await asyncio.sleep_ms(max(0, time.ticks_diff(next_reading, time.ticks_ms())))
+    finally:
+        set_resolution(12)  # power-on default
 
+    temp = estimator.estimate()
+    bound = estimator.bound()
+    if bound is None:
+        bound = step / 2
+    elapsed = time.ticks_diff(time.ticks_ms(), start) / 1000
+    state = "converged" if estimator.converged() else "time limit"
+    print(f"\nDone ({state}, {elapsed:.1f} s). Bodytemp: {temp:.2f} ± {bound:.2f}°C")
+    return temp, bound
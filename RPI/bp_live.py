@@ -1,23 +1,30 @@
 import time
+import uasyncio as asyncio
 import ujson
-import urequests
-from machine import I2C, Pin, ADC
-from max30102 import MAX30102
+import httpclient
+import wireformat
+from machine import Pin, ADC
+from max30102bus import sensor as sensor1
+from sampler import make_sampler
+from samplebuffer import zeros, HeapMonitor
 
 # API
-SERVER_URL = "http://192.168.3.181:5000/api/live-bp"
+SERVER_IP = "192.168.3.181"
+SERVER_PORT = 5000
+LIVE_BP_PATH = "/api/live-bp"
 
-# MAX30102
-i2c = I2C(0, sda=Pin(4), scl=Pin(5), freq=400000)
-sensor1 = MAX30102(i2c=i2c)
+SAMPLE_RATE = 50  # Hz, sampled on core 1 (or a timer)
+SAMPLE_PERIOD_MS = 1000 // SAMPLE_RATE
+CHUNK_SIZE = 25  # samples per POST, 1 sends every sample on its own
+BUFFER_SIZE = 128  # samples buffered while a chunk is being sent
 
 # ICQUANZX
 sensor2 = ADC(Pin(26))
 
-def initialize_sensors():
+async def initialize_sensors():
     print("MAX30102 starts...")
     sensor1.setup_sensor()
-    time.sleep(1)
+    await asyncio.sleep(1)  # settling, without stalling the other tasks
 
     if not sensor1.check_part_id():
         print("Error")
@@ -26,44 +33,97 @@ def initialize_sensors():
     print("MAX30102 started.")
     return True
 
-def read_sensor_data():
+# Sampler callback: one sample of the three channels into the sampler buffer
+def read_channels(buf, i):
     try:
-        ir = sensor1.get_ir() or 0
-        red = sensor1.get_red() or 0
-        ir2_raw = sensor2.read_u16()
-        ir2 = ir2_raw / 65535  # Normalized value
-        timestamp = time.ticks_ms()  # Millisecond based timestamp
-
-        return {
-            "timestamp": timestamp,
-            "max30102_ir": ir,
-            "max30102_red": red,
-            "icquanzx": ir2
-        }
+        buf[i] = sensor1.get_ir() or 0
+        buf[i + 1] = sensor1.get_red() or 0
+        buf[i + 2] = sensor2.read_u16()
     except Exception as e:
         print("Error:", e)
-        return None
 
-def start_bp_measurement():
-    if not initialize_sensors():
+DEVICE_ID = wireformat.device_id()
+
+# Drained samples to a BP sensor frame: millisecond ticks, raw ICQUANZX ADC counts
+# (the server normalizes them), differences sent as zigzag varints
+def to_frame(values, ticks, n):
+    channels = (
+        [values[3 * i] for i in range(n)],      # MAX30102 IR
+        [values[3 * i + 1] for i in range(n)],  # MAX30102 red
+        [values[3 * i + 2] for i in range(n)],  # ICQUANZX
+    )
+    return wireformat.encode(wireformat.SENSOR_BP, channels, SAMPLE_RATE,
+                             ticks=[ticks[i] for i in range(n)], device_id=DEVICE_ID, varint=True)
+
+# Send buffered samples as one request (binary frame), returns True if the server is done.
+# Live chunks carry no measurement id, so a chunk that cannot be sent is dropped rather
+# than queued: resent later it would be appended to whatever measurement runs then.
+async def send_chunk(frame, n):
+    try:
+        client = httpclient.async_client(SERVER_IP, SERVER_PORT, "uploads")
+        response = await client.post(LIVE_BP_PATH, frame)
+        done = response.json().get("done", False)
+        response.close()
+        print(f"Data sent: {n} samples, {len(frame)} bytes")
+        return done
+    except Exception as e:
+        print("Error sending:", e)
+        return False
+
+async def start_bp_measurement(sample_count=200, chunk_size=CHUNK_SIZE):
+    if not await initialize_sensors():
         return False  
 
     print("BP Measurement Starts, Data flow to server started...")
 
+    # I2C reads cannot run in a hard IRQ, so a timer fallback uses a soft callback
+    sampler = make_sampler(read_channels, SAMPLE_RATE, BUFFER_SIZE, channels=3,
+                           typecode='I', clock=time.ticks_ms, hard=False)
+    values = zeros('I', chunk_size * 3)
+    ticks = zeros('I', chunk_size)
+    heap = HeapMonitor("BP")
+    heap.start()
+
+    sent = 0
+    first_tick = None
+    last_tick = None
+    upload = None
+    sampler.start()
+
     try:
-        for _ in range(200):
-            sensor_data = read_sensor_data()
-
-            if sensor_data:
-                try:
-                    response = urequests.post(SERVER_URL, json=sensor_data)
-                    print(f"Data sent: {sensor_data}")
-                    response.close()
-                except Exception as e:
-                    print("Error sending:", e)
-
-            time.sleep(0.02)  # 50 Hz
-    
+        while sent < sample_count:
+            wanted = min(chunk_size, sample_count - sent)
+            n = 0
+            while n < wanted:
+                n += sampler.drain(values, ticks, n)
+                heap.sample()
+                if n < wanted:
+                    await asyncio.sleep_ms(SAMPLE_PERIOD_MS)
+
+            if first_tick is None:
+                first_tick = ticks[0]
+            last_tick = ticks[n - 1]
+            sent += n
+
+            # Chunk N uploads while chunk N+1 is acquired
+            if upload and await upload:
+                upload = None
+                break
+            upload = asyncio.create_task(send_chunk(to_frame(values, ticks, n), n))
+
+        if upload:
+            await upload
+
     except KeyboardInterrupt:
         print("BP Measurement Stopped.")
         return False  
+
+    finally:
+        sampler.stop()
+        heap.report()
+
+    elapsed = time.ticks_diff(last_tick, first_tick) if sent > 1 else 0
+    if elapsed > 0:
+        print(f"Achieved sample rate: {(sent - 1) * 1000 / elapsed:.1f} Hz "
+              f"({sent} samples, chunk {chunk_size}, overruns {sampler.overruns}, late {sampler.late})")
+    return True
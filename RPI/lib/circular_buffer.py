@@ -1,42 +1,205 @@
-from ucollections import deque
+from samplebuffer import zeros
+
 
 class CircularBuffer:
-    def __init__(self, max_size):
-        self.data = deque((), max_size, True)
+    """
+    Fixed-size ring over a preallocated array. append() overwrites the oldest
+    sample when full; pop()/pop_head() remove the oldest. All O(1), no
+    allocation per sample.
+
+    Every sample is written twice (at i and i + max_size) so the most recent
+    n samples are always contiguous and window(n) can return them in order as
+    a memoryview without copying.
+
+    The running sum is kept unless stats=False; with extremes=True min() and
+    max() are kept incrementally too (monotonic queues, O(1) amortized).
+    typecode 'I' suits sensor counts; use 'i' or 'f' for signed or filtered values.
+
+    With channels > 1 every sample is `channels` consecutive values (no sum or
+    extremes). A producer can then write a sample in place: reserve() gives its
+    offset in data, commit() makes it visible. oldest(n) and drop(n) read and
+    remove from the old end, as a sampler's consumer does.
+    """
+    def __init__(self, max_size, typecode='I', extremes=False, channels=1, stats=True):
         self.max_size = max_size
+        self.typecode = typecode
+        self.channels = channels
+        self.data = zeros(typecode, 2 * max_size * channels)
+        self.head = 0  # oldest sample
+        self.length = 0
+        self.sum = 0
+        self.stats = stats and channels == 1
+        extremes = extremes and self.stats
+
+        self.extremes = extremes
+        if extremes:
+            # Ring positions of min/max candidates, oldest first
+            self.min_queue = zeros('H' if max_size < 65536 else 'I', max_size)
+            self.max_queue = zeros('H' if max_size < 65536 else 'I', max_size)
+            self.min_start = self.min_len = 0
+            self.max_start = self.max_len = 0
 
     def __len__(self):
-        return len(self.data)
+        return self.length
 
     def is_empty(self):
-        return not bool(self.data)
+        return self.length == 0
+
+    def is_full(self):
+        return self.length == self.max_size
 
     def append(self, item):
-        if len(self.data) >= self.max_size:
-            self.data.popleft()  
-        self.data.append(item)
+        if self.length == self.max_size:
+            self.pop()
+
+        pos = self.head + self.length
+        if pos >= self.max_size:
+            pos -= self.max_size
+        self.data[pos] = item
+        self.data[pos + self.max_size] = item
+        self.length += 1
+        if self.stats:
+            self.sum += item
+
+        if self.extremes:
+            self.push_extremes(pos, item)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    # In-place writes (any channel count): offset in data of the next sample,
+    # or -1 when full. Nothing changes until commit().
+    def reserve(self):
+        if self.length == self.max_size:
+            return -1
+        pos = self.head + self.length
+        if pos >= self.max_size:
+            pos -= self.max_size
+        return pos * self.channels
+
+    def commit(self):
+        """Publish the sample written at reserve(); copies it to its mirror slot."""
+        channels = self.channels
+        pos = self.head + self.length
+        if pos >= self.max_size:
+            pos -= self.max_size
+        data = self.data
+        start = pos * channels
+        mirror = start + self.max_size * channels
+        for c in range(channels):
+            data[mirror + c] = data[start + c]
+        self.length += 1
+        if self.stats:
+            self.sum += data[start]
+        if self.extremes:
+            self.push_extremes(pos, data[start])
+
+    def oldest(self, n=None):
+        """Oldest n samples (all if None) as a memoryview of n * channels values."""
+        if n is None or n > self.length:
+            n = self.length
+        start = self.head * self.channels
+        return memoryview(self.data)[start:start + n * self.channels]
+
+    def drop(self, n):
+        """Remove the oldest n samples."""
+        if n > self.length:
+            n = self.length
+        if self.stats:
+            for _ in range(n):
+                self.pop()
+            return
+        head = self.head + n
+        self.head = head - self.max_size if head >= self.max_size else head
+        self.length -= n
 
     def pop(self):
-        if self.is_empty():
+        if self.length == 0:
             return None
-        return self.data.popleft()
 
-    def clear(self):
-        self.data = deque((), self.max_size, True)
+        pos = self.head
+        item = self.data[pos * self.channels]
+        self.head = pos + 1 if pos + 1 < self.max_size else 0
+        self.length -= 1
+        if self.stats:
+            self.sum -= item
+
+        if self.extremes:
+            if self.min_len and self.min_queue[self.min_start] == pos:
+                self.min_start = self.min_start + 1 if self.min_start + 1 < self.max_size else 0
+                self.min_len -= 1
+            if self.max_len and self.max_queue[self.max_start] == pos:
+                self.max_start = self.max_start + 1 if self.max_start + 1 < self.max_size else 0
+                self.max_len -= 1
 
+        return item
+
+    # Kept for callers of the old deque based class, same as pop()
     def pop_head(self):
-        if self.is_empty():
-            return None
+        return self.pop()
 
-        temp_queue = deque((), self.max_size, True)
+    def clear(self):
+        self.head = 0
+        self.length = 0
+        self.sum = 0
+        if self.extremes:
+            self.min_start = self.min_len = 0
+            self.max_start = self.max_len = 0
 
-        for _ in range(len(self.data)):
-            val = self.data.popleft()
-            temp_queue.append(val)
+    def window(self, n=None):
+        """Most recent n samples (all if None), oldest first, as a memoryview."""
+        if n is None or n > self.length:
+            n = self.length
+        end = (self.head + self.length) * self.channels
+        return memoryview(self.data)[end - n * self.channels:end]
 
-        first_item = temp_queue.popleft()
+    def snapshot(self):
+        return self.window()
+
+    def mean(self):
+        if not self.length:
+            return 0
+        return (self.sum if self.stats else sum(self.window())) / self.length
+
+    # O(1) with extremes=True, otherwise a scan of the stored samples
+    def min(self):
+        if not self.length:
+            return None
+        if not self.extremes:
+            return min(self.window())
+        return self.data[self.min_queue[self.min_start]]
+
+    def max(self):
+        if not self.length:
+            return None
+        if not self.extremes:
+            return max(self.window())
+        return self.data[self.max_queue[self.max_start]]
 
-        self.data = temp_queue
+    def push_extremes(self, pos, item):
+        size = self.max_size
+        data = self.data
 
-        return first_item
+        # Drop candidates that can no longer be the min/max, newest first
+        while self.min_len:
+            last = self.min_start + self.min_len - 1
+            if last >= size:
+                last -= size
+            if data[self.min_queue[last]] < item:
+                break
+            self.min_len -= 1
+        last = self.min_start + self.min_len
+        self.min_queue[last - size if last >= size else last] = pos
+        self.min_len += 1
 
+        while self.max_len:
+            last = self.max_start + self.max_len - 1
+            if last >= size:
+                last -= size
+            if data[self.max_queue[last]] > item:
+                break
+            self.max_len -= 1
+        last = self.max_start + self.max_len
+        self.max_queue[last - size if last >= size else last] = pos
+        self.max_len += 1
@@ -0,0 +1,122 @@
+import time
+import uasyncio as asyncio
+from machine import Pin
+
+# MAX30102 registers
+REG_INT_STATUS_1 = 0x00
+REG_INT_ENABLE_1 = 0x02
+REG_FIFO_WR_PTR = 0x04
+REG_OVF_COUNTER = 0x05
+REG_FIFO_RD_PTR = 0x06
+REG_FIFO_DATA = 0x07
+REG_FIFO_CONFIG = 0x08
+
+INT_A_FULL = 0x80
+FIFO_DEPTH = 32
+SAMPLE_MASK = 0x3FFFF  # 18 bit ADC values
+
+MAX30102_ADDRESS = 0x57
+
+
+class FifoReader:
+    """
+    MAX30102 FIFO drained on the FIFO-almost-full interrupt instead of polling.
+    The interrupt pin only sets a flag; the waiting task then reads every
+    sample in the FIFO with one I2C transaction into a preallocated buffer.
+    overflows counts samples the sensor dropped because the FIFO was full
+    (OVF_COUNTER, which saturates at 31 per drain).
+    """
+    def __init__(self, i2c, pin, channels=2, almost_full=17, address=MAX30102_ADDRESS):
+        self.i2c = i2c
+        self.pin = pin
+        self.channels = channels
+        self.almost_full = almost_full  # samples in the FIFO when the interrupt fires
+        self.address = address
+
+        self.raw = bytearray(FIFO_DEPTH * 3 * channels)
+        self.raw_view = memoryview(self.raw)
+        self.reg = bytearray(1)
+        self.flag = asyncio.ThreadSafeFlag()
+        self.interrupts = 0
+        self.overflows = 0
+        self.samples = 0
+        self.handler = self.irq  # bound once, the IRQ handler must not allocate
+
+    def irq(self, pin):
+        self.interrupts += 1
+        self.flag.set()
+
+    def read_register(self, reg):
+        self.i2c.readfrom_mem_into(self.address, reg, self.reg)
+        return self.reg[0]
+
+    def write_register(self, reg, value):
+        self.reg[0] = value
+        self.i2c.writeto_mem(self.address, reg, self.reg)
+
+    def start(self):
+        self.interrupts = 0
+        self.overflows = 0
+        self.samples = 0
+
+        # FIFO_A_FULL holds the number of free slots left when the interrupt fires
+        config = self.read_register(REG_FIFO_CONFIG)
+        self.write_register(REG_FIFO_CONFIG, (config & 0xF0) | (FIFO_DEPTH - self.almost_full))
+        self.clear()
+        self.write_register(REG_INT_ENABLE_1, INT_A_FULL)
+        self.read_register(REG_INT_STATUS_1)  # release a pending interrupt
+        self.pin.irq(trigger=Pin.IRQ_FALLING, handler=self.handler)
+
+    def stop(self):
+        self.pin.irq(handler=None)
+        self.write_register(REG_INT_ENABLE_1, 0)
+
+    def clear(self):
+        self.write_register(REG_FIFO_WR_PTR, 0)
+        self.write_register(REG_OVF_COUNTER, 0)
+        self.write_register(REG_FIFO_RD_PTR, 0)
+
+    def pending(self):
+        lost = self.read_register(REG_OVF_COUNTER)
+        if lost:
+            return lost, FIFO_DEPTH
+        return 0, (self.read_register(REG_FIFO_WR_PTR) - self.read_register(REG_FIFO_RD_PTR)) & (FIFO_DEPTH - 1)
+
+    def read(self, out, offset=0):
+        """
+        Burst-read every sample in the FIFO into out (one value per channel,
+        in slot order) from sample position offset, as far as out has room.
+        Returns the number of samples read.
+        """
+        self.read_register(REG_INT_STATUS_1)  # deasserts the interrupt pin
+        lost, n = self.pending()
+        self.overflows += lost
+        n = min(n, len(out) // self.channels - offset)
+        if n <= 0:
+            return 0
+
+        size = n * 3 * self.channels
+        self.i2c.readfrom_mem_into(self.address, REG_FIFO_DATA, self.raw_view[:size])
+
+        raw = self.raw
+        j = offset * self.channels
+        for i in range(0, size, 3):
+            out[j] = (raw[i] << 16 | raw[i + 1] << 8 | raw[i + 2]) & SAMPLE_MASK
+            j += 1
+        self.samples += n
+        return n
+
+    async def wait(self, timeout_ms):
+        """Wait for the almost-full interrupt. False on timeout (the FIFO may still hold samples)."""
+        try:
+            await asyncio.wait_for_ms(self.flag.wait(), timeout_ms)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+def rate_report(name, reader, start_ms):
+    elapsed = time.ticks_diff(time.ticks_ms(), start_ms)
+    rate = reader.samples * 1000 / elapsed if elapsed > 0 else 0
+    print(f"{name}: {reader.samples} samples in {elapsed} ms ({rate:.1f} Hz), "
+          f"dropped {reader.overflows}, interrupts {reader.interrupts}")
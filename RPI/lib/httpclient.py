@@ -0,0 +1,156 @@
+import ujson
+import uasyncio as asyncio
+
+
+class Response:
+    def __init__(self, status, content):
+        self.status_code = status
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return ujson.loads(self.content)
+
+    # Same call pattern as urequests, the connection stays open for the next request
+    def close(self):
+        pass
+
+
+def request_head(method, path, headers, body, content_type):
+    head = method + b" " + path.encode() + b" HTTP/1.1\r\n" + headers
+    if body is not None:
+        head += b"Content-Type: " + content_type + b"\r\nContent-Length: %d\r\n" % len(body)
+    return head + b"\r\n"
+
+
+def parse_status(line):
+    if not line:
+        raise OSError("connection closed")
+    return int(line.split(None, 2)[1])
+
+
+# Header line to (name, value), both lower-cased
+def parse_header(line):
+    name, _, value = line.partition(b":")
+    return name.strip().lower(), value.strip().lower()
+
+
+class AsyncHTTPClient:
+    """
+    Minimal HTTP/1.1 client for uasyncio over one persistent keep-alive stream
+    connection. The constant header bytes are built once, bodies are sent in
+    chunks of at most send_size bytes, and a dropped connection is reopened and
+    the request retried once. Requests on the same client are serialized by a
+    lock; use separate clients (see async_client) for traffic that must not
+    wait, e.g. a long poll.
+    """
+    def __init__(self, host, port=5000, timeout=10, send_size=512):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.send_size = send_size
+        self.reader = None
+        self.writer = None
+        self.lock = asyncio.Lock()
+        self.headers = ("Host: %s:%d\r\nConnection: keep-alive\r\n" % (host, port)).encode()
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def close(self):
+        if self.writer:
+            try:
+                self.writer.close()
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = None
+        self.writer = None
+
+    async def get(self, path, timeout=None):
+        return await self.request(b"GET", path, timeout=timeout)
+
+    async def post(self, path, body, content_type=b"application/octet-stream", timeout=None):
+        return await self.request(b"POST", path, body, content_type, timeout)
+
+    async def post_json(self, path, data, timeout=None):
+        return await self.request(b"POST", path, ujson.dumps(data).encode(), b"application/json", timeout)
+
+    async def request(self, method, path, body=None, content_type=None, timeout=None):
+        async with self.lock:
+            for attempt in range(2):
+                reused = self.writer is not None
+                if not reused:
+                    await self.connect()
+                try:
+                    return await asyncio.wait_for(self.exchange(method, path, body, content_type),
+                                                  timeout or self.timeout)
+                except asyncio.TimeoutError:
+                    await self.close()
+                    raise
+                except OSError:
+                    await self.close()
+                    # Only a stale keep-alive connection is worth a second try
+                    if not reused or attempt:
+                        raise
+
+    async def exchange(self, method, path, body, content_type):
+        writer = self.writer
+        writer.write(request_head(method, path, self.headers, body, content_type))
+        if body:
+            view = memoryview(body)
+            for i in range(0, len(body), self.send_size):
+                writer.write(view[i:i + self.send_size])
+                await writer.drain()
+        await writer.drain()
+
+        reader = self.reader
+        status = parse_status(await reader.readline())
+
+        length = None
+        chunked = False
+        keep_alive = True
+        while True:
+            line = await reader.readline()
+            if not line or line == b"\r\n":
+                break
+            name, value = parse_header(line)
+            if name == b"content-length":
+                length = int(value)
+            elif name == b"transfer-encoding" and value == b"chunked":
+                chunked = True
+            elif name == b"connection" and value == b"close":
+                keep_alive = False
+
+        if chunked:
+            content = b""
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                content += await reader.readexactly(size)
+                await reader.readline()
+        elif length is not None:
+            content = await reader.readexactly(length)
+        else:
+            content = await reader.read(-1)
+            keep_alive = False
+
+        if not keep_alive:
+            await self.close()
+        return Response(status, content)
+
+
+clients = {}
+
+
+# One shared async connection per server and channel ("commands", "uploads", ...)
+def async_client(host, port=5000, channel="default"):
+    key = (host, port, channel)
+    if key not in clients:
+        clients[key] = AsyncHTTPClient(host, port)
+    return clients[key]
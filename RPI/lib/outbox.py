@@ -0,0 +1,267 @@
+import os
+import struct
+try:
+    import ujson
+except ImportError:
+    import json as ujson
+
+# Store-and-forward queue for uploads that could not be sent, kept in flash so
+# they survive a reboot. The data file is preallocated once: `slots` fixed-size
+# slots used as a ring. A record takes one or more consecutive slots:
+#
+#   header "<BBBHH": marker, content type, failed attempts, path length, body length;
+#   path; body
+#
+# A record that would run past the end of the file starts again at slot 0, and
+# the unused tail slots are marked as skipped. Records are written first and only
+# then committed by writing the pointers (head, tail, used slots). The pointers
+# alternate between two checksummed copies in a second file, so a crash during
+# either write leaves the previous, complete state.
+
+RECORD = "<BBBHH"
+RECORD_SIZE = struct.calcsize(RECORD)
+MARK_RECORD = 0xA5
+MARK_SKIP = 0x5A
+
+POINTERS = "<IIIII"  # seq, head, tail, used, check
+POINTERS_SIZE = struct.calcsize(POINTERS)
+CHECK = 0x10A7
+
+# Server errors (5xx) after which a record is dropped instead of blocking the queue
+MAX_ATTEMPTS = 3
+
+CONTENT_TYPES = (b"application/octet-stream", b"application/json")
+
+
+def exists(path):
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+
+class FlashQueue:
+    def __init__(self, path, slots=256, slot_size=256):
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.pointers_path = path + ".ptr"
+        self.header = bytearray(RECORD_SIZE)
+        self.seq = 0
+        self.head = 0  # next slot to write
+        self.tail = 0  # oldest record
+        self.used = 0  # slots in use, skipped ones included
+        self.open()
+
+    def open(self):
+        size = self.slots * self.slot_size
+        if not exists(self.path) or os.stat(self.path)[6] != size:
+            # Preallocate, so appends never grow the file
+            with open(self.path, "wb") as f:
+                block = bytes(self.slot_size)
+                for _ in range(self.slots):
+                    f.write(block)
+            if exists(self.pointers_path):
+                os.remove(self.pointers_path)
+        self.file = open(self.path, "r+b")
+        self.load_pointers()
+
+    def close(self):
+        self.file.close()
+        self.pointers.close()
+
+    def load_pointers(self):
+        if not exists(self.pointers_path):
+            with open(self.pointers_path, "wb") as f:
+                f.write(bytes(2 * POINTERS_SIZE))
+        self.pointers = open(self.pointers_path, "r+b")
+        data = self.pointers.read()
+        best = None
+        for copy in range(2):
+            if len(data) < (copy + 1) * POINTERS_SIZE:
+                continue
+            seq, head, tail, used, check = struct.unpack_from(POINTERS, data, copy * POINTERS_SIZE)
+            valid = check == seq ^ head ^ tail ^ used ^ CHECK and head < self.slots and tail < self.slots
+            if valid and used <= self.slots and (best is None or seq > best[0]):
+                best = (seq, head, tail, used)
+        if best is None:
+            best = (0, 0, 0, 0)
+        self.seq, self.head, self.tail, self.used = best
+        self.next_slots = 0
+        self.attempts = 0
+
+    def commit(self):
+        self.seq += 1
+        data = struct.pack(POINTERS, self.seq, self.head, self.tail, self.used,
+                           self.seq ^ self.head ^ self.tail ^ self.used ^ CHECK)
+        f = self.pointers
+        f.seek((self.seq & 1) * POINTERS_SIZE)
+        f.write(data)
+        f.flush()
+
+    def __len__(self):
+        return self.used
+
+    def is_empty(self):
+        return self.used == 0
+
+    def free(self):
+        return self.slots - self.used
+
+    def slots_for(self, path, body):
+        return (RECORD_SIZE + len(path) + len(body) + self.slot_size - 1) // self.slot_size
+
+    def put(self, path, body, content_type=CONTENT_TYPES[0]):
+        """Append one upload. False when it does not fit (queue full or record too large)."""
+        if isinstance(path, str):
+            path = path.encode()
+        need = self.slots_for(path, body)
+        if need > self.slots:
+            return False
+
+        head = self.head
+        skip = self.slots - head if head + need > self.slots else 0
+        if self.used + skip + need > self.slots:
+            return False
+
+        f = self.file
+        if skip:
+            struct.pack_into(RECORD, self.header, 0, MARK_SKIP, 0, 0, 0, 0)
+            f.seek(head * self.slot_size)
+            f.write(self.header)
+            head = 0
+
+        struct.pack_into(RECORD, self.header, 0, MARK_RECORD, CONTENT_TYPES.index(content_type), 0,
+                         len(path), len(body))
+        f.seek(head * self.slot_size)
+        f.write(self.header)
+        f.write(path)
+        f.write(body)
+        f.flush()
+
+        self.head = (head + need) % self.slots
+        self.used += skip + need
+        self.commit()
+        return True
+
+    def peek(self):
+        """Oldest upload as (path, body, content_type), or None."""
+        while self.used:
+            f = self.file
+            f.seek(self.tail * self.slot_size)
+            f.readinto(self.header)
+            marker, kind, self.attempts, path_len, body_len = struct.unpack(RECORD, self.header)
+            if marker == MARK_RECORD:
+                self.next_slots = (RECORD_SIZE + path_len + body_len + self.slot_size - 1) // self.slot_size
+                path = f.read(path_len).decode()
+                return path, f.read(body_len), CONTENT_TYPES[kind]
+
+            # Skipped tail slots (or damage): continue at slot 0
+            self.used -= self.slots - self.tail
+            self.tail = 0
+            if self.used <= 0:
+                self.used = 0
+                self.head = 0
+        return None
+
+    def pop(self, commit=True):
+        """Drop the upload returned by the last peek() once it was delivered."""
+        if not self.next_slots:
+            return
+        self.tail = (self.tail + self.next_slots) % self.slots
+        self.used -= self.next_slots
+        self.next_slots = 0
+        if commit:
+            self.commit()
+
+    def failed(self, commit=True):
+        """
+        Count a server error for the upload returned by the last peek(). After
+        MAX_ATTEMPTS errors it is dropped, so a record the server keeps refusing
+        cannot hold up everything queued behind it. Returns True when it was dropped.
+        """
+        if not self.next_slots:
+            return False
+        self.attempts += 1
+        if self.attempts >= MAX_ATTEMPTS:
+            print("Upload dropped after", self.attempts, "server errors")
+            self.pop(commit)
+            return True
+        # The count lives in the record header, so it survives a reboot
+        f = self.file
+        f.seek(self.tail * self.slot_size + 2)
+        f.write(bytes((self.attempts,)))
+        f.flush()
+        return False
+
+    async def drain(self, client, limit=None, commit_every=1):
+        """
+        Send queued uploads oldest first over client (httpclient.AsyncHTTPClient)
+        until the queue is empty, limit uploads were sent, or a request fails.
+        An upload is only dropped after the server answered it, or after its
+        MAX_ATTEMPTS-th server error; the pointers are committed every commit_every
+        uploads taken off the queue, so a crash resends at most that many.
+        Returns the number of uploads sent.
+        """
+        sent = 0
+        popped = 0
+        try:
+            while limit is None or sent < limit:
+                record = self.peek()
+                if record is None:
+                    break
+                path, body, content_type = record
+                response = await client.post(path, body, content_type)
+                response.close()
+                if response.status_code >= 500:
+                    if not self.failed(commit=False):
+                        break
+                else:
+                    self.pop(commit=False)
+                    sent += 1
+                popped += 1
+                if popped % commit_every == 0:
+                    self.commit()
+        finally:
+            if popped % commit_every:
+                self.commit()
+        return sent
+
+queues = {}
+
+
+# One shared queue per file
+def queue(path="/outbox", slots=256, slot_size=256):
+    if path not in queues:
+        queues[path] = FlashQueue(path, slots, slot_size)
+    return queues[path]
+
+
+# Upload through the queue: sent directly while nothing is queued (keeps the order),
+# queued otherwise or when the request fails. When the queue is full it is drained
+# first; if that fails too the upload is refused (backpressure). Uploads the server can
+# take out of order (numbered stream chunks) pass direct=True to try the request even
+# while older uploads are queued; they are queued like any other upload when it fails.
+# Returns the response, or None when the upload was queued or dropped.
+async def send(client, path, body, content_type=CONTENT_TYPES[0], store=None, direct=False):
+    if store is None:
+        store = queue()  # not `store or`: an empty queue is falsy
+    if direct or store.is_empty():
+        try:
+            return await client.post(path, body, content_type)
+        except Exception as e:
+            print("Upload failed, queued:", e)
+
+    if not store.put(path, body, content_type):
+        try:
+            await store.drain(client)
+        except Exception:
+            pass
+        if not store.put(path, body, content_type):
+            print("Outbox full, upload dropped")
+    return None
+
+
+async def send_json(client, path, data, store=None):
+    return await send(client, path, ujson.dumps(data).encode(), CONTENT_TYPES[1], store)
@@ -0,0 +1,34 @@
+import gc
+from array import array
+
+
+def zeros(typecode, n):
+    return array(typecode, (0 for _ in range(n)))
+
+
+class HeapMonitor:
+    """
+    Free heap during an acquisition. call sample() once per sample; a rise in
+    gc.mem_free() between two calls means a garbage collection ran.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def start(self):
+        gc.collect()
+        self.start_free = gc.mem_free()
+        self.last_free = self.start_free
+        self.min_free = self.start_free
+        self.gc_runs = 0
+
+    def sample(self):
+        free = gc.mem_free()
+        if free > self.last_free:
+            self.gc_runs += 1
+        if free < self.min_free:
+            self.min_free = free
+        self.last_free = free
+
+    def report(self):
+        print(f"{self.name} heap: start {self.start_free} B free, min {self.min_free} B, "
+              f"used {self.start_free - self.min_free} B, GC runs {self.gc_runs}")
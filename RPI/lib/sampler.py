@@ -0,0 +1,211 @@
+import time
+import _thread
+import machine
+import micropython
+from machine import Timer
+from samplebuffer import zeros
+from circular_buffer import CircularBuffer
+
+micropython.alloc_emergency_exception_buf(100)
+
+
+class Sampler:
+    """
+    Timer-driven sampling at a fixed rate into a preallocated CircularBuffer
+    (channels values per sample, typecode of the sensor values).
+    read(buf, index) stores one sample (channels values) at buf[index:index + channels];
+    it runs inside the timer callback, so it must not allocate when hard=True.
+    read() may return False when no sample was ready; nothing is stored then.
+    Samples that arrive while the buffer is full are dropped and counted in overruns.
+    """
+    def __init__(self, read, rate_hz, capacity, channels=1, typecode='H', clock=time.ticks_us, hard=True):
+        self.read = read
+        self.rate_hz = rate_hz
+        self.capacity = capacity
+        self.channels = channels
+        self.clock = clock
+        self.hard = hard
+
+        # No running sum: it could allocate inside a hard IRQ
+        self.ring = CircularBuffer(capacity, typecode, channels=channels, stats=False)
+        self.ticks = zeros('I', capacity)  # per ring slot
+        self.overruns = 0
+        self.late = 0  # periods missed, the timer never falls behind
+
+        self.timer = Timer()
+        self.callback = self.tick  # bound once, the IRQ handler must not allocate
+
+    def tick(self, timer):
+        ring = self.ring
+        offset = ring.reserve()
+        if offset < 0:
+            self.overruns += 1
+            return
+
+        self.ticks[offset // self.channels] = self.clock()
+        if self.read(ring.data, offset) is False:
+            return
+        ring.commit()
+
+    def start(self):
+        self.ring.clear()
+        self.overruns = 0
+        self.timer.init(freq=self.rate_hz, mode=Timer.PERIODIC, callback=self.callback, hard=self.hard)
+
+    def stop(self):
+        self.timer.deinit()
+
+    def available(self):
+        return len(self.ring)
+
+    def drain(self, values_out, ticks_out=None, offset=0):
+        """
+        Move buffered samples into values_out (and their ticks into ticks_out),
+        starting at sample position offset. Returns the number of samples moved.
+        """
+        ring = self.ring
+        channels = self.channels
+        room = len(values_out) // channels - offset
+        n = min(len(ring), room)
+
+        # Contiguous thanks to the ring's mirrored copy
+        src = ring.oldest(n)
+        dst = offset * channels
+        for i in range(n * channels):
+            values_out[dst + i] = src[i]
+
+        if ticks_out is not None:
+            slot = ring.head
+            for i in range(n):
+                ticks_out[offset + i] = self.ticks[slot]
+                slot += 1
+                if slot >= self.capacity:
+                    slot = 0
+
+        # Head and length are shared with the producer, update them atomically
+        state = self.begin_update()
+        ring.drop(n)
+        self.end_update(state)
+        return n
+
+    def discard(self):
+        # drop() keeps head + length, so a sample the producer is writing stays in place
+        state = self.begin_update()
+        self.ring.drop(len(self.ring))
+        self.end_update(state)
+
+    def begin_update(self):
+        return machine.disable_irq()
+
+    def end_update(self, state):
+        machine.enable_irq(state)
+
+    def wait(self, n, timeout_ms=1000):
+        deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+        while len(self.ring) < n and time.ticks_diff(deadline, time.ticks_ms()) > 0:
+            time.sleep_ms(1)
+        return len(self.ring) >= n
+
+
+
+class ThreadSampler(Sampler):
+    """
+    Sampler filled by a loop on core 1 instead of a timer IRQ, so core 0 stays
+    free for Wi-Fi and HTTP. read() runs in a normal thread and may block on
+    I2C or allocate. The ring's head and length are only read and changed under
+    a lock on both cores; read() itself writes the reserved slot without it.
+
+    Only one core 1 thread can exist; if another acquisition holds it, start()
+    falls back to a soft timer on core 0. late counts periods the loop missed
+    because read() took longer than one sample period.
+    """
+    def __init__(self, read, rate_hz, capacity, channels=1, typecode='H', clock=time.ticks_us):
+        super().__init__(read, rate_hz, capacity, channels, typecode, clock, hard=False)
+        self.lock = _thread.allocate_lock()
+        self.threaded = False
+        self.running = False
+        self.stopped = True
+
+    def tick(self, timer):
+        ring = self.ring
+        self.lock.acquire()
+        offset = ring.reserve()
+        self.lock.release()
+        if offset < 0:
+            self.overruns += 1
+            return
+
+        self.ticks[offset // self.channels] = self.clock()
+        if self.read(ring.data, offset) is False:
+            return
+
+        self.lock.acquire()
+        ring.commit()
+        self.lock.release()
+
+    def run(self):
+        period = 1000000 // self.rate_hz
+        deadline = time.ticks_us()
+        while self.running:
+            self.tick(None)
+            deadline = time.ticks_add(deadline, period)
+            wait = time.ticks_diff(deadline, time.ticks_us())
+            if wait > 0:
+                time.sleep_us(wait)
+            else:
+                # Behind schedule, restart the period from now instead of bursting
+                self.late += 1
+                deadline = time.ticks_us()
+        self.stopped = True
+
+    def start(self):
+        self.ring.clear()
+        self.overruns = 0
+        self.late = 0
+        self.running = True
+        self.stopped = False
+        self.threaded = True
+        try:
+            _thread.start_new_thread(self.run, ())
+        except OSError:
+            print("Core 1 busy, sampling on a timer")
+            self.threaded = False
+            self.running = False
+            self.stopped = True
+            self.timer.init(freq=self.rate_hz, mode=Timer.PERIODIC, callback=self.callback, hard=False)
+
+    def stop(self, timeout_ms=1000):
+        """Ask the core 1 loop to finish and wait for it. Returns False on timeout."""
+        if not self.threaded:
+            self.timer.deinit()
+            return True
+
+        self.running = False
+        deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+        while not self.stopped and time.ticks_diff(deadline, time.ticks_ms()) > 0:
+            time.sleep_ms(1)
+        return self.stopped
+
+    # On core 1 the consumer takes the lock; on the timer fallback the soft
+    # callback runs on this core, where the lock would deadlock
+    def begin_update(self):
+        if self.threaded:
+            self.lock.acquire()
+            return None
+        return machine.disable_irq()
+
+    def end_update(self, state):
+        if self.threaded:
+            self.lock.release()
+        else:
+            machine.enable_irq(state)
+
+
+# Acquisition loops run on core 1 when this is set, on a timer IRQ otherwise
+CORE1 = True
+
+
+def make_sampler(read, rate_hz, capacity, channels=1, typecode='H', clock=time.ticks_us, hard=True):
+    if CORE1:
+        return ThreadSampler(read, rate_hz, capacity, channels, typecode, clock)
+    return Sampler(read, rate_hz, capacity, channels, typecode, clock, hard)
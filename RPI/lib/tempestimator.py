@@ -0,0 +1,115 @@
+import math
+
+
+class TempEstimator:
+    """
+    Equilibrium body temperature predicted while the probe is still warming up.
+    Readings every period_s follow T_i = T_eq - b * r^i with r = exp(-period_s / tau).
+    For each candidate time constant T_eq and b are a linear least-squares fit over
+    the last window_s of readings; the best fitting curve gives the prediction.
+    Fitting the whole window keeps the sensor quantization from dominating.
+
+    The estimate has converged once the last `stable` predictions agree within
+    tolerance and no more than max_rise is still extrapolated. bound() adds half
+    that spread, half the range of equilibria of curves that fit almost as well,
+    and half the sensor resolution.
+    """
+    TAUS = [2 * 1.1 ** i for i in range(44)]  # 2 to 120 s, 10 % apart
+
+    def __init__(self, period_s=1.0, tolerance=0.1, stable=3, window_s=15, min_readings=6, max_rise=2.0):
+        self.period_s = period_s
+        self.tolerance = tolerance
+        self.stable = stable
+        self.window = max(min_readings, int(window_s / period_s))
+        self.min_readings = min_readings
+        self.max_rise = max_rise
+        self.ratios = [math.exp(-period_s / tau) for tau in self.TAUS]
+        self.reset()
+
+    def reset(self):
+        self.readings = []
+        self.predictions = []
+        self.resolution = 0.0625
+        self.fit_bound = 0
+
+    def __len__(self):
+        return len(self.readings)
+
+    def add(self, temp, resolution=0.0625):
+        self.readings.append(temp)
+        self.resolution = resolution
+        if len(self.readings) >= self.min_readings:
+            self.predictions.append(self.predict())
+            del self.predictions[:-self.stable]
+        return self.estimate()
+
+    def predict(self):
+        readings = self.readings[-self.window:]
+        n = len(readings)
+        mean_t = sum(readings) / n
+
+        # No rise beyond quantization steps over the window: settled
+        if readings[-1] - readings[0] <= self.resolution:
+            self.fit_bound = 0
+            return mean_t
+
+        fits = []
+        for r in self.ratios:
+            # Least squares of T_i = a + c * x_i with x_i = r^i
+            x = 1.0
+            sx = sxx = sxt = 0.0
+            for t in readings:
+                sx += x
+                sxx += x * x
+                sxt += x * t
+                x *= r
+            mean_x = sx / n
+            var_x = sxx - sx * mean_x
+            if var_x <= 0:
+                continue
+            c = (sxt - sx * mean_t) / var_x
+            a = mean_t - c * mean_x
+            if c >= 0:
+                continue  # falling curve, not a probe warming up
+
+            sse = 0.0
+            x = 1.0
+            for t in readings:
+                e = t - a - c * x
+                sse += e * e
+                x *= r
+            fits.append((sse, a))
+
+        if not fits:
+            self.fit_bound = 0
+            return readings[-1]
+
+        # Curves that fit about as well as the best one (within twice its residual
+        # plus the quantization noise) bracket the equilibrium
+        best = min(fits)
+        limit = 2 * best[0] + n * self.resolution * self.resolution / 12
+        plausible = [a for sse, a in fits if sse <= limit]
+        self.fit_bound = (max(plausible) - min(plausible)) / 2
+        return max(best[1], readings[-1])
+
+    def estimate(self):
+        if self.predictions:
+            return self.predictions[-1]
+        return self.readings[-1] if self.readings else None
+
+    def spread(self):
+        return max(self.predictions) - min(self.predictions) if self.predictions else None
+
+    def converged(self):
+        # Early in the rise many curves agree on a wrong equilibrium; wait until
+        # the prediction is no more than max_rise above the newest reading
+        return (len(self.predictions) >= self.stable and self.spread() <= self.tolerance
+                and self.estimate() - self.readings[-1] <= self.max_rise)
+
+    def bound(self):
+        if not self.predictions:
+            return None
+        return self.spread() / 2 + self.fit_bound + self.resolution / 2
+
+    def elapsed_s(self):
+        return (len(self.readings) - 1) * self.period_s if self.readings else 0
@@ -0,0 +1,224 @@
+import struct
+from array import array
+
+# Binary sensor frames, shared by the device firmware (MicroPython) and the
+# server side Python (calculate_ptt.py). Everything little-endian.
+#
+# Header (20 bytes): magic "IoMT", version, sensor type, flags, delta mask,
+# sample rate (Hz), sample count, device id, start tick.
+# Body: one column per channel, column after column. With FLAG_TICKS the first
+# column holds the tick of every sample ('I'). Column i is delta coded when bit
+# i of the delta mask is set: first value at full width, then the count - 1
+# differences, either as int16 (only worth it for 32 bit columns) or, with
+# FLAG_VARINT (version 2), as a uint32 byte length and zigzag varints.
+
+MAGIC = b"IoMT"
+VERSION = 2
+VERSIONS = (1, 2)
+HEADER = "<4sBBBBHHII"
+HEADER_SIZE = struct.calcsize(HEADER)
+
+FLAG_TICKS = 0x01
+FLAG_VARINT = 0x02
+
+SENSOR_EKG = 1
+SENSOR_BP = 2
+SENSOR_SPO2 = 3
+
+# Column typecodes of each sensor type
+CHANNELS = {
+    SENSOR_EKG: "H",    # ADC26
+    SENSOR_BP: "IIH",   # MAX30102 IR, MAX30102 red, ICQUANZX ADC
+    SENSOR_SPO2: "II",  # MAX30102 red, IR
+}
+
+SIZES = {"H": 2, "I": 4}
+
+
+def device_id():
+    try:
+        import machine
+    except ImportError:  # server side
+        return 0
+    uid = machine.unique_id()
+    return struct.unpack_from("<I", uid, len(uid) - 4)[0]
+
+
+def column_typecodes(sensor, flags):
+    typecodes = CHANNELS[sensor]
+    return "I" + typecodes if flags & FLAG_TICKS else typecodes
+
+
+def layout(header, data):
+    """(typecode, delta, offset, size) of every body column, offsets from the frame start."""
+    count = header["count"]
+    varint = header["flags"] & FLAG_VARINT
+    offset = HEADER_SIZE
+    columns = []
+    for i, typecode in enumerate(column_typecodes(header["sensor"], header["flags"])):
+        delta = header["delta_mask"] >> i & 1 == 1 and count > 0
+        if not delta:
+            size = SIZES[typecode] * count
+        elif not varint:
+            size = SIZES[typecode] + 2 * (count - 1)
+        elif offset + SIZES[typecode] + 4 <= len(data):
+            size = SIZES[typecode] + 4 + struct.unpack_from("<I", data, offset + SIZES[typecode])[0]
+        else:
+            raise ValueError("Frame length does not match its header")
+        columns.append((typecode, delta, offset, size))
+        offset += size
+    return columns
+
+
+def fits_delta(values):
+    previous = values[0]
+    for value in values:
+        if not -32768 <= value - previous <= 32767:
+            return False
+        previous = value
+    return True
+
+
+# Differences of consecutive values, zigzag mapped (0, -1, 1, -2 -> 0, 1, 2, 3)
+# and written 7 bits per byte, low bits first, high bit set on all but the last
+def zigzag_varints(values):
+    out = bytearray()
+    previous = values[0]
+    for i in range(1, len(values)):
+        value = values[i]
+        d = value - previous
+        previous = value
+        z = d << 1 if d >= 0 else (-d << 1) - 1
+        while z > 0x7F:
+            out.append(z & 0x7F | 0x80)
+            z >>= 7
+        out.append(z)
+    return out
+
+
+def encode_column(typecode, values, delta, varint=False):
+    if not delta:
+        return bytes(array(typecode, values))
+    first = bytes(array(typecode, (values[0],)))
+    if varint:
+        body = zigzag_varints(values)
+        return first + struct.pack("<I", len(body)) + body
+    deltas = array('h', (values[i] - values[i - 1] for i in range(1, len(values))))
+    return first + bytes(deltas)
+
+
+def encode(sensor, channels, sample_rate, start_tick=0, ticks=None, device_id=0, delta=False,
+           varint=False):
+    """
+    One frame from a sequence of channel columns (lists or arrays, in the
+    order of CHANNELS[sensor]). With ticks every sample keeps its own tick,
+    otherwise sample i is at start_tick + i / sample_rate. delta=True delta
+    codes every 32 bit column whose differences fit in 16 bits; varint=True
+    delta codes every column as zigzag varints instead.
+    """
+    typecodes = CHANNELS[sensor]
+    if len(channels) != len(typecodes):
+        raise ValueError("Sensor %d frames have %d channels" % (sensor, len(typecodes)))
+
+    columns = list(channels)
+    count = len(columns[0])
+    if count > 0xFFFF:
+        raise ValueError("At most 65535 samples per frame")
+    flags = 0
+    if ticks is not None:
+        flags |= FLAG_TICKS
+        columns.insert(0, ticks)
+        typecodes = "I" + typecodes
+        if count:
+            start_tick = ticks[0]
+
+    for column in columns:
+        if len(column) != count:
+            raise ValueError("Column lengths differ")
+
+    delta_mask = 0
+    if varint and count > 1:
+        flags |= FLAG_VARINT
+        delta_mask = (1 << len(columns)) - 1
+    elif delta and count > 1:
+        for i, column in enumerate(columns):
+            if SIZES[typecodes[i]] > 2 and fits_delta(column):
+                delta_mask |= 1 << i
+
+    parts = [struct.pack(HEADER, MAGIC, VERSION, sensor, flags, delta_mask,
+                         sample_rate, count, device_id, start_tick)]
+    for i, column in enumerate(columns):
+        parts.append(encode_column(typecodes[i], column, delta_mask >> i & 1, varint))
+    return b"".join(parts)
+
+
+def is_frame(data):
+    return len(data) >= HEADER_SIZE and bytes(data[:4]) == MAGIC
+
+
+def read_header(data):
+    if not is_frame(data):
+        raise ValueError("Not a sensor frame")
+
+    fields = struct.unpack_from(HEADER, data)
+    if fields[1] not in VERSIONS:
+        raise ValueError("Unsupported frame version %d" % fields[1])
+    if fields[2] not in CHANNELS:
+        raise ValueError("Unknown sensor type %d" % fields[2])
+
+    header = {
+        "version": fields[1],
+        "sensor": fields[2],
+        "flags": fields[3],
+        "delta_mask": fields[4],
+        "sample_rate": fields[5],
+        "count": fields[6],
+        "device_id": fields[7],
+        "start_tick": fields[8],
+    }
+    typecode, delta, offset, size = layout(header, data)[-1]
+    if len(data) != offset + size:
+        raise ValueError("Frame length does not match its header")
+    return header
+
+
+def varint_differences(data):
+    z = 0
+    shift = 0
+    for byte in data:
+        z |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            yield z >> 1 if not z & 1 else -((z + 1) >> 1)
+            z = 0
+            shift = 0
+
+
+# bytearray, not bytes: MicroPython only copies raw bytes into an array from a bytearray
+def decode_column(data, typecode, delta, offset, size, count, varint=False):
+    if not delta:
+        return array(typecode, bytearray(data[offset:offset + size]))
+
+    width = SIZES[typecode]
+    value = array(typecode, bytearray(data[offset:offset + width]))[0]
+    values = array(typecode, (value,))
+    if varint:
+        differences = varint_differences(data[offset + width + 4:offset + size])
+    else:
+        differences = array('h', bytearray(data[offset + width:offset + size]))
+    for d in differences:
+        value += d
+        values.append(value)
+    if len(values) != count:
+        raise ValueError("Column holds %d samples, header says %d" % (len(values), count))
+    return values
+
+
+def decode(data):
+    """Frame to (header, ticks or None, list of channel arrays)."""
+    header = read_header(data)
+    varint = header["flags"] & FLAG_VARINT
+    columns = [decode_column(data, typecode, delta, offset, size, header["count"], varint)
+               for typecode, delta, offset, size in layout(header, data)]
+    ticks = columns.pop(0) if header["flags"] & FLAG_TICKS else None
+    return header, ticks, columns
@@ -1,34 +1,36 @@
 import network
-import urequests
+import httpclient
+import outbox
 import time
+import uasyncio as asyncio
 from machine import Pin, SPI
 import NFC_PN532 as nfc
 import bodytemp
 import spo2
 import EKG
 import bp_live
+import max30102bus
 
 WIFI_SSID = "SSID"
 WIFI_PASSWORD = "PASSWORD"
 
 # Web server IP
 SERVER_IP = "192.168.3.181"
+SERVER_PORT = 5000
 
 # Web server APIs
-SCAN_CARD_URL = f"http://{SERVER_IP}:5000/api/scan-card"
-SEND_TAG_URL = f"http://{SERVER_IP}:5000/api/send-tag"
+COMMAND_WAIT = 25  # seconds the server may hold a command request
+COMMAND_PATH = f"/api/command?wait={COMMAND_WAIT}"
 
-MEASURE_BODYTEMP_URL = f"http://{SERVER_IP}:5000/api/measure-bodytemp"
-STORE_BODYTEMP_URL = f"http://{SERVER_IP}:5000/api/store-bodytemp"
+SEND_TAG_PATH = "/api/send-tag"
 
-SPO2_URL = f"http://{SERVER_IP}:5000/api/spo2"
-STORE_SPO2_URL = f"http://{SERVER_IP}:5000/api/store-spo2"
+STORE_BODYTEMP_PATH = "/api/store-bodytemp"
 
-EKG_URL = f"http://{SERVER_IP}:5000/api/EKG"
-STORE_EKG_URL = f"http://{SERVER_IP}:5000/api/store-EKG"
+STORE_SPO2_PATH = "/api/store-spo2"
 
-BP_URL = f"http://{SERVER_IP}:5000/api/BP"
-STORE_BP_URL = f"http://{SERVER_IP}:5000/api/store-BP"
+STORE_BP_PATH = "/api/store-BP"
+
+STORE_SESSION_PATH = "/api/store-session"
 
 def connect_wifi():
     wlan = network.WLAN(network.STA_IF)
@@ -43,13 +45,42 @@ def connect_wifi():
 
 connect_wifi()
 
+# Persistent keep-alive connections to the web server: the long poll gets its
+# own so result uploads never wait behind it
+poller = httpclient.async_client(SERVER_IP, SERVER_PORT, "commands")
+client = httpclient.async_client(SERVER_IP, SERVER_PORT, "uploads")
+
+# Results that could not be uploaded wait in flash until the server is reachable again
+store = outbox.queue()
+draining = False
+
+async def drain_outbox():
+    global draining
+    draining = True
+    try:
+        sent = await store.drain(client)
+        print(f"Outbox: {sent} queued uploads sent, {len(store)} slots still in use")
+    except Exception as e:
+        print("Outbox drain failed:", e)
+    finally:
+        draining = False
+
+# Result upload through the outbox, queued instead of lost when the server is unreachable
+async def store_result(path, data):
+    response = await outbox.send_json(client, path, data, store)
+    if response is None:
+        return
+    print("Response from server:", response.text)
+    response.close()
+
 # Scan tag/card by PN532
-def scan_card():
+async def scan_card():
     print("\nScanning...")
 
     timeout = time.time() + 3  
     while time.time() < timeout:
         uid = pn532.read_passive_target(timeout=500)
+        await asyncio.sleep_ms(0)  # let sampling and uploads run between attempts
 
         if uid:
             uid_str = "-".join([str(i) for i in uid])
@@ -74,85 +105,148 @@ except RuntimeError as e:
 
 pn532.SAM_configuration()
 
-# Rpi listen server requests loop
-while True:
-    try:
-        scanresponse = urequests.get(SCAN_CARD_URL)
-        measresponse = urequests.get(MEASURE_BODYTEMP_URL)
-        spo2response = urequests.get(SPO2_URL)
-        ekgresponse = urequests.get(EKG_URL)
-        bpresponse = urequests.get(BP_URL)
-        
-        scandata = scanresponse.json()
-        measdata = measresponse.json()
-        spo2data = spo2response.json()
-        ekgdata = ekgresponse.json()
-        bpdata = bpresponse.json()
-        
-        scanresponse.close()
-        measresponse.close()
-        spo2response.close()
-        ekgresponse.close()
-        bpresponse.close()
-        
-        if scandata == ('SCAN'):
-            print("Server started scanning.")
-            uid = scan_card()  
-            if uid:
-                print(f"UID {uid} is sent to server...")
-                response = urequests.post(SEND_TAG_URL, json={"uid": uid})
-                print("Response from server:", response.text)
-                response.close()
-            else:
-                print("Scan timeout!")
-                
-        if measdata == ('measure'):
-            print("Server started Body Temperature measurement.")
-            temp = bodytemp.get_bodytemp()  
-            if temp:
-                print(f"Bodytemp {temp:.2f}°C is sent to server...")
-                response = urequests.post(STORE_BODYTEMP_URL, json={"temperature": temp})
-                print("Response from server:", response.text)
-                response.close()
-            else:
-                print("Sensor not found.")
-            print("Test done.")
-            time.sleep(10)
-        
-        if spo2data == ('spo2start'):
-            print("Server started spo2 measurement.")
-            spo2_dat = spo2.measure_spo2()  
-            if spo2_dat:
-                print(f"Spo2 {spo2_dat:.2f} is sent to server...")
-                response = urequests.post(STORE_SPO2_URL, json={"spo2": spo2_dat})
-                print("Response from server:", response.text)
-                response.close()
-            else:
-                print("Sensor not found.")
-            print("Test done.")
-            time.sleep(10)
-        
-        if ekgdata == ('EKGstart'):
-            print("Server started EKG measurement.")
-            EKG_dat = EKG.measure_ekg()  
-            if EKG_dat:
-                print(f"Sent to server...")
-                response = urequests.post(STORE_EKG_URL, json={"EKG": EKG_dat})
-                print("Response from server:", response.text)
-                response.close()
-            else:
-                print("Sensor not found.")
-            print("Test done.")
-            time.sleep(10)
-        
-        if bpdata == ('BPstart'):
-            print("Server started BP measurement.")
-            bp_live.start_bp_measurement()  
-            print("Test done.")
-            time.sleep(10)
+# Sensors sharing a bus cannot measure at the same time: MAX30102 on I2C0 (SpO2, BP)
+# and ADC26 (EKG, BP ICQUANZX)
+i2c_lock = max30102bus.lock
+adc_lock = asyncio.Lock()
+onewire_lock = asyncio.Lock()  # DS18B20
+
+async def measure_bodytemp():
+    async with onewire_lock:
+        return await bodytemp.get_bodytemp()
+
+async def handle_scan():
+    print("Server started scanning.")
+    uid = await scan_card()  
+    if uid:
+        print(f"UID {uid} is sent to server...")
+        response = await client.post_json(SEND_TAG_PATH, {"uid": uid})
+        print("Response from server:", response.text)
+        response.close()
+    else:
+        print("Scan timeout!")
+
+async def handle_bodytemp():
+    print("Server started Body Temperature measurement.")
+    result = await measure_bodytemp()
+    if result:
+        temp, bound = result
+        print(f"Bodytemp {temp:.2f} ± {bound:.2f}°C is sent to server...")
+        await store_result(STORE_BODYTEMP_PATH, {"temperature": temp, "bound": bound})
+    else:
+        print("Sensor not found.")
+    print("Test done.")
+
+async def handle_spo2():
+    print("Server started spo2 measurement.")
+    async with i2c_lock:
+        spo2_dat = await spo2.measure_spo2()  
+    if spo2_dat:
+        print(f"Spo2 {spo2_dat:.2f} is sent to server...")
+        await store_result(STORE_SPO2_PATH, {"spo2": spo2_dat})
+    else:
+        print("Sensor not found.")
+    print("Test done.")
+
+async def handle_ekg():
+    print("Server started EKG measurement.")
+    async with adc_lock:
+        # Chunks are uploaded by EKG.stream_ekg while it records
+        recorded = await EKG.stream_ekg()
+    if not recorded:
+        print("EKG recording failed.")
+    print("Test done.")
+
+async def handle_bp():
+    print("Server started BP measurement.")
+    async with i2c_lock:
+        async with adc_lock:
+            await bp_live.start_bp_measurement()  
+    print("Test done.")
+
+async def timed(coro):
+    start = time.ticks_ms()
+    result = await coro
+    return result, time.ticks_diff(time.ticks_ms(), start)
+
+# Full check-up in one go: the DS18B20 (1-Wire, pin 28), MAX30102 (I2C0) and EKG
+# (ADC26) are independent, so temperature runs in the background while SpO2 and EKG
+# record together. BP needs the MAX30102 and ADC26 both and follows them; it
+# uploads through its own live stream. The rest goes up as one combined result.
+async def handle_session():
+    print("Server started a measurement session.")
+    start = time.ticks_ms()
+    temp_task = asyncio.create_task(timed(measure_bodytemp()))
+    result = {}
 
+    try:
+        async with i2c_lock:
+            async with adc_lock:
+                (spo2_dat, spo2_ms), (ekg_data, ekg_ms) = await asyncio.gather(
+                    timed(spo2.measure_spo2()), timed(EKG.measure_ekg()))
+                result.update(spo2=spo2_dat, ekg=ekg_data, sampleRate=EKG.SAMPLE_RATE)
+                _, bp_ms = await timed(bp_live.start_bp_measurement())
+
+        temp_result, temp_ms = await temp_task
+        if temp_result:
+            result["temperature"], result["bound"] = temp_result
+
+        result["elapsed"] = elapsed = time.ticks_diff(time.ticks_ms(), start)
+        print(f"Session: {elapsed / 1000:.1f} s (one after another: {(temp_ms + spo2_ms + ekg_ms + bp_ms) / 1000:.1f} s; "
+              f"temperature {temp_ms / 1000:.1f}, SpO2 {spo2_ms / 1000:.1f}, EKG {ekg_ms / 1000:.1f}, BP {bp_ms / 1000:.1f})")
+    except Exception as e:
+        print("Session failed:", e)
+        result["error"] = str(e)
+    finally:
+        # The server keeps the session (and its BP run) open until this upload,
+        # so a partial result is sent too
+        if "elapsed" not in result:
+            result["elapsed"] = time.ticks_diff(time.ticks_ms(), start)
+        await store_result(STORE_SESSION_PATH, result)
+    print("Test done.")
+
+COMMANDS = {
+    "SCAN": handle_scan,
+    "measure": handle_bodytemp,
+    "spo2start": handle_spo2,
+    "EKGstart": handle_ekg,
+    "BPstart": handle_bp,
+    "SESSIONstart": handle_session,
+}
+
+running = set()
+
+async def run_command(command):
+    start = time.ticks_ms()
+    try:
+        await COMMANDS[command]()
     except Exception as e:
         print("Error:", e)
-
-    time.sleep(1) 
-
+    finally:
+        running.discard(command)
+    print(f"{command} took {time.ticks_diff(time.ticks_ms(), start) / 1000:.1f} s")
+
+# Rpi listen server requests loop, the server holds the request until a command is pending.
+# Commands run as their own tasks so polling continues during a measurement.
+async def poll_commands():
+    path = COMMAND_PATH + "&boot=1"  # server forgets commands handed out before a restart
+    while True:
+        try:
+            response = await poller.get(path, timeout=COMMAND_WAIT + 5)
+            command = response.json().get("command")
+            response.close()
+            path = COMMAND_PATH
+
+            # The server answered, so queued results can go now
+            if not store.is_empty() and not draining:
+                asyncio.create_task(drain_outbox())
+
+            if command in COMMANDS and command not in running:
+                running.add(command)
+                asyncio.create_task(run_command(command))
+
+        except Exception as e:
+            print("Error:", e)
+            await asyncio.sleep(1)
+
+asyncio.run(poll_commands())
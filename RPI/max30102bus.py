@@ -0,0 +1,12 @@
+import uasyncio as asyncio
+from machine import I2C, Pin
+from max30102 import MAX30102
+
+# One I2C0 bus and MAX30102 driver for spo2.py and bp_live.py. Two drivers on the
+# same bus would each keep their own FIFO pointers and sensor settings; with one,
+# every measurement configures the sensor itself while it holds the lock.
+i2c = I2C(0, sda=Pin(4), scl=Pin(5), freq=400000)
+sensor = MAX30102(i2c=i2c)
+
+# Held for a whole SpO2 or BP measurement
+lock = asyncio.Lock()
@@ -1,48 +1,64 @@
 import time
-from machine import I2C, Pin
-from max30102 import MAX30102  
+import uasyncio as asyncio
+from machine import Pin
 import spo2algorithm  
-
-# Create I2C connection
-i2c = I2C(0, sda=Pin(4), scl=Pin(5), freq=400000)
-
-sensor = MAX30102(i2c=i2c)
+from max30102bus import i2c, sensor
+from fifo_reader import FifoReader, FIFO_DEPTH, rate_report
+from samplebuffer import HeapMonitor, zeros
 
 INTERRUPT_PIN = Pin(6, Pin.IN, Pin.PULL_UP)
 
+FIFO_ALMOST_FULL = 17  # samples in the FIFO when it interrupts, 32 deep
+FIFO_TIMEOUT_MS = 500  # drain anyway if no interrupt arrives
 
-def wait_for_data():
-    while INTERRUPT_PIN.value() == 1:
-        time.sleep(0.001)  
-
-# Data collection from MAX30102 FIFO.
-def gather_samples(sensor, sample_count=200, sample_rate=400):
-    red_list = []
-    ir_list = []
-
-    sensor.clear_fifo()  # clean FIFO
-
-    while len(red_list) < sample_count:
-        wait_for_data()  
-        sensor.check()  # get new FIFO data
+fifo = FifoReader(i2c, INTERRUPT_PIN, channels=2, almost_full=FIFO_ALMOST_FULL)
+pairs = zeros('I', FIFO_DEPTH * 2)  # red/IR pairs of one burst read
 
-        while sensor.available() > 0 and len(red_list) < sample_count:
-            red_list.append(sensor.get_red())
-            ir_list.append(sensor.get_ir())
 
-        time.sleep(0.005)  
+# Data collection from MAX30102 FIFO straight into the SpO2 estimator (reused between attempts).
+# The task sleeps until the FIFO-almost-full interrupt, then reads the whole FIFO in one
+# I2C transaction and feeds each pair to the estimator, so the SpO2 value is ready when
+# the last sample is in. From quality_samples on, every burst is checked with
+# spo2algorithm.signal_quality and the window is aborted as soon as it is unusable.
+# Returns None for a complete window, or the reason it was aborted.
+async def gather_samples(sensor, sample_count=200, sample_rate=400, estimator=None,
+                         quality_samples=spo2algorithm.QUALITY_SAMPLES):
+    if estimator is None:
+        estimator = spo2algorithm.SpO2Estimator()
+    estimator.reset()
 
-    return red_list, ir_list
+    heap = HeapMonitor("SpO2")
+    heap.start()
 
+    fifo.start()
+    start = time.ticks_ms()
+    rejected = None
 
-def adjust_led_power(sensor, red_list, ir_list):
+    try:
+        while len(estimator) < sample_count:
+            await fifo.wait(FIFO_TIMEOUT_MS)
+            n = fifo.read(pairs)
+            for i in range(min(n, sample_count - len(estimator))):
+                estimator.add(pairs[2 * i], pairs[2 * i + 1])
+            heap.sample()
+
+            if quality_samples and quality_samples <= len(estimator) < sample_count:
+                rejected = spo2algorithm.signal_quality(estimator)
+                if rejected:
+                    break
+    finally:
+        fifo.stop()
+
+    rate_report("SpO2", fifo, start)
+    heap.report()
+    return rejected
+
+
+def adjust_led_power(sensor, avg_red, avg_ir):
     """
     If the signal level is too low, increase the LED current; 
     if it is too high, decrease the LED current.
     """
-    avg_red = sum(red_list) / len(red_list) if len(red_list) > 0 else 0
-    avg_ir = sum(ir_list) / len(ir_list) if len(ir_list) > 0 else 0
-
     try:
         current_led_power = ord(sensor.i2c_read_register(0x0C))  
     except:
@@ -62,7 +78,8 @@ def adjust_led_power(sensor, red_list, ir_list):
         print(f"LED power reduced: {new_power}")
 
 
-def measure_spo2(max_attempts=5, min_valid_spo2=95):
+# Aborted windows are cheap, so they have their own limit next to max_attempts
+async def measure_spo2(max_attempts=5, min_valid_spo2=95, max_rejected=10):
 
     sensor.setup_sensor(
         led_mode=2,         
@@ -78,16 +95,27 @@ def measure_spo2(max_attempts=5, min_valid_spo2=95):
     print("SpO2 sensor started.")
 
     best_spo2 = 0  
+    estimator = spo2algorithm.SpO2Estimator()
 
-    for attempt in range(1, max_attempts + 1):
-        print(f"\n🔄 {attempt}. try...")
+    attempt = 0
+    rejected = 0
+    while attempt < max_attempts and rejected < max_rejected:
+        print(f"\n🔄 {attempt + 1}. try...")
 
-        red_list, ir_list = gather_samples(sensor, sample_count=200, sample_rate=400)
+        reason = await gather_samples(sensor, sample_count=200, sample_rate=400, estimator=estimator)
 
         # Dynamically adjust LED power
-        adjust_led_power(sensor, red_list, ir_list)
+        adjust_led_power(sensor, estimator.mean_red(), estimator.mean_ir())
+
+        if reason:
+            rejected += 1
+            print(f"Bad signal ({reason}) after {len(estimator)} samples, retrying...")
+            await asyncio.sleep_ms(100)  # let the new LED current settle
+            continue
+
+        attempt += 1
 
-        spo2 = spo2algorithm.process_spo2(red_list, ir_list, sample_rate=400)
+        spo2 = estimator.result()
         print(f"SpO2: {spo2}%")
 
         if spo2 > best_spo2:
@@ -99,7 +127,7 @@ def measure_spo2(max_attempts=5, min_valid_spo2=95):
 
         print("invalid try...")
 
-        time.sleep(1)  
+        await asyncio.sleep(1)  
 
     print(f"Result: {best_spo2}%")
     return best_spo2  
@@ -107,7 +135,7 @@ def measure_spo2(max_attempts=5, min_valid_spo2=95):
 
 if __name__ == "__main__":
     print("SpO2 started.")
-    final_spo2 = measure_spo2()
+    final_spo2 = asyncio.run(measure_spo2())
     print(f"Result: {final_spo2}%")
 
 
@@ -49,6 +49,11 @@ def process_spo2(red_list, ir_list, sample_rate=400):
     red_dc = mean(red_list[-tail_len:])
     ir_dc  = mean(ir_list[-tail_len:])
 
+    return spo2_from_components(red_ac, ir_ac, red_dc, ir_dc)
+
+
+# AC peak-to-peak and DC levels of both channels to a clamped SpO2 value
+def spo2_from_components(red_ac, ir_ac, red_dc, ir_dc):
     ratio = ((red_ac / red_dc) / (ir_ac / ir_dc)) if ir_dc != 0 and red_dc != 0 else 0
 
     spo2 = 110 - 25 * ratio
@@ -59,3 +64,109 @@ def process_spo2(red_list, ir_list, sample_rate=400):
         spo2 = 70
 
     return round(spo2, 1)
+
+
+# Signal quality gate, evaluated on the first QUALITY_SAMPLES samples of a window
+QUALITY_SAMPLES = 48
+CLIP_LEVEL = 0x3FF00    # 18 bit ADC close to full scale
+MAX_CLIPPED = 2         # clipped samples tolerated
+MIN_DC = 8000           # below this no finger, or LED too weak
+MIN_PERFUSION = 0.0005  # IR AC/DC, 0.05 %: pulse lost in the noise
+MAX_PERFUSION = 0.1     # 10 %: movement, not a pulse
+
+
+class SpO2Estimator:
+    """
+    process_spo2 one sample at a time. Keeps the IIR baselines, the AC
+    min/max and the last tail_len samples of each channel, so memory does not
+    grow with the window and result() is ready as soon as the last sample is
+    in. Gives the same value as process_spo2 over the same samples.
+    """
+    def __init__(self, tail_len=10, alpha=0.05):
+        self.tail_len = tail_len
+        self.alpha = alpha
+        self.red_tail = [0] * tail_len
+        self.ir_tail = [0] * tail_len
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.red_sum = 0
+        self.ir_sum = 0
+        self.clipped = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, red_val, ir_val):
+        alpha = self.alpha
+        if self.count == 0:
+            self.red_baseline = red_val
+            self.ir_baseline = ir_val
+
+        # IIR update
+        self.red_baseline = alpha * red_val + (1 - alpha) * self.red_baseline
+        self.ir_baseline = alpha * ir_val + (1 - alpha) * self.ir_baseline
+
+        red_ac = red_val - self.red_baseline
+        ir_ac = ir_val - self.ir_baseline
+        if self.count == 0:
+            self.red_max = self.red_min = red_ac
+            self.ir_max = self.ir_min = ir_ac
+        else:
+            if red_ac > self.red_max:
+                self.red_max = red_ac
+            elif red_ac < self.red_min:
+                self.red_min = red_ac
+            if ir_ac > self.ir_max:
+                self.ir_max = ir_ac
+            elif ir_ac < self.ir_min:
+                self.ir_min = ir_ac
+
+        if red_val >= CLIP_LEVEL or ir_val >= CLIP_LEVEL:
+            self.clipped += 1
+
+        i = self.count % self.tail_len
+        self.red_tail[i] = red_val
+        self.ir_tail[i] = ir_val
+        self.red_sum += red_val
+        self.ir_sum += ir_val
+        self.count += 1
+
+    def mean_red(self):
+        return self.red_sum / self.count if self.count else 0
+
+    def mean_ir(self):
+        return self.ir_sum / self.count if self.count else 0
+
+    def tail_mean(self, tail):
+        # Oldest to newest, same order as mean() over the list tail
+        start = self.count % self.tail_len
+        total = 0
+        for i in range(self.tail_len):
+            total += tail[(start + i) % self.tail_len]
+        return total / self.tail_len
+
+    def result(self):
+        if self.count < self.tail_len:
+            return 0
+
+        return spo2_from_components(self.red_max - self.red_min, self.ir_max - self.ir_min,
+                                    self.tail_mean(self.red_tail), self.tail_mean(self.ir_tail))
+
+
+# None when the samples so far look usable, otherwise the reason to abort the window
+def signal_quality(estimator):
+    if estimator.clipped > MAX_CLIPPED:
+        return "clipping"
+
+    if estimator.mean_red() < MIN_DC or estimator.mean_ir() < MIN_DC:
+        return "low signal"
+
+    perfusion = (estimator.ir_max - estimator.ir_min) / estimator.mean_ir()
+    if perfusion < MIN_PERFUSION:
+        return "low perfusion"
+    if perfusion > MAX_PERFUSION:
+        return "motion"
+
+    return None
@@ -1,19 +1,25 @@
+import os
+import sys
 import serial
 import json
 import time
 import numpy as np
-from scipy.signal import butter, filtfilt, find_peaks
+
+# Streaming bandpass + peak detector and the BP pipeline shared with the server code in src
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from stream_filter import StreamingPeaks
+from bp_pipeline import PROFILES, ptt_from_times, estimate_parameters, estimate_sbp
 
 SERIAL_PORT = "COM3"
 ser = serial.Serial(SERIAL_PORT, 115200, timeout=1)
 
-timestamps_max = []
-ir_values_max = []
-peaks_max = []
+WINDOW_SIZE = 200
+PROFILE = PROFILES["bp_test"]
 
-timestamps_icq = []
-ir_values_icq = []
-peaks_icq = []
+# Bandpass 0.8-2.5 Hz at 50 Hz, peaks at least 1 s apart, height over the mean of
+# the last WINDOW_SIZE filtered samples
+peaks_max = StreamingPeaks(**PROFILE["ir"], window=WINDOW_SIZE, **PROFILE["filter"])
+peaks_icq = StreamingPeaks(**PROFILE["icq"], window=WINDOW_SIZE, **PROFILE["filter"])
 
 baseline_max = []
 baseline_icq = []
@@ -31,46 +37,6 @@ exercise = input("Haftada en az 3 gün düzenli spor yapıyor musunuz? (E/H): ")
 hypertension = input("Daha önce hipertansiyon veya diyabet tanısı aldınız mı? (E/H): ").strip().upper() == "E"
 bp_status = input("Tansiyonunuz genellikle nasıl? (Yüksek/Y, Düşük/D, Normal/N): ").strip().upper()
 
-def estimate_parameters(age, gender, smoking, exercise, hypertension, bp_status):
-
-    # Test values
-    a0 = 52.6  
-    a1 = 4900  
-    a2 = 10  
-
-    if age > 30:
-        a0 = a0 + (age - 30) * 0.25  
-        a1 = a1 + (age - 30) * 80  
-        a2 = a2 + (age - 30) * 0.2  
-
-    if gender == "K":
-        a0 -= 3  
-
-    if smoking:
-        a1 *= 1.10
-        a2 *= 1.10
-
-    if exercise:
-        a1 *= 0.95  
-        a2 *= 0.95  
-
-    if hypertension:
-        a0 += 7
-        a1 *= 1.15
-        a2 *= 1.15
-
-    if bp_status == "D":
-        a0 -= 5  
-        a1 *= 0.90  
-        a2 *= 0.90  
-
-    if bp_status == "Y":
-        a0 += 10  
-        a1 *= 1.20  
-        a2 *= 1.20  
-
-    return a0, a1, a2
-
 a0, a1, a2 = estimate_parameters(age, gender, smoking, exercise, hypertension, bp_status)
 
 # Serial read
@@ -85,79 +51,13 @@ def read_serial_data():
         print("Seri veri okuma hatası:", e)
     return None
 
-def bandpass_filter(signal, fs=50.0, lowcut=0.8, highcut=2.5, order=6):
-    nyq = 0.5 * fs
-    low = lowcut / nyq
-    high = highcut / nyq
-    b, a = butter(order, [low, high], btype='band')
-    return filtfilt(b, a, signal)
-
-WINDOW_SIZE = 200
-
-def rolling_detect_peaks(signal_list, time_list, sensor_name, peak_list):
-    if len(signal_list) < WINDOW_SIZE:
-        return
-
-    window_signal = signal_list[-WINDOW_SIZE:]
-    window_times = time_list[-WINDOW_SIZE:]
-
-    filtered = bandpass_filter(
-        np.array(window_signal),
-        fs=50.0,
-        lowcut=0.8,
-        highcut=2.5,
-        order=6
-    )
-
-    base = np.mean(filtered)
-    if sensor_name == "MAX30102":
-        height_th = base + 300
-        prominence_th = 150
-    else:
-        height_th = base + 0.005  
-        prominence_th = 0.002  
-
-    peaks, _ = find_peaks(
-        filtered,
-        distance=50,  
-        height=height_th,
-        prominence=prominence_th
-    )
-
-    new_peaks_times = [window_times[i] for i in peaks]
-
-    for pt in new_peaks_times:
-        if pt not in peak_list:
-            peak_list.append(pt)
-
-    peak_list.sort()
-
-# PTT test calc
+# PTT (ms) of the last 3 MAX30102 peaks, each paired with the nearest ICQUANZX peak
 def calculate_ptt(peaks1, peaks2):
-    if len(peaks1) < 3 or len(peaks2) < 3:
+    if len(peaks1) < PROFILE["min_peaks"] or len(peaks2) < PROFILE["min_peaks"]:
         return None
 
-    diffs = []
-    for t1 in peaks1[-3:]:  
-        t2 = min(peaks2, key=lambda x: abs(x - t1))
-        fark = abs(t1 - t2)
-
-        fark = fark / 1000.0  
-
-        if 50 <= fark <= 600:
-            diffs.append(fark)
-    
-    if len(diffs) == 0:
-        return None
-
-    return np.mean(diffs)  
-
-# SBP test calc
-def estimate_sbp(ptt_ms, a0, a1, a2):
-    ptt_s = ptt_ms / 1000.0  
-    sbp = a0 + np.sqrt(a1 + (a2 / (ptt_s ** 2)))
-
-    return sbp
+    return ptt_from_times(peaks1.last(PROFILE["beats"]), peaks2.peaks, PROFILE["beats"], PROFILE["match"],
+                          PROFILE["min_ptt"], PROFILE["max_ptt"])
 
 # Sensor Noise Measurement
 print("Gürültü Ölçümü")
@@ -185,18 +85,13 @@ while not done:
     if data:
         pico_time = data["pico_time"]
 
-        timestamps_max.append(pico_time)
-        ir_values_max.append(data["max30102_ir"])
-
-        timestamps_icq.append(pico_time)
-        ir_values_icq.append(data["icquanzx"])
-
-        if len(ir_values_max) >= 200:
-            rolling_detect_peaks(ir_values_max, timestamps_max, "MAX30102", peaks_max)
-        if len(ir_values_icq) >= 200:
-            rolling_detect_peaks(ir_values_icq, timestamps_icq, "ICQUANZX", peaks_icq)
+        new_max = peaks_max.add(data["max30102_ir"], pico_time)
+        new_icq = peaks_icq.add(data["icquanzx"], pico_time)
 
-        ptt_val = calculate_ptt(peaks_max, peaks_icq)
+        # PTT only changes when a new peak was confirmed
+        ptt_val = None
+        if new_max is not None or new_icq is not None:
+            ptt_val = calculate_ptt(peaks_max, peaks_icq)
         if ptt_val:
             ptt_results.append(ptt_val)
             print(f"PTT found: {ptt_val:.2f} ms (len {len(ptt_results)})")
@@ -4,6 +4,7 @@ const EKGResultSchema = new mongoose.Schema({
     thepatient: { type: String, required: true },
     result: [{ type: Number, required: true }],  
     testType: { type: String, required: true },
+    sampleRate: { type: Number },  // Hz, missing on records from before streamed EKG
     createdAt: { type: Date, default: Date.now }
 });
 
@@ -0,0 +1,10 @@
+"""
+Cuffless blood pressure pipeline shared by src/calculate_ptt.py and TEST/bp_test.py:
+bandpass filter -> peak detection -> IR/ICQ peak pairing -> PTT -> SBP, on NumPy
+arrays with one row per patient.
+"""
+from .filters import bandpass_sos, bandpass
+from .peaks import detect_peaks
+from .ptt import match_peaks, ptt_per_beat, ptt_from_times, pair_batch, ptt_batch
+from .calibration import estimate_parameters, estimate_sbp
+from .pipeline import PROFILES, STAGES, StageTimes, Pipeline
@@ -0,0 +1,51 @@
+import numpy as np
+
+# SBP = a0 + sqrt(a1 + a2 / PTT^2), PTT in seconds. The parameters start from test
+# values and are adjusted from the patient questionnaire (TEST/bp_test.py).
+A0 = 52.6
+A1 = 4900
+A2 = 10
+
+
+# Calibration parameters for one patient or arrays of patients. gender is "E"/"K",
+# bp_status "Y" (high), "D" (low) or "N"; the other flags are booleans.
+def estimate_parameters(age, gender, smoking, exercise, hypertension, bp_status):
+    age = np.asarray(age, dtype=np.float64)
+    gender = np.asarray(gender)
+    bp_status = np.asarray(bp_status)
+
+    older = np.maximum(age - 30, 0)
+    a0 = A0 + older * 0.25
+    a1 = A1 + older * 80
+    a2 = A2 + older * 0.2
+
+    a0 = np.where(gender == "K", a0 - 3, a0)
+
+    scale = np.where(smoking, 1.10, 1.0)
+    a1, a2 = a1 * scale, a2 * scale
+
+    scale = np.where(exercise, 0.95, 1.0)
+    a1, a2 = a1 * scale, a2 * scale
+
+    a0 = np.where(hypertension, a0 + 7, a0)
+    scale = np.where(hypertension, 1.15, 1.0)
+    a1, a2 = a1 * scale, a2 * scale
+
+    low = bp_status == "D"
+    a0 = np.where(low, a0 - 5, a0)
+    scale = np.where(low, 0.90, 1.0)
+    a1, a2 = a1 * scale, a2 * scale
+
+    high = bp_status == "Y"
+    a0 = np.where(high, a0 + 10, a0)
+    scale = np.where(high, 1.20, 1.0)
+    a1, a2 = a1 * scale, a2 * scale
+
+    return a0, a1, a2
+
+
+# Systolic pressure (mmHg) from PTT in ms. Broadcasts, so a (patients, 1) PTT column
+# against (k,) parameter arrays gives a patients x k calibration sweep.
+def estimate_sbp(ptt_ms, a0, a1, a2):
+    ptt_s = np.asarray(ptt_ms, dtype=np.float64) / 1000.0
+    return a0 + np.sqrt(a1 + (a2 / (ptt_s ** 2)))
@@ -0,0 +1,15 @@
+from functools import lru_cache
+import numpy as np
+from scipy.signal import butter, sosfiltfilt
+
+
+# Butterworth bandpass as second-order sections, designed once per parameter set
+@lru_cache(maxsize=None)
+def bandpass_sos(fs=50.0, lowcut=0.8, highcut=2.5, order=6):
+    nyq = 0.5 * fs
+    return butter(order, [lowcut / nyq, highcut / nyq], btype='band', output='sos')
+
+
+# Zero-phase bandpass along the last axis, one row per patient (or a single signal)
+def bandpass(signals, fs=50.0, lowcut=0.8, highcut=2.5, order=6):
+    return sosfiltfilt(bandpass_sos(fs, lowcut, highcut, order), np.asarray(signals, dtype=np.float64), axis=-1)
@@ -0,0 +1,29 @@
+import numpy as np
+from scipy.signal import find_peaks
+
+
+# Peak indices for each row of signals (find_peaks has no batch form).
+# height is relative to the row mean, as in the rolling bp_test.py detector.
+# When a row has fewer than min_peaks peaks it is searched again with the
+# `fallback` find_peaks arguments, as in calculate_ptt.py.
+# Rows whose standard deviation is below min_std are too flat and get no peaks.
+def detect_peaks(signals, distance, prominence, height=None, fallback=None, min_peaks=3, min_std=None):
+    signals = np.atleast_2d(np.asarray(signals))
+    heights = None
+    if height is not None:
+        heights = signals.mean(axis=-1) + height
+    flat = np.zeros(len(signals), dtype=bool)
+    if min_std is not None:
+        flat = signals.std(axis=-1) < min_std
+
+    peaks = []
+    for row, signal in enumerate(signals):
+        if flat[row]:
+            peaks.append(np.zeros(0, dtype=np.intp))
+            continue
+        found, _ = find_peaks(signal, distance=distance, prominence=prominence,
+                              height=None if heights is None else heights[row])
+        if fallback and len(found) < min_peaks:
+            found, _ = find_peaks(signal, **fallback)
+        peaks.append(found)
+    return peaks
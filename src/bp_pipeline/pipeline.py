@@ -0,0 +1,122 @@
+import time
+import numpy as np
+from .filters import bandpass
+from .peaks import detect_peaks
+from .ptt import pair_batch, ptt_batch
+from .calibration import estimate_sbp
+
+# Settings of the two existing detectors. PTT bounds are in timestamp units (ms).
+PROFILES = {
+    # src/calculate_ptt.py: raw signals, looser retry when a channel has < 3 peaks
+    "window": {
+        "filter": None,
+        "ir": {"distance": 15, "prominence": 0.5, "min_std": 0.5,
+               "fallback": {"distance": 10, "prominence": 0.2}},
+        "icq": {"distance": 20, "prominence": 0.0001, "min_std": 0.0001,
+                "fallback": {"distance": 15, "prominence": 0.00005}},
+        "min_peaks": 3,
+        "beats": 3,
+        "match": "nearest",
+        "min_ptt": 100,
+        "max_ptt": 1500,
+    },
+    # TEST/bp_test.py: 0.8-2.5 Hz bandpass at 50 Hz, height over the window mean
+    "bp_test": {
+        "filter": {"fs": 50.0, "lowcut": 0.8, "highcut": 2.5, "order": 6},
+        "ir": {"distance": 50, "prominence": 150, "height": 300},
+        "icq": {"distance": 50, "prominence": 0.002, "height": 0.005},
+        "min_peaks": 3,
+        "beats": 3,
+        "match": "nearest",
+        "min_ptt": 50,
+        "max_ptt": 600,
+    },
+}
+
+STAGES = ("filter", "peaks", "pairing", "ptt", "sbp")
+
+
+# Timing hook that adds up seconds and calls per stage: Pipeline(on_stage=StageTimes())
+class StageTimes:
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.calls = dict.fromkeys(STAGES, 0)
+
+    def __call__(self, stage, seconds, patients):
+        self.seconds[stage] += seconds
+        self.calls[stage] += 1
+
+    def report(self, patients=None):
+        parts = []
+        for stage in STAGES:
+            if self.calls[stage]:
+                seconds = self.seconds[stage]
+                parts.append(f"{stage} {seconds / patients * 1e6:.1f} us/patient" if patients
+                             else f"{stage} {seconds * 1000:.2f} ms")
+        return "  ".join(parts)
+
+
+# Cuffless BP for a batch of patients: filter -> peaks -> pairing -> PTT -> SBP.
+# Signals are (patients, samples) arrays of equal length, or one (samples,) window.
+# on_stage(stage, seconds, patients) is called after every stage that ran.
+# Keyword arguments override single profile entries, e.g. Pipeline("bp_test", beats=5).
+class Pipeline:
+    def __init__(self, profile="window", on_stage=None, **overrides):
+        self.settings = dict(PROFILES[profile])
+        self.settings.update(overrides)
+        self.on_stage = on_stage
+
+    def stage(self, name, patients, fn, *args, **kwargs):
+        if self.on_stage is None:
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.on_stage(name, time.perf_counter() - start, patients)
+        return result
+
+    def filter(self, ir_values, icq_values):
+        options = self.settings["filter"]
+        if not options:
+            return ir_values, icq_values
+        return bandpass(ir_values, **options), bandpass(icq_values, **options)
+
+    def detect(self, ir_values, icq_values):
+        return (detect_peaks(ir_values, **self.settings["ir"]),
+                detect_peaks(icq_values, **self.settings["icq"]))
+
+    # Returns a dict of per-patient arrays: "ptt" (NaN without a valid beat or with
+    # fewer than min_peaks peaks on a channel), "beats", "ir_peaks" and "icq_peaks"
+    # counts, and "sbp" when calibration parameters (a0, a1, a2) are given; with
+    # parameter arrays of shape (k,) "sbp" is patients x k.
+    def run(self, timestamps, ir_values, icq_values, parameters=None):
+        settings = self.settings
+        ir_values = np.atleast_2d(np.asarray(ir_values, dtype=np.float64))
+        icq_values = np.atleast_2d(np.asarray(icq_values, dtype=np.float64))
+        if ir_values.shape != icq_values.shape:
+            raise ValueError("IR and ICQ shapes differ")
+        patients = len(ir_values)
+
+        if settings["filter"]:
+            ir_values, icq_values = self.stage("filter", patients, self.filter, ir_values, icq_values)
+        peaks_ir, peaks_icq = self.stage("peaks", patients, self.detect, ir_values, icq_values)
+        ir_counts = np.array([len(p) for p in peaks_ir])
+        icq_counts = np.array([len(p) for p in peaks_icq])
+
+        # Patients with too few peaks on either channel get no PTT
+        min_peaks = settings["min_peaks"]
+        few = (ir_counts < min_peaks) | (icq_counts < min_peaks)
+        if few.any():
+            none = np.zeros(0, dtype=np.intp)
+            peaks_ir = [none if f else p for f, p in zip(few, peaks_ir)]
+
+        rows, ir, icq = self.stage("pairing", patients, pair_batch, peaks_ir, peaks_icq,
+                                   settings["beats"], settings["match"])
+        ptt, beats = self.stage("ptt", patients, ptt_batch, timestamps, rows, ir, icq, patients,
+                                settings["min_ptt"], settings["max_ptt"])
+
+        result = {"ptt": ptt, "beats": beats, "ir_peaks": ir_counts, "icq_peaks": icq_counts}
+        if parameters is not None:
+            a0, a1, a2 = (np.asarray(p, dtype=np.float64) for p in parameters)
+            column = ptt[:, None] if a0.ndim == 1 else ptt
+            result["sbp"] = self.stage("sbp", patients, estimate_sbp, column, a0, a1, a2)
+        return result
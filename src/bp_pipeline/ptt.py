@@ -0,0 +1,103 @@
+import numpy as np
+
+
+# For each IR peak, index into peaks_icq of the paired ICQ peak (-1 if none).
+# "nearest": closest ICQ peak in either direction (earlier one on ties),
+# "following": first ICQ peak at or after the IR peak.
+# peaks_icq must be sorted, which find_peaks guarantees; O(P log Q).
+def match_peaks(peaks_ir, peaks_icq, match="nearest"):
+    peaks_ir = np.asarray(peaks_ir)
+    peaks_icq = np.asarray(peaks_icq)
+
+    if len(peaks_icq) == 0:
+        return np.full(len(peaks_ir), -1, dtype=np.intp)
+
+    right = np.searchsorted(peaks_icq, peaks_ir, side="left")
+
+    if match == "following":
+        return np.where(right < len(peaks_icq), right, -1)
+
+    if match != "nearest":
+        raise ValueError(f"Unknown match mode: {match}")
+
+    left = np.clip(right - 1, 0, len(peaks_icq) - 1)
+    right = np.clip(right, 0, len(peaks_icq) - 1)
+    left_dist = np.abs(peaks_ir - peaks_icq[left])
+    right_dist = np.abs(peaks_icq[right] - peaks_ir)
+    return np.where(left_dist <= right_dist, left, right)
+
+
+# Per-beat PTT (timestamp units) for every IR peak with a paired ICQ peak inside the bounds
+def ptt_per_beat(timestamps, peaks_ir, peaks_icq, match="nearest", min_ptt=100, max_ptt=1500):
+    peaks_ir = np.asarray(peaks_ir)
+    peaks_icq = np.asarray(peaks_icq)
+
+    paired = match_peaks(peaks_ir, peaks_icq, match)
+    valid = paired >= 0
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    diffs = np.abs(timestamps[peaks_ir[valid]] - timestamps[peaks_icq[paired[valid]]])
+
+    return diffs[(diffs >= min_ptt) & (diffs <= max_ptt)]
+
+
+# Mean PTT of the last `beats` IR peaks from peak timestamps (live detectors keep
+# times, not indices), None when no beat is inside the bounds
+def ptt_from_times(times_ir, times_icq, beats=3, match="nearest", min_ptt=100, max_ptt=1500):
+    times_ir = np.asarray(times_ir, dtype=np.int64)
+    times_icq = np.asarray(times_icq, dtype=np.int64)
+    if beats:
+        times_ir = times_ir[-beats:]
+
+    paired = match_peaks(times_ir, times_icq, match)
+    valid = paired >= 0
+    diffs = np.abs(times_ir[valid] - times_icq[paired[valid]])
+    diffs = diffs[(diffs >= min_ptt) & (diffs <= max_ptt)]
+    return float(np.mean(diffs)) if len(diffs) else None
+
+
+# Pairs the last `beats` IR peaks of every row (all if 0/None) with ICQ peaks of the
+# same row, for the whole batch in one match_peaks call: each row's peak indices are
+# offset by row * stride, with stride large enough that a peak in another row is
+# always farther away than any peak in the same row.
+# Returns (rows, ir, icq) sample indices of the paired beats.
+def pair_batch(peaks_ir, peaks_icq, beats=3, match="nearest"):
+    ir_counts = np.array([len(p) for p in peaks_ir], dtype=np.intp)
+    icq_counts = np.array([len(p) for p in peaks_icq], dtype=np.intp)
+    empty = np.zeros(0, dtype=np.intp)
+    ir = np.concatenate([np.asarray(p, dtype=np.intp) for p in peaks_ir]) if len(peaks_ir) else empty
+    icq = np.concatenate([np.asarray(p, dtype=np.intp) for p in peaks_icq]) if len(peaks_icq) else empty
+    ir_rows = np.repeat(np.arange(len(peaks_ir)), ir_counts)
+    icq_rows = np.repeat(np.arange(len(peaks_icq)), icq_counts)
+
+    if beats:
+        from_end = np.cumsum(ir_counts)[ir_rows] - np.arange(len(ir))
+        keep = from_end <= beats
+        ir, ir_rows = ir[keep], ir_rows[keep]
+
+    if not len(ir) or not len(icq):
+        return empty, empty, empty
+
+    stride = 2 * (max(ir.max(), icq.max()) + 1)
+    paired = match_peaks(ir_rows * stride + ir, icq_rows * stride + icq, match)
+    valid = paired >= 0
+    valid[valid] = icq_rows[paired[valid]] == ir_rows[valid]
+    return ir_rows[valid], ir[valid], icq[paired[valid]]
+
+
+# Mean PTT and beat count per row from pair_batch output. timestamps is
+# (patients, samples) or one (samples,) row shared by all patients.
+# Rows without a beat inside the bounds get NaN.
+def ptt_batch(timestamps, rows, ir, icq, patients, min_ptt=100, max_ptt=1500):
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if timestamps.ndim == 1:
+        diffs = np.abs(timestamps[ir] - timestamps[icq])
+    else:
+        diffs = np.abs(timestamps[rows, ir] - timestamps[rows, icq])
+
+    inside = (diffs >= min_ptt) & (diffs <= max_ptt)
+    rows = rows[inside]
+    beats = np.bincount(rows, minlength=patients)
+    sums = np.bincount(rows, weights=diffs[inside], minlength=patients)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ptt = np.where(beats > 0, sums / beats, np.nan)
+    return ptt, beats
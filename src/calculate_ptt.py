@@ -1,22 +1,128 @@
+import os
 import sys
 import json
+import base64
+import argparse
+import threading
 import numpy as np
-from scipy.signal import find_peaks
+from ptt_stream import StreamingPTT
+import bp_pipeline
+
+# Device frame format, shared with the firmware in RPI/lib
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RPI", "lib"))
+import wireformat
+
+
+# Binary frame: n int32 timestamps, n uint32 IR, n float32 ICQ (little-endian, columnar)
+FRAME_SAMPLE_SIZE = 4 + 4 + 4
+
+
+def decode_frame(frame):
+    if len(frame) % FRAME_SAMPLE_SIZE:
+        raise ValueError("Invalid binary frame length")
+
+    n = len(frame) // FRAME_SAMPLE_SIZE
+    timestamps = np.frombuffer(frame, dtype="<i4", count=n, offset=0)
+    ir_values = np.frombuffer(frame, dtype="<u4", count=n, offset=4 * n)
+    icq_values = np.frombuffer(frame, dtype="<f4", count=n, offset=8 * n)
+    return timestamps, ir_values, icq_values
+
+
+def encode_frame(timestamps, ir_values, icq_values):
+    return (np.asarray(timestamps, dtype="<i4").tobytes()
+            + np.asarray(ir_values, dtype="<u4").tobytes()
+            + np.asarray(icq_values, dtype="<f4").tobytes())
+
+
+WIRE_DTYPES = {"H": "<u2", "I": "<u4"}
+
+
+# Zigzag varint differences (see wireformat.zigzag_varints) without a Python loop:
+# every byte is shifted into place and the bytes of each value are summed.
+def decode_varints(data, count):
+    data = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(data < 0x80)
+    if len(ends) != count or (count and ends[-1] != len(data) - 1):
+        raise ValueError("Varint column does not match the sample count")
+    if not count:
+        return np.zeros(0, dtype=np.int64)
+
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    position = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    z = np.add.reduceat((data & 0x7F).astype(np.uint64) << (7 * position).astype(np.uint64), starts)
+    return (z >> np.uint64(1)).astype(np.int64) ^ -(z & np.uint64(1)).astype(np.int64)
+
+
+# Device frame (RPI/lib/wireformat.py) to (header, ticks or None, channel arrays), vectorized
+def decode_wire_frame(frame):
+    header = wireformat.read_header(frame)
+    count = header["count"]
+    varint = header["flags"] & wireformat.FLAG_VARINT
+
+    columns = []
+    for typecode, delta, offset, size in wireformat.layout(header, frame):
+        dtype = WIRE_DTYPES[typecode]
+        if not delta:
+            columns.append(np.frombuffer(frame, dtype=dtype, count=count, offset=offset))
+            continue
+        width = wireformat.SIZES[typecode]
+        first = np.frombuffer(frame, dtype=dtype, count=1, offset=offset).astype(np.int64)
+        if varint:
+            deltas = decode_varints(frame[offset + width + 4:offset + size], count - 1)
+        else:
+            deltas = np.frombuffer(frame, dtype="<i2", count=count - 1, offset=offset + width)
+        columns.append(np.concatenate((first, first[0] + np.cumsum(deltas, dtype=np.int64))))
+
+    ticks = columns.pop(0) if header["flags"] & wireformat.FLAG_TICKS else None
+    return header, ticks, columns
 
-try:
-    sys.stdout.reconfigure(encoding='utf-8')
 
-    # Read incoming data
-    input_data = sys.stdin.read()
-    sensor_data = json.loads(input_data)
+def load_wire_frame(frame):
+    header, ticks, channels = decode_wire_frame(frame)
+    if header["sensor"] != wireformat.SENSOR_BP:
+        raise ValueError("Not a BP frame")
+    ir_values, red_values, icq_values = channels
 
-    if len(sensor_data) < 10:
-        print(json.dumps({"success": False, "error": "Not enough data"}))
-        sys.exit(0)
+    # Ticks are milliseconds; without them the samples are evenly spaced
+    if ticks is None:
+        ticks = header["start_tick"] + np.arange(header["count"]) * 1000 / header["sample_rate"]
+    return ticks, ir_values, icq_values / 65535
+
+
+# Sensor data to (timestamps, ir_values, icq_values) arrays.
+# Accepts the legacy list of per-sample dicts, parallel arrays keyed like the
+# sample dict, a device frame or a binary frame (bytes).
+def load_sensor_data(sensor_data):
+    if isinstance(sensor_data, (bytes, bytearray, memoryview)):
+        if wireformat.is_frame(sensor_data):
+            return load_wire_frame(sensor_data)
+        return decode_frame(sensor_data)
+
+    if isinstance(sensor_data, dict):
+        timestamps = np.asarray(sensor_data["timestamp"])
+        ir_values = np.asarray(sensor_data["max30102_ir"])
+        icq_values = np.asarray(sensor_data["icquanzx"])
+        if not len(timestamps) == len(ir_values) == len(icq_values):
+            raise ValueError("Column lengths differ")
+        return timestamps, ir_values, icq_values
 
     timestamps = np.array([d["timestamp"] for d in sensor_data])
     ir_values = np.array([d["max30102_ir"] for d in sensor_data])
     icq_values = np.array([d["icquanzx"] for d in sensor_data])
+    return timestamps, ir_values, icq_values
+
+
+# PTT calc for one BP window, averaged over the last `beats` IR peaks (all if None).
+# If a `stats` dict is given it is filled with sample, peak and beat counts.
+def calculate_ptt(sensor_data, beats=3, match="nearest", stats=None):
+    if stats is None:
+        stats = {}
+
+    timestamps, ir_values, icq_values = load_sensor_data(sensor_data)
+    stats["samples"] = len(timestamps)
+
+    if len(timestamps) < 10:
+        return {"success": False, "error": "Not enough data"}
 
     # Statistics of sensor data
     ir_std = np.std(ir_values)
@@ -24,41 +130,327 @@ try:
 
     # If the variance is too low, it is difficult to find the peak
     if ir_std < 0.5 or icq_std < 0.0001:
-        print(json.dumps({"success": False, "error": "Sensor data too flat, no peaks detected"}))
-        sys.exit(0)
+        return {"success": False, "error": "Sensor data too flat, no peaks detected"}
+
+    # Peaks, pairing and PTT of the last `beats` beats
+    pipeline = bp_pipeline.Pipeline("window", beats=beats, match=match)
+    result = pipeline.run(timestamps, ir_values, icq_values)
+    stats["ir_peaks"] = int(result["ir_peaks"][0])
+    stats["icq_peaks"] = int(result["icq_peaks"][0])
+
+    if stats["ir_peaks"] < 3 or stats["icq_peaks"] < 3:
+        return {"success": False, "error": "Not enough peaks"}
+
+    stats["beats"] = int(result["beats"][0])
+    if stats["beats"] == 0:
+        return {"success": False, "error": "PTT Calculation Failed"}
+
+    return {"success": True, "PTT": float(result["ptt"][0])}
+
+
+def safe_calculate_ptt(sensor_data, **options):
+    try:
+        return calculate_ptt(sensor_data, **options)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+# One request line: either a bare sample list or {"id": ..., "data": ...};
+# a binary frame is sent base64-encoded as {"id": ..., "frame": "..."}.
+# Optional "beats" and "match" keys are passed on to calculate_ptt.
+def handle_request(line):
+    request_id = None
+    options = {}
+    try:
+        request = json.loads(line)
+        if isinstance(request, dict):
+            request_id = request.get("id")
+            for key in ("beats", "match"):
+                if key in request:
+                    options[key] = request[key]
+            if "frame" in request:
+                request = base64.b64decode(request["frame"])
+            else:
+                request = request.get("data", [])
+        result = safe_calculate_ptt(request, **options)
+    except Exception as e:
+        result = {"success": False, "error": str(e)}
+
+    if request_id is not None:
+        result["id"] = request_id
+    return result
+
+
+# Live streams {"id": ..., "stream": name, "data": ...} feed a StreamingPTT kept in
+# the serving process (not the pool); {"stream": name, "reset": true} drops it.
+# Returns None for ordinary window requests.
+streams = {}
+streams_lock = threading.Lock()
 
-    # Detect first peaks
-    peaks_ir, _ = find_peaks(ir_values, distance=15, prominence=0.5)
-    peaks_icq, _ = find_peaks(icq_values, distance=20, prominence=0.0001)
 
-    if len(peaks_ir) < 3:
-        peaks_ir, _ = find_peaks(ir_values, distance=10, prominence=0.2)
+def handle_stream_request(line):
+    # Window payloads only hold numbers, so the key name is a cheap pre-check
+    if '"stream"' not in line:
+        return None
 
-    if len(peaks_icq) < 3:
-        peaks_icq, _ = find_peaks(icq_values, distance=15, prominence=0.00005)
+    request = {}
+    result = {}
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict) or "stream" not in request:
+            return None
 
-    if len(peaks_ir) < 3 or len(peaks_icq) < 3:
-        print(json.dumps({"success": False, "error": "Not enough peaks"}))
-        sys.exit(0)
+        with streams_lock:
+            stream_id = request["stream"]
+            if request.get("reset"):
+                streams.pop(stream_id, None)
+                result = {"success": True}
+            else:
+                estimator = streams.get(stream_id)
+                if estimator is None:
+                    estimator = StreamingPTT(beats=request.get("beats", 3))
+                    streams[stream_id] = estimator
 
-    # PTT calc
-    ptt_values = []
-    for t1 in peaks_ir[-3:]:
-        t2 = min(peaks_icq, key=lambda x: abs(x - t1))
-        diff = abs(timestamps[t1] - timestamps[t2])
+                if "frame" in request:
+                    sensor_data = base64.b64decode(request["frame"])
+                else:
+                    sensor_data = request.get("data", [])
+                estimator.add_samples(*load_sensor_data(sensor_data))
 
-        if 100 <= diff <= 1500:  
-            ptt_values.append(diff)
+                if estimator.ptt is None:
+                    result = {"success": False, "error": "No beats yet", "beats": 0}
+                else:
+                    result = {"success": True, "PTT": estimator.ptt, "beats": estimator.beats}
+    except Exception as e:
+        result = {"success": False, "error": str(e)}
 
-    if not ptt_values:
-        print(json.dumps({"success": False, "error": "PTT Calculation Failed"}))
-        sys.exit(0)
+    if request.get("id") is not None:
+        result["id"] = request["id"]
+    return result
 
-    avg_ptt = np.mean(ptt_values)
+
+# Long-lived worker: newline-delimited JSON requests on stdin, one JSON line per reply
+def serve_stdio(workers=1):
+    write_lock = threading.Lock()
+
+    def reply(result):
+        with write_lock:
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+
+    pool = None
+    if workers > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+
+    try:
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            result = handle_stream_request(line)
+            if result is not None:
+                reply(result)
+            elif pool:
+                # Replies may come back out of order, callers match them by "id"
+                pool.apply_async(handle_request, (line,), callback=reply)
+            else:
+                reply(handle_request(line))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+
+# Same protocol over a local Unix socket, one thread per connected client
+def serve_socket(path, workers=1):
+    import socketserver
+
+    pool = None
+    if workers > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+
+    class PTTHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for raw in self.rfile:
+                line = raw.decode("utf-8").strip()
+                if not line:
+                    continue
+                result = handle_stream_request(line)
+                if result is not None:
+                    pass
+                elif pool:
+                    result = pool.apply(handle_request, (line,))
+                else:
+                    result = handle_request(line)
+                self.wfile.write((json.dumps(result) + "\n").encode("utf-8"))
+                self.wfile.flush()
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    server = socketserver.ThreadingUnixStreamServer(path, PTTHandler)
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+        if pool:
+            pool.close()
+            pool.join()
+
+
+# Recorded sessions: a directory of .json (or binary .bin frame) files, one session
+# per file, or a JSONL file with one session per line as a bare sample list or
+# {"session": ..., "data": ...} / {"session": ..., "frame": "<base64>"}.
+def iter_sessions(path):
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            session, ext = os.path.splitext(name)
+            file_path = os.path.join(path, name)
+            if ext == ".json":
+                with open(file_path, encoding="utf-8") as f:
+                    yield session, f.read()
+            elif ext == ".bin":
+                with open(file_path, "rb") as f:
+                    yield session, f.read()
+        return
+
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if line:
+                yield str(line_number), line
+
+
+BATCH_FIELDS = ["session", "success", "PTT", "samples", "ir_peaks", "icq_peaks", "beats", "error"]
+
+
+# One result row per session, same detection path as the stdin/server modes
+def process_session(item, beats=3, match="nearest"):
+    session, raw = item
+    stats = {}
+    try:
+        if isinstance(raw, bytes):
+            sensor_data = raw
+        else:
+            sensor_data = json.loads(raw)
+            if isinstance(sensor_data, dict) and ("data" in sensor_data or "frame" in sensor_data):
+                session = str(sensor_data.get("session", sensor_data.get("id", session)))
+                if "frame" in sensor_data:
+                    sensor_data = base64.b64decode(sensor_data["frame"])
+                else:
+                    sensor_data = sensor_data["data"]
+        result = calculate_ptt(sensor_data, beats=beats, match=match, stats=stats)
+    except Exception as e:
+        result = {"success": False, "error": str(e)}
+
+    row = dict.fromkeys(BATCH_FIELDS, "")
+    row.update(stats)
+    row.update(result)
+    row["session"] = session
+    return row
+
+
+def write_rows(rows, output):
+    import csv
+
+    if output.endswith(".parquet"):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow, use a .csv or .jsonl output instead.")
+        rows = list(rows)
+        table = pyarrow.Table.from_pylist(rows)
+        pyarrow.parquet.write_table(table, output)
+        return len(rows)
+
+    count = 0
+    with open(output, "w", newline="", encoding="utf-8") as f:
+        if output.endswith(".jsonl"):
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+                count += 1
+        else:
+            writer = csv.DictWriter(f, fieldnames=BATCH_FIELDS)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+    return count
+
+
+# Offline reprocessing of recorded sessions across a process pool
+def run_batch(path, output, workers=None, beats=3, match="nearest"):
+    import time
+    import functools
+    import multiprocessing
+
+    start = time.perf_counter()
+    worker = functools.partial(process_session, beats=beats, match=match)
+
+    with multiprocessing.Pool(workers) as pool:
+        rows = pool.imap(worker, iter_sessions(path), chunksize=16)
+        count = write_rows(rows, output)
+
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else 0
+    print(f"{count} sessions in {elapsed:.2f} s ({rate:.1f} sessions/s)", file=sys.stderr)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PTT calculation from live BP sensor data")
+    parser.add_argument("--server", action="store_true",
+                        help="keep running and answer newline-delimited JSON requests on stdin")
+    parser.add_argument("--socket", metavar="PATH",
+                        help="keep running and answer requests on a Unix socket")
+    parser.add_argument("--batch", metavar="PATH",
+                        help="reprocess recorded sessions from a directory or JSONL file")
+    parser.add_argument("--output", metavar="FILE", default="ptt_results.csv",
+                        help="batch result file (.csv, .jsonl or .parquet)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="process pool size (server modes default to 1, batch to all cores)")
+    parser.add_argument("--binary", action="store_true",
+                        help="stdin is a binary frame instead of JSON (single window mode)")
+    parser.add_argument("--beats", type=int, default=3,
+                        help="number of trailing beats to average, 0 for all (single window and batch)")
+    parser.add_argument("--match", choices=["nearest", "following"], default="nearest",
+                        help="how IR peaks are paired with ICQ peaks (single window and batch)")
+    args = parser.parse_args()
+
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    if args.batch:
+        run_batch(args.batch, args.output, args.workers, args.beats, args.match)
+        return
+
+    if args.socket:
+        serve_socket(args.socket, args.workers or 1)
+        return
+
+    if args.server:
+        serve_stdio(args.workers or 1)
+        return
+
+    # Single window: read incoming data once and exit
+    try:
+        if args.binary:
+            sensor_data = sys.stdin.buffer.read()
+        else:
+            sensor_data = json.loads(sys.stdin.read())
+        result = safe_calculate_ptt(sensor_data, beats=args.beats, match=args.match)
+    except Exception as e:
+        result = {"success": False, "error": str(e)}
 
     # JSON output
-    print(json.dumps({"success": True, "PTT": avg_ptt}))
+    print(json.dumps(result))
+
 
-except Exception as e:
-    print(json.dumps({"success": False, "error": str(e)}))
-    sys.exit(0)
+if __name__ == "__main__":
+    main()
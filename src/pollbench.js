@@ -0,0 +1,62 @@
+import http from "http";
+
+// Idle-device load on the server: connections opened per second per device,
+// legacy five-endpoint polling vs the long-polled /api/command.
+// Usage: node src/pollbench.js [devices] [seconds] [server url]
+const DEVICES = parseInt(process.argv[2] || "20", 10);
+const DURATION = parseFloat(process.argv[3] || "30");
+const SERVER = process.argv[4] || "http://localhost:5000";
+
+const LEGACY_ENDPOINTS = ["/api/scan-card", "/api/measure-bodytemp", "/api/spo2", "/api/EKG", "/api/BP"];
+const COMMAND_WAIT = 25;
+
+// One request on a fresh TCP connection, like urequests on the device
+function get(path) {
+    return new Promise((resolve) => {
+        const req = http.get(SERVER + path, { agent: false }, (res) => {
+            res.resume();
+            res.on("end", resolve);
+        });
+        req.on("error", resolve);
+    });
+}
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+async function legacyDevice(state) {
+    while (!state.done) {
+        for (const path of LEGACY_ENDPOINTS) {
+            state.connections++;
+            await get(path);
+        }
+        await sleep(1000);
+    }
+}
+
+async function commandDevice(state) {
+    while (!state.done) {
+        state.connections++;
+        await get(`/api/command?wait=${COMMAND_WAIT}`);
+    }
+}
+
+async function run(name, device) {
+    const state = { done: false, connections: 0 };
+    const start = Date.now();
+    const devices = Array.from({ length: DEVICES }, () => device(state));
+
+    await sleep(DURATION * 1000);
+    state.done = true;
+    const elapsed = (Date.now() - start) / 1000;
+
+    const perDevice = state.connections / elapsed / DEVICES;
+    console.log(`${name.padEnd(8)} ${DEVICES} devices, ${elapsed.toFixed(1)} s: ` +
+        `${(state.connections / elapsed).toFixed(2)} connections/s, ${perDevice.toFixed(3)} per device`);
+
+    // Long polls still open are not waited for
+    return devices;
+}
+
+await run("legacy", legacyDevice);
+await run("command", commandDevice);
+process.exit(0);
@@ -0,0 +1,380 @@
+import sys
+import os
+import json
+import time
+import base64
+import argparse
+import subprocess
+import numpy as np
+from scipy.signal import butter, filtfilt, sosfiltfilt, find_peaks
+import calculate_ptt
+from ptt_stream import StreamingPTT
+from stream_filter import StreamingPeaks, bandpass_sos
+import spo2_batch
+import bp_pipeline
+
+# Device SpO2 algorithm (plain Python) for the comparison
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RPI"))
+import spo2algorithm
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "calculate_ptt.py")
+
+
+# Synthetic BP window: 50 Hz samples, ~1.2 Hz pulse, ICQUANZX lagging MAX30102 by ptt_ms
+def synthetic_window(n=200, fs=50.0, ptt_ms=240, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / fs
+    timestamps = (t * 1000).astype(np.int64) + 100000
+    pulse = 2 * np.pi * 1.2
+    ir = 50000 + 400 * np.sin(pulse * t) + rng.normal(0, 5, n)
+    icq = 0.5 + 0.01 * np.sin(pulse * (t - ptt_ms / 1000.0)) + rng.normal(0, 0.0002, n)
+
+    return [
+        {"timestamp": int(timestamps[i]), "max30102_ir": int(ir[i]),
+         "max30102_red": int(ir[i] * 0.8), "icquanzx": float(icq[i])}
+        for i in range(n)
+    ]
+
+
+def summary(name, latencies):
+    ms = np.array(latencies) * 1000
+    print(f"{name:<14} n={len(ms):<4} mean={ms.mean():8.2f} ms  "
+          f"p50={np.percentile(ms, 50):8.2f} ms  p95={np.percentile(ms, 95):8.2f} ms")
+
+
+# Cold-spawn (one interpreter per window, like the old server) vs warm --server worker
+def bench_worker(runs, workers):
+    payload = json.dumps(synthetic_window())
+
+    cold = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, SCRIPT], input=payload, capture_output=True, text=True, check=True)
+        cold.append(time.perf_counter() - start)
+    summary("cold-spawn", cold)
+
+    proc = subprocess.Popen([sys.executable, SCRIPT, "--server", "--workers", str(workers)],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        # First reply only tells us the imports are done
+        proc.stdin.write(payload + "\n")
+        proc.stdin.flush()
+        proc.stdout.readline()
+
+        warm = []
+        for i in range(runs):
+            start = time.perf_counter()
+            proc.stdin.write(json.dumps({"id": i, "data": json.loads(payload)}) + "\n")
+            proc.stdin.flush()
+            proc.stdout.readline()
+            warm.append(time.perf_counter() - start)
+        summary("warm-worker", warm)
+
+        # Many devices at once: all windows in flight, replies matched by id
+        start = time.perf_counter()
+        for i in range(runs):
+            proc.stdin.write(json.dumps({"id": i, "data": json.loads(payload)}) + "\n")
+        proc.stdin.flush()
+        for _ in range(runs):
+            proc.stdout.readline()
+        elapsed = time.perf_counter() - start
+        print(f"{'warm-burst':<14} n={runs:<4} {runs / elapsed:8.1f} windows/s ({workers} worker(s))")
+    finally:
+        proc.stdin.close()
+        proc.wait()
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+# Parse + load cost of the legacy list-of-dicts, columnar JSON, binary frame and device frame inputs
+def bench_input(sizes, repeat):
+    for n in sizes:
+        samples = synthetic_window(n=n)
+        legacy = json.dumps(samples)
+        columns = json.dumps({
+            "timestamp": [d["timestamp"] for d in samples],
+            "max30102_ir": [d["max30102_ir"] for d in samples],
+            "icquanzx": [d["icquanzx"] for d in samples],
+        })
+        timestamps, ir_values, icq_values = calculate_ptt.load_sensor_data(json.loads(columns))
+        frame = calculate_ptt.encode_frame(timestamps, ir_values, icq_values)
+        wire = calculate_ptt.wireformat
+        channels = ([d["max30102_ir"] for d in samples], [d["max30102_red"] for d in samples],
+                    [round(d["icquanzx"] * 65535) for d in samples])
+        ticks = [d["timestamp"] for d in samples]
+        device_frame = wire.encode(wire.SENSOR_BP, channels, 50, ticks=ticks)
+        delta_frame = wire.encode(wire.SENSOR_BP, channels, 50, ticks=ticks, delta=True)
+
+        inputs = [
+            ("legacy", len(legacy), lambda: calculate_ptt.load_sensor_data(json.loads(legacy))),
+            ("columnar", len(columns), lambda: calculate_ptt.load_sensor_data(json.loads(columns))),
+            ("binary", len(frame), lambda: calculate_ptt.load_sensor_data(frame)),
+            ("device", len(device_frame), lambda: calculate_ptt.load_sensor_data(device_frame)),
+            ("delta", len(delta_frame), lambda: calculate_ptt.load_sensor_data(delta_frame)),
+        ]
+        for name, size, fn in inputs:
+            elapsed = best_of(fn, repeat) * 1000
+            print(f"n={n:<6} {name:<9} {size:>8} bytes  load={elapsed:8.3f} ms")
+
+
+# Old min()-per-IR-peak pairing vs searchsorted matcher, all beats of long recordings
+def bench_pairing(sizes, repeat):
+    for n in sizes:
+        timestamps, ir_values, icq_values = calculate_ptt.load_sensor_data(synthetic_window(n=n))
+        peaks_ir, _ = find_peaks(ir_values, distance=15, prominence=0.5)
+        peaks_icq, _ = find_peaks(icq_values, distance=20, prominence=0.0001)
+
+        def loop_pairing():
+            ptt_values = []
+            for t1 in peaks_ir:
+                t2 = min(peaks_icq, key=lambda x: abs(x - t1))
+                diff = abs(timestamps[t1] - timestamps[t2])
+                if 100 <= diff <= 1500:
+                    ptt_values.append(diff)
+            return ptt_values
+
+        loop = best_of(loop_pairing, repeat) * 1000
+        sorted_search = best_of(lambda: bp_pipeline.ptt_per_beat(timestamps, peaks_ir, peaks_icq), repeat) * 1000
+        print(f"n={n:<7} beats={len(peaks_ir):<5} min-loop={loop:9.3f} ms  searchsorted={sorted_search:7.3f} ms")
+
+
+# Streaming estimator: samples until the first 3-beat PTT, and per-sample cost
+def bench_stream(sizes):
+    for n in sizes:
+        timestamps, ir_values, icq_values = calculate_ptt.load_sensor_data(synthetic_window(n=n))
+        timestamps, ir_values, icq_values = timestamps.tolist(), ir_values.tolist(), icq_values.tolist()
+
+        estimator = StreamingPTT(beats=3)
+        first_result = None
+        start = time.perf_counter()
+        for i in range(n):
+            estimator.add_sample(timestamps[i], ir_values[i], icq_values[i])
+            if first_result is None and estimator.beats >= 3:
+                first_result = i + 1
+        elapsed = time.perf_counter() - start
+
+        print(f"n={n:<7} first 3-beat PTT after {first_result} samples (batch waits for 200)  "
+              f"{elapsed / n * 1e6:6.2f} us/sample  PTT={estimator.ptt:.1f}")
+
+
+# TEST/bp_test.py before the streaming filter: butter + filtfilt + find_peaks over the
+# last 200 samples for every new sample, then a list membership test and a sort
+def rolling_detect_peaks(signal_list, time_list, peak_list, height, prominence):
+    if len(signal_list) < 200:
+        return
+    window_signal = signal_list[-200:]
+    window_times = time_list[-200:]
+    b, a = butter(6, [0.8 / 25, 2.5 / 25], btype='band')
+    filtered = filtfilt(b, a, np.array(window_signal))
+    peaks, _ = find_peaks(filtered, distance=50, height=np.mean(filtered) + height,
+                                        prominence=prominence)
+    for pt in [window_times[i] for i in peaks]:
+        if pt not in peak_list:
+            peak_list.append(pt)
+    peak_list.sort()
+
+
+# bp_test.py peak detection per sample after `history` samples of stream: rolling window
+# recomputation vs StreamingPeaks, and the beat interval both find on a clean signal.
+def bench_filter(histories, timed=250):
+    for history in histories:
+        timestamps, ir_values, _ = calculate_ptt.load_sensor_data(synthetic_window(n=history + timed))
+        timestamps, ir_values = timestamps.tolist(), ir_values.tolist()
+
+        # Zero-phase filter + find_peaks over the whole stream as the reference beats.
+        # The rolling version keeps every sample and peak; its state is rebuilt from these.
+        reference = sosfiltfilt(bandpass_sos(), np.array(ir_values))
+        reference_peaks = [timestamps[i] for i in find_peaks(reference, distance=50, prominence=150)[0]]
+        peak_list = [t for t in reference_peaks if t < timestamps[history]]
+        signal_list, time_list = ir_values[:history], timestamps[:history]
+        start = time.perf_counter()
+        for i in range(history, history + timed):
+            signal_list.append(ir_values[i])
+            time_list.append(timestamps[i])
+            rolling_detect_peaks(signal_list, time_list, peak_list, 300, 150)
+        rolling = (time.perf_counter() - start) / timed
+
+        detector = StreamingPeaks(height=300, prominence=150, distance=50)
+        for i in range(history):
+            detector.add(ir_values[i], timestamps[i])
+        start = time.perf_counter()
+        for i in range(history, history + timed):
+            detector.add(ir_values[i], timestamps[i])
+        streaming = (time.perf_counter() - start) / timed
+
+        interval = np.median(np.diff(detector.last(len(detector))))
+        print(f"history={history:<7} rolling {rolling * 1e6:8.1f} us/sample  streaming {streaming * 1e6:6.1f} us/sample  "
+              f"({rolling / streaming:5.1f}x)  beat interval {interval:.0f} ms "
+              f"(zero-phase {np.median(np.diff(reference_peaks)):.0f} ms)")
+
+
+# BP windows for a batch of patients: per-patient pulse rate, PTT and IR level, shared timestamps
+def synthetic_patients(patients, n=200, fs=50.0, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / fs
+    timestamps = (t * 1000).astype(np.int64) + 100000
+    pulse = 2 * np.pi * rng.uniform(0.9, 2.0, (patients, 1))
+    ptt = rng.uniform(0.15, 0.4, (patients, 1))
+    ir = rng.uniform(30000, 80000, (patients, 1)) + 400 * np.sin(pulse * t) + rng.normal(0, 5, (patients, n))
+    icq = 0.5 + 0.01 * np.sin(pulse * (t - ptt)) + rng.normal(0, 0.0002, (patients, n))
+    return timestamps, ir.astype(np.int64), icq
+
+
+# calculate_ptt per window vs one bp_pipeline batch (same PTTs), stage timings, and an
+# SBP calibration sweep of every patient over a grid of questionnaire answers
+def bench_pipeline(sizes, repeat):
+    ages = np.repeat(np.arange(20, 80), 8)
+    answers = (ages, np.tile(["E", "K"], len(ages) // 2), np.arange(len(ages)) % 3 == 0,
+               np.arange(len(ages)) % 4 == 0, np.arange(len(ages)) % 5 == 0, np.tile(["N", "D", "Y", "N"], len(ages) // 4))
+    parameters = bp_pipeline.estimate_parameters(*answers)
+
+    for patients in sizes:
+        timestamps, ir, icq = synthetic_patients(patients)
+        windows = [{"timestamp": timestamps, "max30102_ir": ir[i], "icquanzx": icq[i]} for i in range(patients)]
+
+        def per_window():
+            return [calculate_ptt.calculate_ptt(window).get("PTT", np.nan) for window in windows]
+
+        expected = np.array(per_window())
+        timing = bp_pipeline.StageTimes()
+        result = bp_pipeline.Pipeline("window", on_stage=timing).run(timestamps, ir, icq, parameters)
+        assert np.array_equal(result["ptt"], expected, equal_nan=True), "bp_pipeline differs from calculate_ptt"
+
+        loop = best_of(per_window, max(1, repeat // 10))
+        timing = bp_pipeline.StageTimes()
+        pipeline = bp_pipeline.Pipeline("window", on_stage=timing)
+        batch = best_of(lambda: pipeline.run(timestamps, ir, icq, parameters), repeat)
+        print(f"patients={patients:<6} equal  per window {patients / loop:8.0f} patients/s  "
+              f"batch {patients / batch:8.0f} patients/s  sweep {result['sbp'].shape}")
+        print(f"{'':16}{timing.report(patients * repeat)}")
+
+        filtered = bp_pipeline.StageTimes()
+        bp_pipeline.Pipeline("bp_test").run(timestamps, ir, icq)  # designs the filter once
+        bp_pipeline.Pipeline("bp_test", on_stage=filtered).run(timestamps, ir, icq, parameters)
+        print(f"{'':16}bp_test profile: {filtered.report(patients)}")
+
+
+def synthetic_ekg(n, fs=250, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / fs
+    beat = np.sin(np.pi * (t * 1.2 % 1)) ** 40  # narrow QRS-like spike, 72 bpm
+    return (32768 + 12000 * beat + 800 * np.sin(2 * np.pi * 0.3 * t) + rng.normal(0, 40, n)).astype(int).tolist()
+
+
+# (name, sensor, channels, ticks) for the codec benchmark: synthetic EKG and BP,
+# or the BP channels of recorded sessions (same inputs as calculate_ptt.py --batch).
+# Sessions carry no red channel, red repeats IR.
+def codec_inputs(sessions):
+    wire = calculate_ptt.wireformat
+    if not sessions:
+        for n in (2500, 60000):  # 10 s and 4 min at 250 Hz
+            yield f"ekg-{n}", wire.SENSOR_EKG, (synthetic_ekg(n),), None
+        windows = [(f"bp-{n}", synthetic_window(n=n)) for n in (200, 3000)]
+    else:
+        windows = []
+        for name, raw in calculate_ptt.iter_sessions(sessions):
+            data = raw if isinstance(raw, bytes) else json.loads(raw)
+            if isinstance(data, dict) and "frame" in data:
+                data = base64.b64decode(data["frame"])
+            elif isinstance(data, dict) and "data" in data:
+                data = data["data"]
+            windows.append((name, data))
+
+    for name, data in windows:
+        timestamps, ir_values, icq_values = calculate_ptt.load_sensor_data(data)
+        ir = np.asarray(ir_values).astype(int).tolist()
+        icq = np.round(np.asarray(icq_values) * 65535).astype(int).tolist()
+        yield name, wire.SENSOR_BP, (ir, ir, icq), np.asarray(timestamps).astype(int).tolist()
+
+
+# Delta/zigzag varint frames vs raw and int16-delta frames and JSON: size, encode and decode rate
+def bench_codec(sessions, repeat):
+    wire = calculate_ptt.wireformat
+    for name, sensor, channels, ticks in codec_inputs(sessions):
+        n = len(channels[0])
+        columns = {"samples": channels[0]} if ticks is None else {"timestamp": ticks, "channels": channels}
+        frames = {
+            "raw": wire.encode(sensor, channels, 50, ticks=ticks),
+            "delta16": wire.encode(sensor, channels, 50, ticks=ticks, delta=True),
+            "varint": wire.encode(sensor, channels, 50, ticks=ticks, varint=True),
+        }
+        frame = frames["varint"]
+        decoded = calculate_ptt.decode_wire_frame(frame)
+        assert [c.tolist() for c in decoded[2]] == [list(c) for c in channels]
+
+        encode = best_of(lambda: wire.encode(sensor, channels, 50, ticks=ticks, varint=True), repeat)
+        numpy_decode = best_of(lambda: calculate_ptt.decode_wire_frame(frame), repeat)
+        python_decode = best_of(lambda: wire.decode(frame), max(1, repeat // 10))
+
+        sizes = "  ".join(f"{kind} {len(f):>7}" for kind, f in frames.items())
+        print(f"{name:<14} n={n:<6} json {len(json.dumps(columns)):>8}  {sizes} bytes  "
+              f"varint {len(frames['raw']) / len(frame):4.2f}x raw")
+        print(f"{'':<14} encode {n / encode / 1e6:6.2f} M samples/s  decode numpy {n / numpy_decode / 1e6:7.2f}"
+              f"  python {n / python_decode / 1e6:5.2f} M samples/s")
+
+
+# Synthetic MAX30102 recordings: 400 Hz red/IR with a per-recording pulse, perfusion and level
+def synthetic_spo2(recordings, n=200, fs=400, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / fs
+    rate = rng.uniform(0.8, 2.5, (recordings, 1))
+    level = rng.uniform(5000, 120000, (recordings, 1))
+    pulse = np.sin(2 * np.pi * rate * t)
+    ir = level + level * rng.uniform(0.002, 0.05, (recordings, 1)) * pulse + rng.normal(0, 20, (recordings, n))
+    red = 0.8 * level + level * rng.uniform(0.001, 0.05, (recordings, 1)) * pulse + rng.normal(0, 20, (recordings, n))
+    return np.maximum(red, 0).astype(int), np.maximum(ir, 0).astype(int)
+
+
+# Device process_spo2 per recording vs spo2_batch over the whole batch, recordings/s.
+# Equal values are checked in test_spo2_batch.py
+def bench_spo2(sizes, repeat):
+    for recordings in sizes:
+        red, ir = synthetic_spo2(recordings)
+        red_lists, ir_lists = red.tolist(), ir.tolist()
+
+        def device():
+            return [spo2algorithm.process_spo2(r, i) for r, i in zip(red_lists, ir_lists)]
+
+        loop = best_of(device, max(1, repeat // 10))
+        vectorized = best_of(lambda: spo2_batch.process_spo2(red, ir), repeat)
+        print(f"recordings={recordings:<7} device loop {recordings / loop:10.0f} rec/s  "
+              f"vectorized {recordings / vectorized:10.0f} rec/s  ({loop / vectorized:5.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="calculate_ptt.py benchmarks")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--sessions", metavar="PATH", help="recorded sessions for the codec benchmark")
+    parser.add_argument("bench", nargs="?", default="worker",
+                        choices=["worker", "input", "pairing", "stream", "filter", "pipeline", "codec", "spo2"])
+    args = parser.parse_args()
+
+    if args.bench == "worker":
+        bench_worker(args.runs, args.workers)
+    elif args.bench == "input":
+        bench_input([200, 2000, 20000], args.repeat)
+    elif args.bench == "pairing":
+        bench_pairing([200, 3000, 15000, 60000], args.repeat)
+    elif args.bench == "stream":
+        bench_stream([200, 3000, 60000])
+    elif args.bench == "filter":
+        bench_filter([200, 3000, 30000])
+    elif args.bench == "pipeline":
+        bench_pipeline([1, 100, 2000], args.repeat)
+    elif args.bench == "codec":
+        bench_codec(args.sessions, args.repeat)
+    elif args.bench == "spo2":
+        bench_spo2([1, 100, 10000], args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+from collections import deque
+
+
+# Online peak detector: a peak is confirmed once the signal has risen `prominence`
+# above the preceding trough and then fallen `prominence` below the maximum.
+# Peaks closer than `distance` samples to the previous one are dropped.
+class PeakDetector:
+    def __init__(self, prominence, distance):
+        self.prominence = prominence
+        self.distance = distance
+        self.index = -1
+        self.looking_for_max = False
+        self.min_value = None
+        self.max_value = None
+        self.max_index = 0
+        self.max_time = None
+        self.last_peak_index = None
+
+    # Returns the timestamp of a newly confirmed peak, or None
+    def add(self, value, timestamp):
+        self.index += 1
+
+        if self.min_value is None:
+            self.min_value = value
+            return None
+
+        if self.looking_for_max:
+            if value > self.max_value:
+                self.max_value = value
+                self.max_index = self.index
+                self.max_time = timestamp
+            elif value < self.max_value - self.prominence:
+                self.looking_for_max = False
+                self.min_value = value
+
+                if self.last_peak_index is None or self.max_index - self.last_peak_index >= self.distance:
+                    self.last_peak_index = self.max_index
+                    return self.max_time
+        else:
+            if value < self.min_value:
+                self.min_value = value
+            elif value > self.min_value + self.prominence:
+                self.looking_for_max = True
+                self.max_value = value
+                self.max_index = self.index
+                self.max_time = timestamp
+
+        return None
+
+
+# Streaming PTT estimator: feed samples one by one, get an updated PTT after each
+# new beat. Peaks are paired like calculate_ptt.py ("nearest" ICQ peak) and the
+# result is the mean of the last `beats` PTTs (of all of them if beats is 0/None).
+# O(1) work and memory per sample.
+class StreamingPTT:
+    def __init__(self, beats=3, min_ptt=100, max_ptt=1500,
+                 ir_prominence=0.5, ir_distance=15,
+                 icq_prominence=0.0001, icq_distance=20):
+        self.min_ptt = min_ptt
+        self.max_ptt = max_ptt
+        self.ir_peaks = PeakDetector(ir_prominence, ir_distance)
+        self.icq_peaks = PeakDetector(icq_prominence, icq_distance)
+
+        self.pending_ir = deque()
+        self.recent_icq = deque(maxlen=4)
+        self.ptt_values = deque(maxlen=beats) if beats else None
+        self.ptt_sum = 0.0
+        self.beats = 0
+        self.ptt = None
+
+    def add_sample(self, timestamp, ir_value, icq_value):
+        ir_peak = self.ir_peaks.add(ir_value, timestamp)
+        icq_peak = self.icq_peaks.add(icq_value, timestamp)
+
+        if ir_peak is not None:
+            self.pending_ir.append(ir_peak)
+        if icq_peak is not None:
+            self.recent_icq.append(icq_peak)
+
+        updated = False
+        while self.pending_ir and self.recent_icq:
+            t1 = self.pending_ir[0]
+
+            # The nearest ICQ peak is known once one at/after t1 exists or the
+            # window for a following peak has passed
+            if self.recent_icq[-1] < t1 and timestamp - t1 <= self.max_ptt:
+                break
+
+            self.pending_ir.popleft()
+            t2 = min(self.recent_icq, key=lambda x: abs(x - t1))
+            if self.add_ptt(abs(t1 - t2)):
+                updated = True
+
+        # IR peaks with no ICQ peak at all are useless once they are too old
+        while self.pending_ir and not self.recent_icq and timestamp - self.pending_ir[0] > self.max_ptt:
+            self.pending_ir.popleft()
+
+        return self.ptt if updated else None
+
+    # Chunk of samples, returns the latest PTT update in it (or None)
+    def add_samples(self, timestamps, ir_values, icq_values):
+        latest = None
+        for timestamp, ir_value, icq_value in zip(timestamps, ir_values, icq_values):
+            ptt = self.add_sample(timestamp, ir_value, icq_value)
+            if ptt is not None:
+                latest = ptt
+        return latest
+
+    def add_ptt(self, diff):
+        if not self.min_ptt <= diff <= self.max_ptt:
+            return False
+
+        self.beats += 1
+        count = self.beats
+        if self.ptt_values is not None:
+            if len(self.ptt_values) == self.ptt_values.maxlen:
+                self.ptt_sum -= self.ptt_values[0]
+            self.ptt_values.append(diff)
+            count = len(self.ptt_values)
+        self.ptt_sum += diff
+        self.ptt = self.ptt_sum / count
+        return True
@@ -0,0 +1,107 @@
+import { spawn } from "child_process";
+import readline from "readline";
+
+// Persistent calculate_ptt.py process, numpy/scipy are imported only once.
+const PTT_WORKERS = parseInt(process.env.PTT_WORKERS || "1", 10);
+const PYTHON = process.env.PYTHON || "python";
+
+let worker = null;
+let nextRequestId = 1;
+const pendingRequests = new Map();
+
+function startWorker() {
+    const args = ["src/calculate_ptt.py", "--server", "--workers", String(PTT_WORKERS)];
+    const child = spawn(PYTHON, args);
+
+    const lines = readline.createInterface({ input: child.stdout });
+
+    lines.on("line", (line) => {
+        let output;
+        try {
+            output = JSON.parse(line);
+        } catch (err) {
+            console.error("❌ JSON Parse error:", err.message);
+            console.error("📡 Raw data:", line);
+            return;
+        }
+
+        const pending = pendingRequests.get(output.id);
+        if (!pending) {
+            return;
+        }
+
+        pendingRequests.delete(output.id);
+        delete output.id;
+        pending.resolve(output);
+    });
+
+    child.on("error", (err) => {
+        console.error("❌ PTT worker error:", err.message);
+    });
+
+    child.stdin.on("error", (err) => {
+        console.error("❌ PTT worker stdin error:", err.message);
+    });
+
+    child.stderr.on("data", (data) => {
+        console.error(`❌ Python error: ${data}`);
+    });
+
+    child.on("close", (code) => {
+        console.warn(`⚠️ PTT worker exited (code ${code}).`);
+        if (worker === child) {
+            worker = null;
+        }
+
+        for (const pending of pendingRequests.values()) {
+            pending.reject(new Error("PTT worker exited."));
+        }
+        pendingRequests.clear();
+    });
+
+    console.log(`✅ PTT worker started (${PTT_WORKERS} process(es)).`);
+    return child;
+}
+
+// List of per-sample dicts to parallel arrays, parsed by numpy without per-sample dicts.
+function toColumns(sensorData) {
+    return {
+        timestamp: sensorData.map((d) => d.timestamp),
+        max30102_ir: sensorData.map((d) => d.max30102_ir),
+        icquanzx: sensorData.map((d) => d.icquanzx)
+    };
+}
+
+function sendRequest(request) {
+    return new Promise((resolve, reject) => {
+        if (!worker) {
+            worker = startWorker();
+        }
+
+        const id = nextRequestId++;
+        pendingRequests.set(id, { resolve, reject });
+
+        worker.stdin.write(JSON.stringify({ id, ...request }) + "\n");
+    });
+}
+
+// Send one BP window to the worker, resolves with the {success, PTT} payload.
+export function calculatePTT(sensorData) {
+    return sendRequest({ data: toColumns(sensorData) });
+}
+
+// Feed new samples to a live PTT stream, resolves with {success, PTT, beats}.
+export function streamPTT(stream, sensorData, beats = 3) {
+    return sendRequest({ stream, beats, data: toColumns(sensorData) });
+}
+
+export function resetPTTStream(stream) {
+    return sendRequest({ stream, reset: true });
+}
+
+export function stopPTTWorker() {
+    if (worker) {
+        worker.stdin.end();
+        worker = null;
+    }
+}
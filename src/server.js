@@ -8,7 +8,8 @@ import User from './user.js';
 import TestResult from './testresult.js';
 import EKGResult from './EKGresult.js';
 import BloodPressure from "./bloodpressure.js";
-import { spawn } from "child_process";
+import { calculatePTT, streamPTT, resetPTTStream } from "./pttworker.js";
+import { decodeFrame, SENSOR_BP, SENSOR_EKG } from "./wireformat.js";
 
 dotenv.config();
 connectDB();
@@ -24,6 +25,7 @@ app.use(express.static(path.join(path.resolve(), 'public')));
 // Middlewares
 app.use(express.json());
 app.use(express.urlencoded({ extended: true }));
+app.use(express.raw({ type: "application/octet-stream", limit: "1mb" }));  // device sensor frames
 app.use(session({
     secret: process.env.SESSION_SECRET || 'supersecret',
     resave: false,
@@ -129,6 +131,7 @@ let lastScannedUID = null;
 // Endpoint Running When Scan Button Is Pressed
 app.post('/api/scan-card', (req, res) => {
     scanRequestActive = true; 
+    notifyDevice("SCAN");
     lastScannedUID = null; 
     res.json({ success: true, message: "Scanning started." });
 
@@ -188,6 +191,7 @@ app.post('/api/measure-bodytemp', (req, res) => {
     }
 
     btRequestActive = true; 
+    notifyDevice("measure");
     lastMeasuredTemp = null; 
 
     res.json({ success: true, message: "Measurement started." });
@@ -202,11 +206,12 @@ app.get('/api/measure-bodytemp', (req, res) => {
 });
 
 app.post('/api/store-bodytemp', async (req, res) => {
-    const { temperature } = req.body; 
+    const { temperature, bound } = req.body; 
 
     const patientUID = pendingMeasurementForUser; 
 
-    console.log(`✅ Bodytemp: ${temperature}°C, Patient: ${patientUID}`);
+    const confidence = bound !== undefined ? ` ± ${Number(bound).toFixed(2)}` : "";
+    console.log(`✅ Bodytemp: ${temperature}${confidence}°C, Patient: ${patientUID}`);
 
     if (!patientUID) {
         console.error("❌ Patient UID not found!");
@@ -263,6 +268,7 @@ app.post('/api/measure-spo2', (req, res) => {
     }
 
     spo2RequestActive = true; 
+    notifyDevice("spo2start");
     lastMeasuredSpo2 = null; 
 
     res.json({ success: true, message: "SpO₂ measurement started." });
@@ -324,6 +330,21 @@ let ekgRequestActive = false;
 let lastMeasuredEKG = null;
 let pendingEKGForUser = null;
 
+// Streamed EKG recordings: length and rate are chosen per measurement, the
+// device uploads numbered chunks while it records (see /api/ekg-stream)
+const EKG_DEFAULT_DURATION = 10;  // seconds
+const EKG_MAX_DURATION = 300;
+const EKG_DEFAULT_RATE = 250;  // Hz
+const EKG_MIN_RATE = 50;
+const EKG_MAX_RATE = 500;
+let ekgSettings = { duration: EKG_DEFAULT_DURATION, sampleRate: EKG_DEFAULT_RATE };
+let ekgStream = null;
+
+function clampSetting(value, fallback, min, max) {
+    const number = parseInt(value, 10);
+    return Number.isFinite(number) ? Math.min(Math.max(number, min), max) : fallback;
+}
+
 app.post('/api/measure-ekg', (req, res) => {
     if (!req.session.user) {
         return res.json({ success: false, message: "Not logged in" });
@@ -337,10 +358,18 @@ app.post('/api/measure-ekg', (req, res) => {
         return res.json({ success: false, message: "EKG measurement already in progress." });
     }
 
+    const { duration, sampleRate } = req.body || {};
+    ekgSettings = {
+        duration: clampSetting(duration, EKG_DEFAULT_DURATION, 1, EKG_MAX_DURATION),
+        sampleRate: clampSetting(sampleRate, EKG_DEFAULT_RATE, EKG_MIN_RATE, EKG_MAX_RATE)
+    };
+
     ekgRequestActive = true; 
+    ekgStream = null;
+    notifyDevice("EKGstart");
     lastMeasuredEKG = null; 
 
-    res.json({ success: true, message: "EKG measurement started." });
+    res.json({ success: true, message: "EKG measurement started.", ...ekgSettings });
 });
 
 app.get('/api/EKG', (req, res) => {
@@ -351,8 +380,33 @@ app.get('/api/EKG', (req, res) => {
     }
 });
 
+async function saveEKGResult(EKG, patientUID, sampleRate) {
+    if (!patientUID) {
+        console.error("❌ Patient UID not found!");
+        throw new Error("Patient UID not found.");
+    }
+
+    const newTest = new EKGResult({
+        thepatient: patientUID, 
+        result: EKG, 
+        testType: "ekg",
+        sampleRate
+    });
+
+    await newTest.save();
+    console.log(`✅ EKG data saved to database! ${EKG.length} samples`);
+
+    lastMeasuredEKG = EKG;
+    ekgRequestActive = false;
+    ekgStream = null;
+}
+
+// Whole recording in one request (firmware from before /api/ekg-stream, which samples
+// at 20 Hz). The rate is stored only when the client sends it.
 app.post('/api/store-EKG', async (req, res) => {
     const { EKG } = req.body;  
+    const sampleRate = Number.isFinite(req.body.sampleRate) && req.body.sampleRate > 0
+        ? req.body.sampleRate : undefined;
     const patientUID = pendingEKGForUser; 
 
     console.log("✅ Incoming data:", req.body);
@@ -364,19 +418,101 @@ app.post('/api/store-EKG', async (req, res) => {
     }
 
     try {
-        const newTest = new EKGResult({
-            thepatient: patientUID, 
-            result: EKG, 
-            testType: "ekg"
-        });
+        await saveEKGResult(EKG, patientUID, sampleRate);
+        res.json({ success: true, message: "EKG recorded." });
+    } catch (error) {
+        console.error("❌ EKG saving error:", error);
+        res.status(500).json({ success: false, message: "Database error." });
+    }
+});
 
-        await newTest.save();
-        console.log("✅ EKG data saved to database!");
+// Device opens a stream for the active measurement and gets its settings:
+// {success, stream, duration, sampleRate}
+app.get('/api/ekg-stream', (req, res) => {
+    if (!ekgRequestActive) {
+        return res.json({ success: false, message: "No active EKG request." });
+    }
 
-        lastMeasuredEKG = EKG;
-        ekgRequestActive = false;
+    ekgStream = {
+        id: Date.now().toString(36),
+        ...ekgSettings,
+        chunks: new Map(),
+        received: 0
+    };
 
-        res.json({ success: true, message: "EKG recorded." });
+    console.log(`🔄 EKG stream ${ekgStream.id}: ${ekgStream.duration} s at ${ekgStream.sampleRate} Hz`);
+    res.json({ success: true, stream: ekgStream.id, ...ekgSettings });
+});
+
+// Binary chunk: an EKG sensor frame as body, stream, seq and final as query parameters
+function ekgChunkFromFrame(req) {
+    const frame = decodeFrame(req.body);
+    if (frame.sensor !== SENSOR_EKG) {
+        throw new Error("Not an EKG frame");
+    }
+
+    return {
+        stream: req.query.stream,
+        seq: parseInt(req.query.seq, 10),
+        samples: frame.channels[0],
+        final: req.query.final === "1"
+    };
+}
+
+// One chunk of a stream: {stream, seq, samples, final} or a binary frame. Chunks are
+// reassembled in seq order when the final one arrives; a resent seq replaces the earlier copy.
+app.post('/api/ekg-stream', async (req, res) => {
+    let chunk = req.body;
+    if (Buffer.isBuffer(req.body)) {
+        try {
+            chunk = ekgChunkFromFrame(req);
+        } catch (err) {
+            return res.status(400).json({ success: false, message: err.message });
+        }
+    }
+    const { stream, seq, samples, final } = chunk;
+
+    if (!Number.isInteger(seq) || seq < 0 || !Array.isArray(samples) || !samples.every(Number.isFinite)) {
+        return res.status(400).json({ success: false, message: "Invalid EKG chunk format" });
+    }
+
+    if (!ekgRequestActive || !ekgStream || stream !== ekgStream.id) {
+        return res.json({ success: true, done: true, message: "No active EKG stream." });
+    }
+
+    // Recording length is bounded by the requested duration, plus one second of slack
+    const maxSamples = (ekgStream.duration + 1) * ekgStream.sampleRate;
+    const previous = ekgStream.chunks.get(seq);
+    const received = ekgStream.received - (previous ? previous.length : 0) + samples.length;
+    if (received > maxSamples) {
+        return res.status(413).json({ success: false, message: "EKG stream longer than requested" });
+    }
+
+    ekgStream.chunks.set(seq, samples);
+    ekgStream.received = received;
+
+    if (!final) {
+        return res.json({ success: true, received });
+    }
+
+    const EKG = [];
+    const missing = [];
+    for (let i = 0; i <= seq; i++) {
+        const chunk = ekgStream.chunks.get(i);
+        if (chunk) {
+            EKG.push(...chunk);
+        } else {
+            missing.push(i);
+        }
+    }
+
+    if (missing.length) {
+        console.warn(`⚠️ EKG stream ${ekgStream.id} is missing chunks: ${missing.join(", ")}`);
+    }
+
+    try {
+        await saveEKGResult(EKG, pendingEKGForUser, ekgStream.sampleRate);
+        res.json({ success: true, done: true, received: EKG.length, missing });
     } catch (error) {
         console.error("❌ EKG saving error:", error);
         res.status(500).json({ success: false, message: "Database error." });
@@ -429,6 +565,9 @@ let pendingBPForUser = null;
 let bpRequestActive = false; 
 let latestPTT = null;
 
+const BP_STREAM = "bp";
+const BP_STREAM_BEATS = 3; // beats averaged by the live estimator before the test ends early
+
 app.get("/api/BP", (req, res) => {
     if (bpRequestActive) {
         console.log("📡 RPi started BP measurement...");
@@ -449,21 +588,263 @@ app.post("/api/BP", (req, res) => {
 
     pendingBPForUser = req.session.user.username;
     bpRequestActive = true; 
+    bpDataBuffer = [];
+    resetPTTStream(BP_STREAM).catch((err) => console.error("❌ PTT stream reset error:", err.message));
+    notifyDevice("BPstart");
 
     console.log("🔄 BP measurement started...");
     res.json({ success: true, message: "BP measurement started." });
 });
 
+// Full check-up: the device measures temperature, SpO2 and EKG together, then BP,
+// and uploads one combined result. BP still arrives through /api/live-bp.
+// A session the device never reports (crash, reboot) is ended after SESSION_TIMEOUT,
+// so new measurements can be started again.
+const SESSION_TIMEOUT = 10 * 60 * 1000;  // ms, longest EKG plus SpO2 and BP with margin
+let sessionRequestActive = false;
+let pendingSessionForUser = null;
+let lastSession = null;
+let sessionTimer = null;
+
+function endSession() {
+    clearTimeout(sessionTimer);
+    sessionTimer = null;
+    sessionRequestActive = false;
+    pendingSessionForUser = null;
+
+    // A BP run that never finished must not be handed out on its own afterwards
+    if (bpRequestActive) {
+        finishBPMeasurement();
+    }
+}
+
+app.post('/api/measure-session', (req, res) => {
+    if (!req.session.user) {
+        return res.json({ success: false, message: "Not logged in" });
+    }
+
+    if (sessionRequestActive || btRequestActive || spo2RequestActive || ekgRequestActive || bpRequestActive) {
+        return res.json({ success: false, message: "Measurement already in progress." });
+    }
+
+    pendingSessionForUser = req.session.user.username;
+    sessionRequestActive = true;
+    lastSession = null;
+
+    // BP part of the session, handed out as SESSIONstart instead of BPstart
+    pendingBPForUser = pendingSessionForUser;
+    bpRequestActive = true;
+    bpDataBuffer = [];
+    latestPTT = null;
+    resetPTTStream(BP_STREAM).catch((err) => console.error("❌ PTT stream reset error:", err.message));
+    notifyDevice("SESSIONstart");
+
+    sessionTimer = setTimeout(() => {
+        console.warn(`⚠️ Session of ${pendingSessionForUser} timed out without a result`);
+        endSession();
+    }, SESSION_TIMEOUT);
+
+    console.log("🔄 The website started a measurement session...");
+    res.json({ success: true, message: "Session started." });
+});
+
+app.post('/api/store-session', async (req, res) => {
+    const { temperature, bound, spo2, ekg, sampleRate, elapsed, error } = req.body;
+    const patientUID = pendingSessionForUser;
+
+    if (!sessionRequestActive || !patientUID) {
+        console.error("❌ Patient UID not found!");
+        return res.status(400).json({ success: false, message: "No active session." });
+    }
+
+    const confidence = bound !== undefined ? ` ± ${Number(bound).toFixed(2)}` : "";
+    console.log(`✅ Session: ${temperature}${confidence}°C, SpO₂ ${spo2}%, EKG ${ekg?.length || 0} samples, ` +
+        `${(elapsed / 1000).toFixed(1)} s, Patient: ${patientUID}`);
+    if (error) {
+        console.warn(`⚠️ Session ended early on the device: ${error}`);
+    }
+
+    try {
+        if (Number.isFinite(temperature)) {
+            await new TestResult({ thepatient: patientUID, result: temperature, testType: "bodytemp" }).save();
+        }
+        if (Number.isFinite(spo2) && spo2 > 0) {
+            await new TestResult({ thepatient: patientUID, result: spo2, testType: "spo2" }).save();
+        }
+        if (Array.isArray(ekg) && ekg.length) {
+            await new EKGResult({ thepatient: patientUID, result: ekg, testType: "ekg", sampleRate }).save();
+        }
+
+        lastSession = { temperature, bound, spo2, ekgSamples: ekg?.length || 0, PTT: latestPTT, elapsed, error };
+        endSession();
+
+        res.json({ success: true, message: "Session recorded." });
+    } catch (error) {
+        console.error("❌ Error:", error);
+        res.status(500).json({ success: false, message: "Database error." });
+    }
+});
+
+app.get('/api/get-session', (req, res) => {
+    if (lastSession !== null) {
+        res.json({ success: true, ...lastSession });
+        lastSession = null;
+    } else {
+        res.json({ success: false, message: "Session not completed yet." });
+    }
+});
+
+// Device command channel: one long-polled request instead of polling every
+// measurement endpoint. Replies {command} with "SCAN", "measure", "spo2start",
+// "EKGstart", "BPstart", "SESSIONstart" or null when nothing arrived within ?wait= seconds.
+// Each started measurement is handed out once, so the device can keep polling
+// while it measures; ?boot=1 from a restarted device hands them out again.
+const COMMAND_MAX_WAIT = 30;
+let commandWaiters = [];
+const dispatchedCommands = new Set();
+
+function nextDeviceCommand() {
+    if (scanRequestActive) {
+        scanRequestActive = false;
+        return "SCAN";
+    }
+
+    const active = [
+        [btRequestActive, "measure"],
+        [spo2RequestActive, "spo2start"],
+        [ekgRequestActive, "EKGstart"],
+        [bpRequestActive && !sessionRequestActive, "BPstart"],
+        [sessionRequestActive, "SESSIONstart"]
+    ];
+
+    for (const [isActive, command] of active) {
+        if (!isActive) {
+            dispatchedCommands.delete(command);
+        } else if (!dispatchedCommands.has(command)) {
+            dispatchedCommands.add(command);
+            return command;
+        }
+    }
+    return null;
+}
+
+// A measurement was (re)started: make sure the device gets it, even if an earlier run was handed out
+function notifyDevice(command) {
+    dispatchedCommands.delete(command);
+
+    const waiters = commandWaiters;
+    commandWaiters = [];
+
+    for (const waiter of waiters) {
+        clearTimeout(waiter.timer);
+        waiter.res.json({ command: nextDeviceCommand() });
+    }
+}
+
+app.get("/api/command", (req, res) => {
+    if (req.query.boot) {
+        dispatchedCommands.clear();
+    }
+
+    const command = nextDeviceCommand();
+    const wait = Math.min(parseFloat(req.query.wait) || 0, COMMAND_MAX_WAIT);
+
+    if (command || wait <= 0) {
+        return res.json({ command });
+    }
+
+    const waiter = { res };
+    waiter.timer = setTimeout(() => {
+        commandWaiters = commandWaiters.filter((w) => w !== waiter);
+        res.json({ command: null });
+    }, wait * 1000);
+
+    req.on("close", () => {
+        if (!res.writableEnded) {
+            clearTimeout(waiter.timer);
+            commandWaiters = commandWaiters.filter((w) => w !== waiter);
+        }
+    });
+
+    commandWaiters.push(waiter);
+});
+
+// Single sample object, a chunk of parallel arrays (timestamp, max30102_ir, max30102_red, icquanzx)
+// or a BP sensor frame
+function toBPSamples(body) {
+    if (Buffer.isBuffer(body)) {
+        const frame = decodeFrame(body);
+        if (frame.sensor !== SENSOR_BP) {
+            throw new Error("Not a BP frame");
+        }
+
+        // Frames carry raw ICQUANZX ADC counts; without ticks samples are evenly spaced (ms)
+        const [ir, red, icq] = frame.channels;
+        return ir.map((value, i) => ({
+            timestamp: frame.ticks ? frame.ticks[i] : frame.startTick + Math.round(i * 1000 / frame.sampleRate),
+            max30102_ir: value,
+            max30102_red: red[i],
+            icquanzx: icq[i] / 65535
+        }));
+    }
+
+    if (!body || !Array.isArray(body.timestamp)) {
+        return [body];
+    }
+
+    return body.timestamp.map((timestamp, i) => ({
+        timestamp,
+        max30102_ir: body.max30102_ir?.[i],
+        max30102_red: body.max30102_red?.[i],
+        icquanzx: body.icquanzx?.[i]
+    }));
+}
+
 app.post("/api/live-bp", async (req, res) => {
-    const bpData = req.body;
+    let bpSamples;
+    try {
+        bpSamples = toBPSamples(req.body);
+    } catch (err) {
+        return res.status(400).json({ success: false, message: err.message });
+    }
 
-    if (!bpData || !bpData.timestamp || !bpData.max30102_ir || !bpData.icquanzx) {
-        return res.status(400).json({ success: false, message: "Invalid BP data format" });
+    // Samples are checked one by one: the device writes 0 when a sensor read failed,
+    // and such a sample (or a non-numeric one) is dropped without losing the chunk
+    const isReading = (value) => Number.isFinite(value) && value !== 0;
+    const isValid = (bpData) => bpData && Number.isFinite(bpData.timestamp) &&
+        isReading(bpData.max30102_ir) && isReading(bpData.icquanzx);
+    const received = bpSamples.length;
+    bpSamples = bpSamples.filter(isValid);
+    const dropped = received - bpSamples.length;
+    if (!bpSamples.length) {
+        return res.status(400).json({ success: false, message: "Invalid BP data format", dropped });
+    }
+    if (dropped) {
+        console.warn(`⚠️ Dropped ${dropped} of ${received} BP samples without a sensor reading`);
+    }
+
+    if (!bpRequestActive) {
+        return res.json({ success: true, done: true, message: "No active BP measurement." });
     }
 
-    bpDataBuffer.push(bpData);
+    bpDataBuffer.push(...bpSamples);
 
-    if (bpDataBuffer.length >= 200) {  
+    // Live estimate, finishes as soon as enough beats are paired
+    try {
+        const live = await streamPTT(BP_STREAM, bpSamples, BP_STREAM_BEATS);
+
+        if (live.success && live.beats >= BP_STREAM_BEATS && bpRequestActive) {
+            console.log(`✅ Live PTT after ${live.beats} beats, ${bpDataBuffer.length} samples`);
+            const patientUID = pendingBPForUser;
+            finishBPMeasurement();
+            await saveBPResult(live.PTT, patientUID);
+            return res.json({ success: true, done: true, message: "BP measurement done" });
+        }
+    } catch (err) {
+        console.error("❌ Live PTT error:", err.message);
+    }
+
+    if (bpDataBuffer.length >= 200 && bpRequestActive) {  
         console.log("✅ Data received, calculating PTT...");
         
         try {
@@ -473,74 +854,54 @@ app.post("/api/live-bp", async (req, res) => {
             console.error("❌ BP test error:", err.message);
         }
 
-        bpRequestActive = false;  
-        pendingBPForUser = null;  
-        bpDataBuffer = []; 
+        finishBPMeasurement();
+        return res.json({ success: true, done: true, message: "BP measurement done" });
     }
 
-    res.json({ success: true, message: "BP data received" });
+    res.json({ success: true, message: "BP data received", dropped });
 });
 
-function processBPData(sensorData) {
-    return new Promise((resolve, reject) => {
-        console.log("📡 Data sent to Python script:", JSON.stringify(sensorData));
+async function processBPData(sensorData) {
+    console.log("📡 Data sent to PTT worker:", JSON.stringify(sensorData));
 
-        const pythonProcess = spawn("python", ["src/calculate_ptt.py"]);
+    const output = await calculatePTT(sensorData);
 
-        pythonProcess.stdin.write(JSON.stringify(sensorData));
-        pythonProcess.stdin.end();
+    if (typeof output !== "object" || output === null) {
+        throw new Error("Invalid JSON format from Python script.");
+    }
 
-        let resultData = "";
+    console.log("✅ JSON Output:", output);
 
-        pythonProcess.stdout.on("data", (data) => {
-            console.log("📡 Data from Python script:", data.toString());
-            resultData += data.toString();
-        });
+    if (!output.success) {
+        console.warn(`⚠️ PTT could not be calculated: ${output.error}`);
+        throw new Error(output.error || "PTT could not be calculated");
+    }
 
-        pythonProcess.stderr.on("data", (data) => {
-            console.error(`❌ Python error: ${data}`);
-        });
+    return saveBPResult(output.PTT, pendingBPForUser);
+}
 
-        pythonProcess.on("close", async () => {
-            try {
-                console.log("📡 Raw data:", resultData); // JSON raw data
-                const output = JSON.parse(resultData);
-            
-                if (typeof output !== "object" || output === null) {
-                    throw new Error("Invalid JSON format from Python script.");
-                }
-            
-                console.log("✅ JSON Output:", output);
-            
-                if (!output.success) {  
-                    console.warn(`⚠️ PTT could not be calculated: ${output.error}`);
-                    return reject(new Error(output.error || "PTT could not be calculated"));
-                }
-            
-                const patientUID = pendingBPForUser;
-                if (!patientUID) {
-                    console.error("❌ Patient UID not found!");
-                    return reject(new Error("Patient UID not found."));
-                }
-            
-                const newBPRecord = new BloodPressure({
-                    thepatient: patientUID,
-                    PTT: output.PTT,
-                    date: new Date().toLocaleString()
-                });
-            
-                await newBPRecord.save();
-                console.log(`✅ PTT saved: ${output.PTT} ms`);
-                latestPTT = output.PTT;
-                return resolve({ success: true, PTT: output.PTT });
-            
-            } catch (err) {
-                console.error("❌ JSON Parse error:", err.message);
-                console.error("📡 Raw data:", resultData); 
-                return reject(new Error("JSON error."));
-            }            
-        });
+async function saveBPResult(PTT, patientUID) {
+    if (!patientUID) {
+        console.error("❌ Patient UID not found!");
+        throw new Error("Patient UID not found.");
+    }
+
+    const newBPRecord = new BloodPressure({
+        thepatient: patientUID,
+        PTT,
+        date: new Date().toLocaleString()
     });
+
+    await newBPRecord.save();
+    console.log(`✅ PTT saved: ${PTT} ms`);
+    latestPTT = PTT;
+    return { success: true, PTT };
+}
+
+function finishBPMeasurement() {
+    bpRequestActive = false;
+    pendingBPForUser = null;
+    bpDataBuffer = [];
 }
 
 app.get("/api/get-latest-bp", async (req, res) => {
@@ -816,7 +1177,11 @@ app.get('/auth/logout', (req, res) => {
 
 // Start server.
 const PORT = process.env.PORT || 5000;
-app.listen(PORT, '0.0.0.0', () => {
+const server = app.listen(PORT, '0.0.0.0', () => {
     console.log(`🚀 Server running on port ${PORT}`);
     console.log(`🌍 Visit the application at: http://localhost:${PORT}`);
 });
+
+// Devices keep one connection open between requests, don't drop it after the default 5 s
+server.keepAliveTimeout = 65000;
+server.headersTimeout = 66000;
@@ -0,0 +1,132 @@
+import sys
+import json
+import base64
+import argparse
+import numpy as np
+from scipy.signal import lfilter
+import calculate_ptt
+from calculate_ptt import wireformat
+
+# Server side twin of RPI/spo2algorithm.py. Every function works on a batch of
+# recordings at once (one recording per row, samples along the last axis) and
+# process_spo2 gives the same values as the device for the same red/IR samples.
+
+ALPHA = 0.05  # IIR baseline weight, as on the device
+TAIL_LEN = 10  # samples averaged for the DC level
+
+
+# Cumulative-sum moving average, O(n) instead of one sum per window
+def moving_average(signal, window_size=5):
+    signal = np.asarray(signal, dtype=np.float64)
+    if signal.shape[-1] < window_size:
+        return signal[..., :0]
+    sums = np.cumsum(signal, axis=-1)
+    sums = np.concatenate((np.zeros(sums.shape[:-1] + (1,)), sums), axis=-1)
+    return (sums[..., window_size:] - sums[..., :-window_size]) / window_size
+
+
+def standard_deviation(values):
+    return np.std(np.asarray(values, dtype=np.float64), axis=-1)
+
+
+# y[i] = alpha * x[i] + (1 - alpha) * y[i - 1], starting from the first sample.
+# lfilter does the same two multiplies and one add per sample, so the result
+# matches the device loop exactly.
+def iir_baseline(signal, alpha=ALPHA):
+    signal = np.asarray(signal, dtype=np.float64)
+    zi = (1 - alpha) * signal[..., :1]
+    baseline, _ = lfilter([alpha], [1, -(1 - alpha)], signal, axis=-1, zi=zi)
+    return baseline
+
+
+# SpO2 for a (recordings, samples) batch of red/IR values, or a single recording.
+# Recordings shorter than TAIL_LEN give 0, like the device.
+def process_spo2(red, ir, sample_rate=400):
+    red = np.atleast_2d(np.asarray(red, dtype=np.float64))
+    ir = np.atleast_2d(np.asarray(ir, dtype=np.float64))
+    if red.shape != ir.shape:
+        raise ValueError("Red and IR shapes differ")
+
+    if red.shape[-1] < TAIL_LEN:
+        return np.zeros(red.shape[0])
+
+    red_ac_list = red - iir_baseline(red)
+    ir_ac_list = ir - iir_baseline(ir)
+    red_ac = red_ac_list.max(axis=-1) - red_ac_list.min(axis=-1)
+    ir_ac = ir_ac_list.max(axis=-1) - ir_ac_list.min(axis=-1)
+
+    # Summed left to right like Python's sum()
+    red_dc = np.cumsum(red[:, -TAIL_LEN:], axis=-1)[:, -1] / TAIL_LEN
+    ir_dc = np.cumsum(ir[:, -TAIL_LEN:], axis=-1)[:, -1] / TAIL_LEN
+
+    # A flat IR window (ir_ac == 0) raises on the device, here it gets ratio 0
+    valid = (red_dc != 0) & (ir_dc != 0) & (ir_ac != 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(valid, (red_ac / red_dc) / (ir_ac / ir_dc), 0)
+
+    spo2 = np.clip(110 - 25 * ratio, 70, 100)
+
+    # np.round rounds differently from Python's round() on some halves
+    return np.array([round(float(value), 1) for value in spo2])
+
+
+# Recording to (red, ir, device spo2 or None). Accepts {"red": [...], "ir": [...],
+# "spo2": ...} or an SpO2 device frame, raw or base64-encoded as {"frame": "..."}.
+def load_recording(raw):
+    if not isinstance(raw, bytes):
+        data = json.loads(raw)
+        if "frame" not in data:
+            return np.asarray(data["red"]), np.asarray(data["ir"]), data.get("spo2")
+        raw = base64.b64decode(data["frame"])
+
+    header, _, (red, ir) = calculate_ptt.decode_wire_frame(raw)
+    if header["sensor"] != wireformat.SENSOR_SPO2:
+        raise ValueError("Not an SpO2 frame")
+    return red, ir, None
+
+
+# Recomputes SpO2 for recorded sessions (same inputs as calculate_ptt.py --batch).
+# Recordings of equal length are computed together in one batch.
+def run_batch(path):
+    sessions = []
+    groups = {}
+    for session, raw in calculate_ptt.iter_sessions(path):
+        try:
+            red, ir, device = load_recording(raw)
+        except Exception as e:
+            print(json.dumps({"session": session, "success": False, "error": str(e)}))
+            continue
+        sessions.append((session, device))
+        groups.setdefault(len(red), []).append((len(sessions) - 1, red, ir))
+
+    results = [None] * len(sessions)
+    for rows in groups.values():
+        values = process_spo2([r[1] for r in rows], [r[2] for r in rows])
+        for (index, _, _), value in zip(rows, values):
+            results[index] = float(value)
+
+    mismatches = 0
+    for (session, device), spo2 in zip(sessions, results):
+        row = {"session": session, "success": True, "spo2": spo2}
+        if device is not None:
+            row["device_spo2"] = device
+            row["match"] = device == spo2
+            mismatches += not row["match"]
+        print(json.dumps(row))
+
+    print(f"{len(sessions)} recordings, {mismatches} differ from the device value", file=sys.stderr)
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SpO2 recomputation from raw red/IR recordings")
+    parser.add_argument("batch", metavar="PATH",
+                        help="directory or JSONL file of recordings, one JSON result line per recording")
+    args = parser.parse_args()
+
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.exit(1 if run_batch(args.batch) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+from collections import deque
+import numpy as np
+from scipy.signal import sosfilt, sosfilt_zi
+from ptt_stream import PeakDetector
+from bp_pipeline.filters import bandpass_sos
+
+
+# Causal bandpass that keeps the filter state between calls, so every sample is
+# filtered once. Unlike filtfilt over a window this delays the signal by the filter's
+# group delay; both BP channels go through the same filter, so their peak times
+# shift alike and the PTT between them is unchanged.
+class StreamingBandpass:
+    def __init__(self, fs=50.0, lowcut=0.8, highcut=2.5, order=6):
+        self.sos = bandpass_sos(fs, lowcut, highcut, order)
+        self.sections = [tuple(section) for section in self.sos.tolist()]
+        self.zi_step = sosfilt_zi(self.sos)
+        self.zi = None
+
+    def reset(self):
+        self.zi = None
+
+    # Chunk of samples, returns the filtered chunk
+    def process(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return values
+        if self.zi is None:
+            # Start as if the first value had always been there (no step response)
+            self.zi = (self.zi_step * values[0]).tolist()
+        filtered, zi = sosfilt(self.sos, values, zi=np.array(self.zi))
+        self.zi = zi.tolist()
+        return filtered
+
+    # Single sample. sosfilt's per-call overhead is far larger than the filter itself,
+    # so the same sections are run here in plain Python (same operations as sosfilt)
+    def add(self, value):
+        if self.zi is None:
+            self.zi = (self.zi_step * value).tolist()
+        for (b0, b1, b2, _, a1, a2), z in zip(self.sections, self.zi):
+            out = b0 * value + z[0]
+            z[0] = b1 * value - a1 * out + z[1]
+            z[1] = b2 * value - a2 * out
+            value = out
+        return value
+
+
+# Streaming replacement for bandpass + find_peaks over a rolling window. Peaks of the
+# filtered signal are confirmed by PeakDetector once it has fallen `prominence` below
+# them; a peak also has to be `height` above the mean of the last `window` filtered
+# samples, and peaks within `distance` samples of the previous one are refractory.
+# Confirmed peak timestamps are kept in order in a bounded deque with a set for
+# membership tests. O(1) work per sample, independent of how long the stream ran.
+class StreamingPeaks:
+    def __init__(self, height, prominence, distance=50, window=200, history=64,
+                 fs=50.0, lowcut=0.8, highcut=2.5, order=6):
+        self.filter = StreamingBandpass(fs, lowcut, highcut, order)
+        self.detector = PeakDetector(prominence, 0)
+        self.height = height
+        self.distance = distance
+
+        self.recent = deque(maxlen=window)
+        self.recent_sum = 0.0
+        self.index = -1
+        self.last_peak_index = None
+
+        self.peaks = deque(maxlen=history)
+        self.peak_set = set()
+
+    def __len__(self):
+        return len(self.peaks)
+
+    def __contains__(self, timestamp):
+        return timestamp in self.peak_set
+
+    # One raw sample, returns the timestamp of a newly confirmed peak or None
+    def add(self, value, timestamp):
+        return self.add_filtered(self.filter.add(value), timestamp)
+
+    # Chunk of raw samples filtered in one call, returns the new peak timestamps
+    def add_samples(self, values, timestamps):
+        new_peaks = []
+        for value, timestamp in zip(self.filter.process(values).tolist(), timestamps):
+            peak = self.add_filtered(value, timestamp)
+            if peak is not None:
+                new_peaks.append(peak)
+        return new_peaks
+
+    def add_filtered(self, value, timestamp):
+        self.index += 1
+        if len(self.recent) == self.recent.maxlen:
+            self.recent_sum -= self.recent[0]
+        self.recent.append(value)
+        self.recent_sum += value
+
+        peak = self.detector.add(value, timestamp)
+        if peak is None:
+            return None
+
+        detector = self.detector
+        if detector.max_value < self.recent_sum / len(self.recent) + self.height:
+            return None
+        if self.last_peak_index is not None and detector.max_index - self.last_peak_index < self.distance:
+            return None
+        if peak in self.peak_set:
+            return None
+
+        self.last_peak_index = detector.max_index
+        if len(self.peaks) == self.peaks.maxlen:
+            self.peak_set.discard(self.peaks[0])
+        self.peaks.append(peak)
+        self.peak_set.add(peak)
+        return peak
+
+    # Last n confirmed peak timestamps, oldest first
+    def last(self, n):
+        n = min(n, len(self.peaks))
+        return [self.peaks[-i] for i in range(n, 0, -1)]
@@ -0,0 +1,131 @@
+import os
+import sys
+import asyncio
+import tempfile
+import unittest
+
+# Store-and-forward queue of the firmware (RPI/lib/outbox.py), run on desktop Python.
+# Run with: python -m unittest test_outbox (in src)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RPI", "lib"))
+import outbox
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def close(self):
+        pass
+
+
+# Stand-in for httpclient.AsyncHTTPClient: raises OSError while offline, otherwise
+# answers with the next queued status code (200 once they are used up)
+class Client:
+    def __init__(self, offline=False, statuses=()):
+        self.offline = offline
+        self.statuses = list(statuses)
+        self.received = []
+
+    async def post(self, path, body, content_type=b"application/octet-stream"):
+        if self.offline:
+            raise OSError("network unreachable")
+        self.received.append((path, body, content_type))
+        return Response(self.statuses.pop(0) if self.statuses else 200)
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "outbox")
+        self.store = outbox.FlashQueue(self.path, slots=16, slot_size=64)
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def reopen(self):
+        self.store.close()
+        self.store = outbox.FlashQueue(self.path, slots=16, slot_size=64)
+
+    def send(self, client, path, body, direct=False):
+        return asyncio.run(outbox.send(client, path, body, store=self.store, direct=direct))
+
+    def test_failed_upload_is_queued_and_drained_in_order(self):
+        offline = Client(offline=True)
+        self.assertIsNone(asyncio.run(outbox.send_json(offline, "/api/store-session", {"n": 0},
+                                                       self.store)))
+        self.assertEqual(len(self.store), 1)
+
+        # Back online, but older uploads are queued: later ones queue behind them
+        online = Client()
+        self.assertIsNone(self.send(online, "/api/store-EKG", b"1"))
+        self.assertIsNone(self.send(offline, "/api/store-EKG", b"2"))
+        self.assertEqual(online.received, [])
+
+        self.reopen()
+        self.assertEqual(asyncio.run(self.store.drain(online)), 3)
+        self.assertEqual(online.received, [
+            ("/api/store-session", b'{"n": 0}', b"application/json"),
+            ("/api/store-EKG", b"1", b"application/octet-stream"),
+            ("/api/store-EKG", b"2", b"application/octet-stream"),
+        ])
+        self.assertTrue(self.store.is_empty())
+
+        response = self.send(online, "/api/store-EKG", b"3")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.store.is_empty())
+
+    def test_direct_upload(self):
+        self.send(Client(offline=True), "/old", b"0")
+
+        # Sent even though an older upload is queued, and queued when it fails
+        online = Client()
+        self.assertEqual(self.send(online, "/chunk?seq=1", b"1", direct=True).status_code, 200)
+        self.assertIsNone(self.send(Client(offline=True), "/chunk?seq=2", b"2", direct=True))
+        self.assertEqual(len(self.store), 2)
+
+        asyncio.run(self.store.drain(online))
+        self.assertEqual([path for path, _, _ in online.received], ["/chunk?seq=1", "/old", "/chunk?seq=2"])
+
+    def test_full_queue_is_drained_before_refusing(self):
+        offline = Client(offline=True)
+        for i in range(self.store.slots):
+            self.send(offline, "/x", bytes([i]) * 20)
+        self.assertEqual(self.store.free(), 0)
+
+        # Refused while the server stays unreachable
+        self.send(offline, "/x", b"late")
+        self.assertEqual(self.store.free(), 0)
+
+        # A server error while draining leaves the queue full, the upload is refused
+        busy = Client(statuses=[503])
+        self.send(busy, "/x", b"late")
+        self.assertEqual(self.store.free(), 0)
+        self.assertEqual(len(busy.received), 1)
+
+        # Drained once the server answers, then queued behind the older uploads
+        online = Client()
+        self.send(online, "/x", b"late")
+        self.assertEqual(len(online.received), self.store.slots)
+        self.assertEqual(len(self.store), 1)
+        asyncio.run(self.store.drain(online))
+        self.assertEqual([body for _, body, _ in online.received][-2:], [bytes([15]) * 20, b"late"])
+
+    def test_server_errors_drop_a_record_after_max_attempts(self):
+        self.send(Client(offline=True), "/bad", b"0")
+        self.send(Client(offline=True), "/good", b"1")
+
+        client = Client(statuses=[500] * outbox.MAX_ATTEMPTS)
+        for attempt in range(1, outbox.MAX_ATTEMPTS):
+            self.assertEqual(asyncio.run(self.store.drain(client)), 0)
+            self.reopen()
+            self.store.peek()
+            self.assertEqual(self.store.attempts, attempt)
+
+        self.assertEqual(asyncio.run(self.store.drain(client)), 1)
+        self.assertEqual([path for path, _, _ in client.received][-2:], ["/bad", "/good"])
+        self.assertTrue(self.store.is_empty())
+
+
+if __name__ == "__main__":
+    unittest.main()
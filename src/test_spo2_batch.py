@@ -0,0 +1,106 @@
+import os
+import sys
+import unittest
+import numpy as np
+import spo2_batch
+
+# spo2_batch.process_spo2 and the incremental SpO2Estimator against the device's
+# list based process_spo2 (RPI/spo2algorithm.py): equal values for the same samples.
+# Run with: python -m unittest test_spo2_batch (in src)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RPI"))
+import spo2algorithm
+
+
+# Pulsing red/IR recordings (ints, like the MAX30102 FIFO) at 400 Hz
+def recordings(rng, count, n, fs=400):
+    t = np.arange(n) / fs
+    rate = rng.uniform(0.8, 2.5, (count, 1))
+    level = rng.uniform(5000, 120000, (count, 1))
+    pulse = np.sin(2 * np.pi * rate * t)
+    ir = level + level * rng.uniform(0.002, 0.05, (count, 1)) * pulse + rng.normal(0, 20, (count, n))
+    red = 0.8 * level + level * rng.uniform(0.001, 0.05, (count, 1)) * pulse + rng.normal(0, 20, (count, n))
+    return np.maximum(red, 0).astype(int).tolist(), np.maximum(ir, 0).astype(int).tolist()
+
+
+def estimate(red, ir):
+    estimator = spo2algorithm.SpO2Estimator()
+    for red_val, ir_val in zip(red, ir):
+        estimator.add(red_val, ir_val)
+    return estimator.result()
+
+
+class BatchTest(unittest.TestCase):
+    def assert_batch_matches_device(self, red, ir):
+        expected = [spo2algorithm.process_spo2(r, i) for r, i in zip(red, ir)]
+        self.assertEqual(spo2_batch.process_spo2(red, ir).tolist(), expected)
+
+    def test_random_batches(self):
+        rng = np.random.default_rng(0)
+        for count in (1, 7, 500):
+            with self.subTest(count=count):
+                self.assert_batch_matches_device(*recordings(rng, count, 200))
+
+    def test_noise_only(self):
+        rng = np.random.default_rng(1)
+        red = rng.integers(0, 0x3FFFF, (200, 100)).tolist()
+        ir = rng.integers(1, 0x3FFFF, (200, 100)).tolist()
+        self.assert_batch_matches_device(red, ir)
+
+    def test_unequal_lengths(self):
+        # Grouped by length as in run_batch; every group gives the device values
+        rng = np.random.default_rng(2)
+        for n in (spo2_batch.TAIL_LEN, 11, 57, 200, 1000):
+            with self.subTest(n=n):
+                self.assert_batch_matches_device(*recordings(rng, 20, n))
+
+        red, ir = recordings(rng, 2, 50)
+        with self.assertRaisesRegex(ValueError, "shapes differ"):
+            spo2_batch.process_spo2(red, [row[:-1] for row in ir])
+
+    def test_shorter_than_tail(self):
+        rng = np.random.default_rng(3)
+        for n in range(1, spo2_batch.TAIL_LEN):
+            with self.subTest(n=n):
+                red, ir = recordings(rng, 5, n)
+                self.assertEqual(spo2_batch.process_spo2(red, ir).tolist(), [0] * 5)
+                self.assert_batch_matches_device(red, ir)
+
+    def test_flat_ir(self):
+        # The device divides by the zero IR AC and raises; the batch gives ratio 0
+        red, ir = recordings(np.random.default_rng(4), 3, 200)
+        ir[1] = [50000] * 200
+        with self.assertRaises(ZeroDivisionError):
+            spo2algorithm.process_spo2(red[1], ir[1])
+
+        values = spo2_batch.process_spo2(red, ir).tolist()
+        self.assertEqual(values[1], 100.0)
+        self.assertEqual([values[0], values[2]],
+                         [spo2algorithm.process_spo2(red[i], ir[i]) for i in (0, 2)])
+
+
+class EstimatorTest(unittest.TestCase):
+    def test_same_as_process_spo2(self):
+        rng = np.random.default_rng(5)
+        for n in (1, spo2_batch.TAIL_LEN - 1, spo2_batch.TAIL_LEN, 11, 23, 200, 1000):
+            red, ir = recordings(rng, 20, n)
+            for i in range(20):
+                with self.subTest(n=n, recording=i):
+                    self.assertEqual(estimate(red[i], ir[i]), spo2algorithm.process_spo2(red[i], ir[i]))
+
+    def test_reset(self):
+        red, ir = recordings(np.random.default_rng(6), 2, 200)
+        estimator = spo2algorithm.SpO2Estimator()
+        for row in range(2):
+            estimator.reset()
+            for red_val, ir_val in zip(red[row], ir[row]):
+                estimator.add(red_val, ir_val)
+            self.assertEqual(estimator.result(), spo2algorithm.process_spo2(red[row], ir[row]))
+
+    def test_flat_ir(self):
+        red, ir = recordings(np.random.default_rng(7), 1, 200)
+        with self.assertRaises(ZeroDivisionError):
+            estimate(red[0], [50000] * 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
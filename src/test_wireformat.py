@@ -0,0 +1,194 @@
+import os
+import json
+import shutil
+import unittest
+import subprocess
+import calculate_ptt
+from calculate_ptt import wireformat
+
+# Round trips of device frames (RPI/lib/wireformat.py) through the three decoders:
+# wireformat.decode (device/plain Python), calculate_ptt.decode_wire_frame (NumPy)
+# and src/wireformat.js (server). Run with: python -m unittest test_wireformat (in src)
+
+WIREFORMAT_JS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wireformat.js")
+
+# Decodes hex frames from stdin, one {"frame": ...} or {"error": ...} per frame
+JS_DECODER = """
+import { readFileSync } from "fs";
+import { pathToFileURL } from "url";
+const { decodeFrame } = await import(pathToFileURL(process.argv[1]).href);
+const results = JSON.parse(readFileSync(0, "utf8")).map((hex) => {
+    try {
+        const frame = decodeFrame(Buffer.from(hex, "hex"));
+        return { frame: { sensor: frame.sensor, count: frame.count, startTick: frame.startTick,
+                          ticks: frame.ticks, channels: frame.channels } };
+    } catch (err) {
+        return { error: err.message };
+    }
+});
+process.stdout.write(JSON.stringify(results));
+"""
+
+MODES = {"raw": {}, "delta": {"delta": True}, "varint": {"varint": True}}
+
+
+def decode_js(frames):
+    result = subprocess.run(["node", "--input-type=module", "-e", JS_DECODER, WIREFORMAT_JS],
+                            input=json.dumps([frame.hex() for frame in frames]),
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+def decode_python(frame):
+    header, ticks, channels = wireformat.decode(frame)
+    return header, None if ticks is None else list(ticks), [list(c) for c in channels]
+
+
+def decode_numpy(frame):
+    header, ticks, channels = calculate_ptt.decode_wire_frame(frame)
+    return header, None if ticks is None else ticks.tolist(), [c.tolist() for c in channels]
+
+
+# Channel columns for a sensor: slow ramps plus a jump, so delta coding is used
+# for some columns and not for others
+def sample_channels(sensor, count):
+    columns = []
+    for i, typecode in enumerate(wireformat.CHANNELS[sensor]):
+        if typecode == "H":
+            columns.append([(1000 * i + 37 * j) % 65536 for j in range(count)])
+        else:
+            columns.append([(200000 + 3 * j * (i + 1) + (i > 0 and j == count // 2) * 40000) & 0xFFFFFFFF
+                            for j in range(count)])
+    return columns
+
+
+class RoundTripTest(unittest.TestCase):
+    def assert_decodes(self, frame, sensor, channels, ticks=None):
+        for decode in (decode_python, decode_numpy):
+            header, frame_ticks, frame_channels = decode(frame)
+            self.assertEqual(header["sensor"], sensor)
+            self.assertEqual(header["count"], len(channels[0]))
+            self.assertEqual(frame_ticks, None if ticks is None else list(ticks))
+            self.assertEqual(frame_channels, [list(c) for c in channels])
+
+    def test_counts_and_modes(self):
+        for sensor in wireformat.CHANNELS:
+            for count in (0, 1, 2, 50):
+                for mode, options in MODES.items():
+                    for with_ticks in (False, True):
+                        with self.subTest(sensor=sensor, count=count, mode=mode, ticks=with_ticks):
+                            channels = sample_channels(sensor, count)
+                            ticks = [5000 + 20 * j for j in range(count)] if with_ticks else None
+                            frame = wireformat.encode(sensor, channels, 50, start_tick=5000, ticks=ticks,
+                                                      **options)
+                            self.assert_decodes(frame, sensor, channels, ticks)
+
+    def test_tick_wraparound(self):
+        ticks = [(0xFFFFFF00 + 20 * j) & 0xFFFFFFFF for j in range(30)]
+        self.assertLess(ticks[-1], ticks[0])
+        channels = sample_channels(wireformat.SENSOR_BP, len(ticks))
+        for mode, options in MODES.items():
+            with self.subTest(mode=mode):
+                frame = wireformat.encode(wireformat.SENSOR_BP, channels, 50, ticks=ticks, **options)
+                self.assert_decodes(frame, wireformat.SENSOR_BP, channels, ticks)
+
+    def test_column_extremes(self):
+        # Full range jumps: too large for int16 deltas, largest varints
+        red = [0, 0xFFFFFFFF, 0, 1, 0xFFFFFFFE]
+        ir = [0xFFFFFFFF, 0, 0xFFFFFFFF, 5, 6]
+        for mode, options in MODES.items():
+            with self.subTest(mode=mode):
+                frame = wireformat.encode(wireformat.SENSOR_SPO2, (red, ir), 400, **options)
+                self.assert_decodes(frame, wireformat.SENSOR_SPO2, (red, ir))
+
+    def test_delta_only_where_it_fits(self):
+        channels = sample_channels(wireformat.SENSOR_BP, 20)
+        header = wireformat.read_header(wireformat.encode(wireformat.SENSOR_BP, channels, 50, delta=True))
+        # IR is delta coded, red has a jump of 40000, the 16 bit ICQ column stays raw
+        self.assertEqual(header["delta_mask"], 0b001)
+
+    def test_version_1_frames(self):
+        channels = sample_channels(wireformat.SENSOR_EKG, 10)
+        frame = bytearray(wireformat.encode(wireformat.SENSOR_EKG, channels, 250))
+        frame[4] = 1
+        self.assert_decodes(bytes(frame), wireformat.SENSOR_EKG, channels)
+
+    def test_load_wire_frame(self):
+        channels = sample_channels(wireformat.SENSOR_BP, 4)
+        frame = wireformat.encode(wireformat.SENSOR_BP, channels, 50, start_tick=1000)
+        ticks, ir, icq = calculate_ptt.load_wire_frame(frame)
+        self.assertEqual(ticks.tolist(), [1000, 1020, 1040, 1060])
+        self.assertEqual(ir.tolist(), channels[0])
+        self.assertEqual(icq.tolist(), [value / 65535 for value in channels[2]])
+
+
+def invalid_frames():
+    """(name, frame, part of the expected error message) for every decoder."""
+    channels = sample_channels(wireformat.SENSOR_BP, 10)
+    ticks = list(range(10))
+    frames = []
+    for mode, options in MODES.items():
+        frame = wireformat.encode(wireformat.SENSOR_BP, channels, 50, ticks=ticks, **options)
+        for length in (0, 3, wireformat.HEADER_SIZE - 1):
+            frames.append((f"{mode} cut to {length}", frame[:length], "Not a sensor frame"))
+        for length in range(wireformat.HEADER_SIZE, len(frame)):
+            frames.append((f"{mode} cut to {length}", frame[:length], ""))
+        frames.append((f"{mode} trailing byte", frame + b"\0", ""))
+
+    frame = bytearray(wireformat.encode(wireformat.SENSOR_BP, channels, 50))
+    for version in (0, 3, 255):
+        frame[4] = version
+        frames.append((f"version {version}", bytes(frame), "version"))
+    frame[4] = wireformat.VERSION
+    for sensor in (0, 4, 255):
+        frame[5] = sensor
+        frames.append((f"sensor {sensor}", bytes(frame), "sensor type"))
+    return frames
+
+
+class InvalidFrameTest(unittest.TestCase):
+    def test_python_decoders_reject(self):
+        for name, frame, message in invalid_frames():
+            for decode in (wireformat.decode, calculate_ptt.decode_wire_frame):
+                with self.subTest(frame=name, decoder=decode.__module__):
+                    with self.assertRaisesRegex(ValueError, message):
+                        decode(frame)
+
+    def test_wrong_sensor_for_bp(self):
+        frame = wireformat.encode(wireformat.SENSOR_EKG, sample_channels(wireformat.SENSOR_EKG, 5), 250)
+        with self.assertRaisesRegex(ValueError, "Not a BP frame"):
+            calculate_ptt.load_wire_frame(frame)
+
+
+@unittest.skipUnless(shutil.which("node"), "node is not installed")
+class JavaScriptDecoderTest(unittest.TestCase):
+    def test_same_values_as_python(self):
+        frames = []
+        for sensor in wireformat.CHANNELS:
+            for count in (0, 1, 2, 50):
+                for options in MODES.values():
+                    channels = sample_channels(sensor, count)
+                    ticks = [(0xFFFFFF00 + 20 * j) & 0xFFFFFFFF for j in range(count)]
+                    frames.append(wireformat.encode(sensor, channels, 50, start_tick=7, **options))
+                    frames.append(wireformat.encode(sensor, channels, 50, ticks=ticks, **options))
+
+        for frame, result in zip(frames, decode_js(frames)):
+            header, ticks, channels = decode_python(frame)
+            self.assertNotIn("error", result)
+            decoded = result["frame"]
+            self.assertEqual(decoded["sensor"], header["sensor"])
+            self.assertEqual(decoded["count"], header["count"])
+            self.assertEqual(decoded["startTick"], header["start_tick"])
+            self.assertEqual(decoded["ticks"], ticks)
+            self.assertEqual(decoded["channels"], channels)
+
+    def test_rejects_invalid_frames(self):
+        frames = invalid_frames()
+        for (name, _, message), result in zip(frames, decode_js([frame for _, frame, _ in frames])):
+            with self.subTest(frame=name):
+                self.assertIn("error", result)
+                self.assertIn(message, result["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
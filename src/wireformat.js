@@ -0,0 +1,108 @@
+// Decoder for the binary sensor frames written by the device, see
+// RPI/lib/wireformat.py for the layout. Keep both in step.
+export const SENSOR_EKG = 1;
+export const SENSOR_BP = 2;
+export const SENSOR_SPO2 = 3;
+
+const MAGIC = "IoMT";
+const VERSIONS = [1, 2];
+const HEADER_SIZE = 20;
+const FLAG_TICKS = 0x01;
+const FLAG_VARINT = 0x02;
+
+const CHANNELS = { [SENSOR_EKG]: "H", [SENSOR_BP]: "IIH", [SENSOR_SPO2]: "II" };
+const SIZES = { H: 2, I: 4 };
+
+// Frame Buffer to {version, sensor, sampleRate, count, deviceId, startTick, ticks, channels}
+export function decodeFrame(buf) {
+    if (buf.length < HEADER_SIZE || buf.toString("latin1", 0, 4) !== MAGIC) {
+        throw new Error("Not a sensor frame");
+    }
+
+    const version = buf.readUInt8(4);
+    const sensor = buf.readUInt8(5);
+    const flags = buf.readUInt8(6);
+    const deltaMask = buf.readUInt8(7);
+    const sampleRate = buf.readUInt16LE(8);
+    const count = buf.readUInt16LE(10);
+    const deviceId = buf.readUInt32LE(12);
+    const startTick = buf.readUInt32LE(16);
+
+    if (!VERSIONS.includes(version)) {
+        throw new Error(`Unsupported frame version ${version}`);
+    }
+    if (!CHANNELS[sensor]) {
+        throw new Error(`Unknown sensor type ${sensor}`);
+    }
+
+    const typecodes = [...(flags & FLAG_TICKS ? "I" : "") + CHANNELS[sensor]];
+    const varint = (flags & FLAG_VARINT) !== 0;
+    const isDelta = (i) => (deltaMask >> i & 1) === 1 && count > 0;
+    const truncated = new Error("Frame length does not match its header");
+
+    let offset = HEADER_SIZE;
+    const columns = typecodes.map((typecode, i) => {
+        const read = typecode === "H" ? (o) => buf.readUInt16LE(o) : (o) => buf.readUInt32LE(o);
+        const column = new Array(count);
+        const size = isDelta(i) ? SIZES[typecode] : SIZES[typecode] * count;
+        if (offset + size > buf.length) {
+            throw truncated;
+        }
+
+        if (isDelta(i) && varint) {
+            column[0] = read(offset);
+            offset += SIZES[typecode];
+            if (offset + 4 > buf.length) {
+                throw truncated;
+            }
+            const end = offset + 4 + buf.readUInt32LE(offset);
+            if (end > buf.length) {
+                throw truncated;
+            }
+            offset += 4;
+
+            // Zigzag varints, see zigzag_varints() in wireformat.py
+            let j = 1;
+            let z = 0;
+            let scale = 1;
+            for (; offset < end; offset++) {
+                const byte = buf[offset];
+                z += (byte & 0x7F) * scale;
+                scale *= 128;
+                if (byte < 0x80) {
+                    if (j >= count) {
+                        throw new Error("Varint column does not match the sample count");
+                    }
+                    column[j] = column[j - 1] + (z % 2 ? -(z + 1) / 2 : z / 2);
+                    j++;
+                    z = 0;
+                    scale = 1;
+                }
+            }
+            if (j !== count || scale !== 1) {
+                throw new Error("Varint column does not match the sample count");
+            }
+        } else if (isDelta(i)) {
+            if (offset + SIZES[typecode] + 2 * (count - 1) > buf.length) {
+                throw truncated;
+            }
+            column[0] = read(offset);
+            offset += SIZES[typecode];
+            for (let j = 1; j < count; j++, offset += 2) {
+                column[j] = column[j - 1] + buf.readInt16LE(offset);
+            }
+        } else {
+            for (let j = 0; j < count; j++, offset += SIZES[typecode]) {
+                column[j] = read(offset);
+            }
+        }
+        return column;
+    });
+
+    if (offset !== buf.length) {
+        throw truncated;
+    }
+
+    const ticks = flags & FLAG_TICKS ? columns.shift() : null;
+    return { version, sensor, sampleRate, count, deviceId, startTick, ticks, channels: columns };
+}